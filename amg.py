@@ -1,129 +1,427 @@
 # amg.py
+import argparse
+import asyncio
 import csv
 import requests
-from bs4 import BeautifulSoup
-import time
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
 import re
-import uuid
+import json
 import os
 import shutil
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
-def search_angry_metal_guy(album_name, artist_name):
-    """Search for album reviews on Angry Metal Guy website"""
-    # Format search query
-    search_query = f"{artist_name} {album_name}"
-    search_url = f"https://www.angrymetalguy.com/?s={search_query.replace(' ', '+')}"
+import metrics
+from amg_parsers import BACKEND_FACTORIES, DEFAULT_BACKEND, get_backend
+from dedup import duplicate_albums
+from http_cache import HTTPCache, DEFAULT_CACHE_FILE, SEARCH_TTL, REVIEW_TTL
+from matching import fold, normalize_name, strip_edition
+from ratelimit import HostRateLimiter
+from review_metadata import METADATA_FILE, open_metadata
+from reviews import album_key, read_review_file, review_fields, save_review
+from store import LibraryStore
+
+AMG_BASE_URL = "https://www.angrymetalguy.com"
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Look for rating pattern like "4.0/5.0" or similar
+RATING_PATTERN = re.compile(r'(\d\.\d)/5\.0')
+
+def create_session(pool_size=10):
+    """Create a requests session with a connection pool sized for concurrent fetches"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch_html(url, session=None, cache=None, ttl=REVIEW_TTL, limiter=None):
+    """Download a page and return its HTML, using the response cache when given one"""
+    host = urlsplit(url).netloc
     
-    # Send request
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    def get(url, headers=None):
+        # Only requests that actually go to the network count against the rate limit
+        if limiter is not None:
+            with metrics.timer('rate_limit_wait', host=host):
+                limiter.acquire(url)
+        with metrics.timer('http_request', host=host):
+            if session is None:
+                response = requests.get(url, headers={**HEADERS, **(headers or {})})
+            else:
+                response = session.get(url, headers=headers)
+        metrics.count('http_responses', host=host, status=response.status_code)
+        metrics.count('http_bytes', len(response.content), host=host)
+        return response
     
-    try:
-        response = requests.get(search_url, headers=headers)
-        response.raise_for_status()
-        
-        # Parse response
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find search results
-        search_results = soup.find_all('article', class_='post')
-        
-        for result in search_results:
-            title_element = result.find('h2', class_='entry-title')
-            if not title_element:
-                continue
-                
-            title = title_element.text.strip()
-            # Check if both artist and album name are in the title
-            if artist_name.lower() in title.lower() and album_name.lower() in title.lower():
-                link = title_element.find('a')['href']
-                return link
-        
+    metrics.count('page_fetches', host=host)
+    if cache is not None:
+        return cache.fetch(url, get, ttl)
+    response = get(url)
+    response.raise_for_status()
+    return response.text
+
+def search_url_for(album_name, artist_name):
+    """Build the Angry Metal Guy search URL for an album"""
+    # Edition notes like "(Deluxe Edition)" are not in review titles and would make the search miss
+    search_query = f"{artist_name} {strip_edition(album_name)}"
+    return f"{AMG_BASE_URL}/?s={search_query.replace(' ', '+')}"
+
+def parse_search_results(html, album_name, artist_name, backend=DEFAULT_BACKEND):
+    """Return the link of the first search result matching both artist and album"""
+    search_results, _ = get_backend(backend)
+    with metrics.timer('parse', page='search', backend=backend):
+        results = search_results(html)
+    
+    # Compare without case, accents, punctuation or edition notes
+    artist_name, album_name = normalize_name(artist_name), normalize_name(album_name)
+    for title, link in results:
+        # Check if both artist and album name are in the title
+        title = fold(title)
+        if artist_name in title and album_name in title:
+            if link is None:
+                raise ValueError(f"Search result '{title}' has no link")
+            return link
+    
+    return None
+
+def parse_review(html, backend=DEFAULT_BACKEND):
+    """Extract the review text, rating and the other review fields from the HTML of a review page.
+
+    Returns a dict with text, rating, label, release_date, year, dr, reviewer,
+    tags and categories, all from the one parse of the page.
+    """
+    _, review_parts = get_backend(backend)
+    
+    # Extract ALL text content of the review, not just paragraphs
+    # This gets text from paragraphs, blockquotes, headers, etc.
+    with metrics.timer('parse', page='review', backend=backend):
+        review_text, rating_text, details = review_parts(html)
+    review = {'text': review_text, 'rating': None, **review_fields(review_text), **details}
+    if review_text is None:
+        return review
+    
+    # Find rating
+    rating = None
+    
+    # Check in the review text
+    rating_match = RATING_PATTERN.search(review_text)
+    if rating_match:
+        rating = rating_match.group(1)
+    
+    # Check in specific rating div if exists
+    if rating_text and not rating:
+        rating_match = RATING_PATTERN.search(rating_text)
+        if rating_match:
+            rating = rating_match.group(1)
+    
+    review['rating'] = rating
+    return review
+
+def parse_review_page(html, backend=DEFAULT_BACKEND):
+    """Extract review text and rating from the HTML of a review page"""
+    review = parse_review(html, backend)
+    return review['text'], review['rating']
+
+def fetch_search_page(album_name, artist_name, session=None, cache=None, limiter=None):
+    """Return (search URL, HTML) for an album; the HTML is None if the search recently found nothing"""
+    search_url = search_url_for(album_name, artist_name)
+    if cache is not None and cache.is_negative(search_url):
+        return search_url, None
+    return search_url, fetch_html(search_url, session, cache, SEARCH_TTL, limiter)
+
+def record_search_miss(search_url, cache=None):
+    if cache is not None:
+        # Remember the miss instead of keeping the whole results page around
+        cache.set_negative(search_url)
+        cache.delete(search_url)
+
+def find_review_url(album_name, artist_name, session=None, cache=None, limiter=None, backend=DEFAULT_BACKEND):
+    """Search for an album's review URL; network errors are raised to the caller"""
+    search_url, html = fetch_search_page(album_name, artist_name, session, cache, limiter)
+    if html is None:
         return None
     
+    review_url = parse_search_results(html, album_name, artist_name, backend)
+    if review_url is None:
+        record_search_miss(search_url, cache)
+    return review_url
+
+def fetch_review_fields(review_url, session=None, cache=None, limiter=None, backend=DEFAULT_BACKEND):
+    """Download a review page and return all its fields (see parse_review); network errors are raised"""
+    return parse_review(fetch_html(review_url, session, cache, REVIEW_TTL, limiter), backend)
+
+def fetch_review(review_url, session=None, cache=None, limiter=None, backend=DEFAULT_BACKEND):
+    """Download a review page and return its text and rating; network errors are raised"""
+    review = fetch_review_fields(review_url, session, cache, limiter, backend)
+    return review['text'], review['rating']
+
+def search_angry_metal_guy(album_name, artist_name, session=None, cache=None):
+    """Search for album reviews on Angry Metal Guy website"""
+    try:
+        return find_review_url(album_name, artist_name, session, cache)
+    
     except Exception as e:
         print(f"Error searching for {artist_name} - {album_name}: {e}")
         return None
 
-def extract_review_and_rating(review_url):
+def extract_review_and_rating(review_url, session=None, cache=None):
     """Extract review text and rating from a review page"""
     if not review_url:
         return None, None
-        
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
     
     try:
-        response = requests.get(review_url, headers=headers)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find review content
-        review_content = soup.find('div', class_='entry-content')
-        if not review_content:
-            return None, None
-            
-        # Extract ALL text content, not just paragraphs
-        # This gets text from paragraphs, blockquotes, headers, etc.
-        review_text = review_content.get_text(separator="\n\n", strip=True)
-        
-        # Find rating
-        rating = None
-        # Look for rating pattern like "4.0/5.0" or similar
-        rating_pattern = re.compile(r'(\d\.\d)/5\.0')
-        
-        # Check in the review text
-        rating_match = rating_pattern.search(review_text)
-        if rating_match:
-            rating = rating_match.group(1)
-        
-        # Check in specific rating div if exists
-        rating_div = soup.find('div', class_='rating')
-        if rating_div and not rating:
-            rating_text = rating_div.text.strip()
-            rating_match = rating_pattern.search(rating_text)
-            if rating_match:
-                rating = rating_match.group(1)
-        
-        return review_text, rating
+        return fetch_review(review_url, session, cache)
         
     except Exception as e:
         print(f"Error extracting review from {review_url}: {e}")
         return None, None
 
-def main():
-    # Create a directory for review texts
-    reviews_folder = "album_reviews"
-    if os.path.exists(reviews_folder):
-        shutil.rmtree(reviews_folder)  # Remove if exists to start fresh
-    os.makedirs(reviews_folder)
+def create_parse_pool(workers):
+    """Process pool for parsing pages on several cores, started fresh rather than forked from a threaded process"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def crawl_record(album, status, review_url=None, rating=None):
+    """Build the crawl state entry for one album lookup"""
+    return {
+        'AlbumID': album['AlbumID'],
+        'Artist': album['Artist'],
+        'Album': album['Album'],
+        'status': status,  # found, not_found, no_text or error
+        'review_url': review_url,
+        'rating': rating,
+        'searched_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+def load_crawl_state(state_file):
+    """Load the crawl state log; later entries for an album replace earlier ones"""
+    state = {}
+    if not os.path.exists(state_file):
+        return state
+    with open(state_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Partial last line from a crashed run
+            state[record['AlbumID']] = record
+    return state
+
+def append_crawl_state(state_file, state, record):
+    """Record an album lookup immediately so an interrupted run can resume"""
+    state[record['AlbumID']] = record
+    metrics.count('albums_crawled', status=record['status'])
+    with metrics.timer('file_write', kind='crawl_state', target='file'):
+        with open(state_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+def compact_crawl_state(state_file, state):
+    """Rewrite the state log with one entry per album"""
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        for record in state.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_file, state_file)
+
+def copy_duplicate_reviews(albums, duplicates, reviews_folder, state_file, state, store=None):
+    """Give every other edition of an album the lookup result of its canonical album.
+
+    `duplicates` maps album IDs to their canonical album ID, from
+    dedup.duplicate_albums. Members whose canonical wasn't looked up yet, or
+    failed, are left for the next run.
+    """
+    copied = 0
+    for album in albums:
+        canonical_id = duplicates.get(album['AlbumID'])
+        canonical = state.get(canonical_id)
+        if canonical is None or canonical['status'] == 'error':
+            continue
+        record = state.get(album['AlbumID'])
+        if (record and record.get('duplicate_of') == canonical_id and record['status'] == canonical['status']
+                and record['review_url'] == canonical['review_url']
+                and (record['status'] != 'found' or not needs_crawl(album, state, reviews_folder, 0, store))):
+            continue  # Already copied
+        if canonical['status'] == 'found':
+            if store is not None:
+                review = store.get_review(canonical_id)
+                text = review['text'] if review else None
+            else:
+                path = os.path.join(reviews_folder, f"{canonical_id}.txt")
+                text = read_review_file(path)[1] if os.path.exists(path) else None
+            if text is None:
+                continue
+            metadata = open_metadata(store.path if store is not None else os.path.join(reviews_folder, METADATA_FILE))
+            row = metadata.get(canonical_id)
+            fields = None
+            if row:
+                fields = {**row, 'categories': row['categories'].split(', ') if row['categories'] else [],
+                          'tags': row['tags'].split(', ') if row['tags'] else []}
+            save_review(reviews_folder, album, canonical['review_url'], text, store, fields)
+        record = crawl_record(album, canonical['status'], canonical['review_url'], canonical['rating'])
+        record['duplicate_of'] = canonical_id
+        append_crawl_state(state_file, state, record)
+        album['AMG_Rating'] = canonical['rating'] or ""
+        copied += 1
+    metrics.count('dedup_copies', copied, kind='review')
+    return copied
+
+def needs_crawl(album, state, reviews_folder, max_age_days, store=None):
+    """Decide whether an album has to be looked up again in incremental mode"""
+    record = state.get(album['AlbumID'])
+    if not record or record['status'] == 'error':
+        return True
+    if record['status'] == 'found':
+        # Found reviews don't change; only refetch if the file went missing
+        if store is not None:
+            return not store.has_review(album['AlbumID'])
+        return not os.path.exists(os.path.join(reviews_folder, f"{album['AlbumID']}.txt"))
+    searched_at = datetime.fromisoformat(record['searched_at'])
+    return datetime.now() - searched_at > timedelta(days=max_age_days)
+
+async def crawl_albums(albums, reviews_folder, state_file, state, concurrency=8, rate=1.0, burst=2,
+                       cache=None, backend=DEFAULT_BACKEND, store=None, parse_workers=0):
+    """Crawl reviews for all albums concurrently.
+
+    At most `concurrency` albums are in flight at once over a single pooled
+    session, and every request to angrymetalguy.com first takes a token from a
+    per-host bucket refilled at `rate` requests per second. Pages served from
+    the response cache don't use up tokens.
+
+    The fetch threads only download HTML. With `parse_workers`, pages are
+    parsed in a pool of that many processes, so parsing isn't held back by the
+    GIL; otherwise they are parsed in the fetch threads.
+    """
+    loop = asyncio.get_running_loop()
+    limiter = HostRateLimiter(rate, burst)
+    semaphore = asyncio.Semaphore(concurrency)
+    session = create_session(pool_size=concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    parse_executor = create_parse_pool(parse_workers) if parse_workers else executor
+    total_albums = len(albums)
+    done = 0
     
-    # Read the existing CSV file
-    input_csv = 'tidal_favorite_albums.csv'
-    albums = []
+    async def crawl_one(album):
+        nonlocal done
+        artist_name = album['Artist']
+        album_name = album['Album']
+        review_url, review = None, None
+        failed = False
+        
+        async with semaphore:
+            try:
+                search_url, html = await loop.run_in_executor(
+                    executor, fetch_search_page, album_name, artist_name, session, cache, limiter)
+                if html is not None:
+                    review_url = await loop.run_in_executor(
+                        parse_executor, parse_search_results, html, album_name, artist_name, backend)
+                    if review_url is None:
+                        record_search_miss(search_url, cache)
+                
+                if review_url:
+                    html = await loop.run_in_executor(
+                        executor, fetch_html, review_url, session, cache, REVIEW_TTL, limiter)
+                    review = await loop.run_in_executor(parse_executor, parse_review, html, backend)
+            except Exception as e:
+                print(f"Error looking up {artist_name} - {album_name}: {e}")
+                failed = True
+        
+        done += 1
+        prefix = f"[{done}/{total_albums}] {artist_name} - {album_name} (ID: {album['AlbumID']})"
+        if failed:
+            print(f"{prefix}: failed, will retry on the next run")
+            append_crawl_state(state_file, state, crawl_record(album, 'error', review_url))
+        elif not review_url:
+            print(f"{prefix}: no review found")
+            append_crawl_state(state_file, state, crawl_record(album, 'not_found'))
+        elif not review['text']:
+            print(f"{prefix}: could not extract review from {review_url}")
+            append_crawl_state(state_file, state, crawl_record(album, 'no_text', review_url))
+        else:
+            rating = review['rating']
+            review_filename = save_review(reviews_folder, album, review_url, review['text'], store, review)
+            if rating:
+                album['AMG_Rating'] = rating
+            append_crawl_state(state_file, state, crawl_record(album, 'found', review_url, rating))
+            print(f"{prefix}: saved to {review_filename} (rating: {rating or 'not found'})")
     
     try:
-        with open(input_csv, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            fieldnames = reader.fieldnames
-            
-            for row in reader:
-                # Generate a random ID for each album
-                album_id = str(uuid.uuid4())[:8]  # Use first 8 chars of UUID for brevity
-                row['AlbumID'] = album_id
-                row['AMG_Rating'] = ""  # Add empty AMG_Rating field
-                albums.append(row)
-    except Exception as e:
-        print(f"Error reading CSV file '{input_csv}': {e}")
-        return
+        await asyncio.gather(*(crawl_one(album) for album in albums))
+    finally:
+        executor.shutdown(wait=False)
+        if parse_executor is not executor:
+            parse_executor.shutdown()
+        session.close()
 
-    print(f"Loaded {len(albums)} albums from {input_csv}")
+def reparse_cached(albums, reviews_folder, state_file, state, cache, workers=None, backend=DEFAULT_BACKEND,
+                   store=None):
+    """Look albums up again from the pages in the response cache, without any network access.
+
+    Review URLs come from the crawl state or from cached search pages, and the
+    cached review pages are parsed in a pool of `workers` processes (default:
+    one per core) whether or not they are past their TTL. Albums whose pages
+    aren't cached are left as they are.
+    """
+    searches = []
+    lookups = []
+    skipped = 0
+    for album in albums:
+        record = state.get(album['AlbumID'])
+        if record and record['review_url']:
+            lookups.append((album, record['review_url']))
+            continue
+        entry = cache.get(search_url_for(album['Album'], album['Artist']))
+        if entry is None:
+            skipped += 1
+        else:
+            searches.append((album, entry['body']))
     
-    # Process ALL albums
+    with create_parse_pool(workers) as pool:
+        review_urls = pool.map(parse_search_results, [html for _, html in searches],
+                               [album['Album'] for album, _ in searches],
+                               [album['Artist'] for album, _ in searches],
+                               [backend] * len(searches), chunksize=8)
+        for (album, _), review_url in zip(searches, review_urls):
+            if review_url is None:
+                print(f"{album['Artist']} - {album['Album']} (ID: {album['AlbumID']}): no review found")
+                append_crawl_state(state_file, state, crawl_record(album, 'not_found'))
+            else:
+                lookups.append((album, review_url))
+        
+        pages = []
+        for album, review_url in lookups:
+            entry = cache.get(review_url)
+            if entry is None:
+                skipped += 1
+            else:
+                pages.append((album, review_url, entry['body']))
+        results = pool.map(parse_review, [html for _, _, html in pages], [backend] * len(pages), chunksize=8)
+        for (album, review_url, _), review in zip(pages, results):
+            prefix = f"{album['Artist']} - {album['Album']} (ID: {album['AlbumID']})"
+            if not review['text']:
+                print(f"{prefix}: could not extract review from {review_url}")
+                append_crawl_state(state_file, state, crawl_record(album, 'no_text', review_url))
+                continue
+            rating = review['rating']
+            review_filename = save_review(reviews_folder, album, review_url, review['text'], store, review)
+            if rating:
+                album['AMG_Rating'] = rating
+            append_crawl_state(state_file, state, crawl_record(album, 'found', review_url, rating))
+            print(f"{prefix}: saved to {review_filename} (rating: {rating or 'not found'})")
+    print(f"Re-parsed {len(pages)} review pages; {skipped} albums have no cached pages")
+
+def crawl_albums_serially(albums, reviews_folder, state_file, state, cache=None, backend=DEFAULT_BACKEND,
+                          store=None):
+    """Crawl reviews one album at a time, at one request per second"""
     total_albums = len(albums)
+    # A search and a review page take 2 seconds per album, the pace of the old 2-second
+    # sleep after every album; cached pages don't wait
+    limiter = HostRateLimiter(rate=1.0)
     for i, album in enumerate(albums):
         artist_name = album['Artist']
         album_name = album['Album']
@@ -131,24 +429,26 @@ def main():
         
         print(f"\n[{i+1}/{total_albums}] Searching for review: {artist_name} - {album_name} (ID: {album_id})")
         
-        # Search for review
-        review_url = search_angry_metal_guy(album_name, artist_name)
+        try:
+            # Search for review
+            review_url = find_review_url(album_name, artist_name, cache=cache, limiter=limiter, backend=backend)
+            
+            review = {'text': None, 'rating': None}
+            if review_url:
+                print(f"Found review at: {review_url}")
+                
+                # Extract review, rating and the other review fields
+                review = fetch_review_fields(review_url, cache=cache, limiter=limiter, backend=backend)
+            review_text, rating = review['text'], review['rating']
+        except Exception as e:
+            print(f"Error looking up {artist_name} - {album_name}: {e}")
+            append_crawl_state(state_file, state, crawl_record(album, 'error'))
+            continue
         
         if review_url:
-            print(f"Found review at: {review_url}")
-            
-            # Extract review and rating
-            review_text, rating = extract_review_and_rating(review_url)
-            
             if review_text:
                 # Save review text to file
-                review_filename = os.path.join(reviews_folder, f"{album_id}.txt")
-                with open(review_filename, 'w', encoding='utf-8') as f:
-                    f.write(f"Artist: {artist_name}\n")
-                    f.write(f"Album: {album_name}\n")
-                    f.write(f"Album ID: {album_id}\n")  # Include UUID in the review file
-                    f.write(f"Review URL: {review_url}\n\n")
-                    f.write(review_text)
+                review_filename = save_review(reviews_folder, album, review_url, review_text, store, review)
                 
                 print(f"Review saved to: {review_filename}")
                 
@@ -159,13 +459,139 @@ def main():
                 else:
                     print(f"Review excerpt: {review_text[:200]}...")
                     print("Rating: Not found")
+                append_crawl_state(state_file, state, crawl_record(album, 'found', review_url, rating))
             else:
                 print("Could not extract review or rating")
+                append_crawl_state(state_file, state, crawl_record(album, 'no_text', review_url))
         else:
             print(f"No review found for {artist_name} - {album_name}")
-        
-        # Sleep to avoid overloading the server
-        time.sleep(2)
+            append_crawl_state(state_file, state, crawl_record(album, 'not_found'))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch Angry Metal Guy reviews for Tidal favorites")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Crawl albums concurrently instead of one at a time")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="Maximum albums in flight in async mode (default: 8)")
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help="Requests per second allowed to angrymetalguy.com in async and catalog mode (default: 1.0)")
+    parser.add_argument('--burst', type=int, default=2,
+                        help="Requests allowed in a burst in async mode (default: 2)")
+    parser.add_argument('--parse-workers', type=int, default=0,
+                        help="Processes parsing pages in async mode (default: 0, parse in the fetch threads)")
+    parser.add_argument('--reparse', action='store_true',
+                        help="Parse the pages in the response cache again instead of crawling; "
+                             "nothing is downloaded")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="Look up every edition of an album separately instead of copying the review "
+                             "of one edition to the others")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Keep existing reviews and only look up new or stale albums")
+    parser.add_argument('--max-age-days', type=int, default=30,
+                        help="Re-search albums without a review after this many days (default: 30)")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE,
+                        help=f"Response cache file (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always download pages instead of using the response cache")
+    parser.add_argument('--cache-max-mb', type=int, default=500,
+                        help="Maximum size of cached pages in MB (default: 500)")
+    parser.add_argument('--store', metavar='FILE',
+                        help="Save reviews and ratings in this library store (see store.py) instead of text files")
+    parser.add_argument('--catalog', nargs='?', const='amg_catalog.sqlite', metavar='FILE',
+                        help="Sync the review catalog through the WordPress REST API (default file: "
+                             "amg_catalog.sqlite) and look albums up in it instead of searching the site")
+    parser.add_argument('--parser', default=DEFAULT_BACKEND, choices=sorted(BACKEND_FACTORIES),
+                        help=f"HTML parser backend (default: {DEFAULT_BACKEND}); see bench_parsers.py")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
+    
+    # Create a directory for review texts
+    reviews_folder = "album_reviews"
+    if os.path.exists(reviews_folder) and not (args.incremental or args.reparse):
+        shutil.rmtree(reviews_folder)  # Remove if exists to start fresh
+    os.makedirs(reviews_folder, exist_ok=True)
+    
+    # Record of every lookup: what was searched, whether a review was found, and when
+    state_file = os.path.join(reviews_folder, 'crawl_state.jsonl')
+    state = load_crawl_state(state_file)
+    
+    store = LibraryStore(args.store) if args.store else None
+    
+    # Read the existing CSV file
+    input_csv = 'tidal_favorite_albums.csv'
+    albums = []
+    
+    try:
+        with open(input_csv, 'r', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            fieldnames = reader.fieldnames
+            
+            for row in reader:
+                # Derive the ID from artist and album so it is the same on every run
+                album_id = album_key(row['Artist'], row['Album'])
+                row['AlbumID'] = album_id
+                row['AMG_Rating'] = ""  # Add empty AMG_Rating field
+                if album_id in state and state[album_id]['rating']:
+                    row['AMG_Rating'] = state[album_id]['rating']
+                albums.append(row)
+    except Exception as e:
+        print(f"Error reading CSV file '{input_csv}': {e}")
+        return
+
+    print(f"Loaded {len(albums)} albums from {input_csv}")
+    if args.reparse and args.no_cache:
+        print("--reparse needs the response cache")
+        return
+    
+    # Process ALL albums, or only new and stale ones in incremental mode; re-parsing is cheap, so it does all
+    total_albums = len(albums)
+    pending = albums
+    if args.incremental and not args.reparse:
+        pending = [album for album in albums
+                   if needs_crawl(album, state, reviews_folder, args.max_age_days, store)]
+        print(f"{total_albums - len(pending)} albums are up to date, {len(pending)} to look up")
+    
+    # Deluxe, remastered and anniversary editions only get looked up once
+    duplicates = {} if args.no_dedup else duplicate_albums(albums)
+    if duplicates:
+        pending = [album for album in pending if album['AlbumID'] not in duplicates]
+        print(f"{len(duplicates)} albums are other editions of a favorite and share its review")
+    
+    cache = None
+    if not args.no_cache:
+        cache = HTTPCache(args.cache, max_bytes=args.cache_max_mb * 1024 * 1024)
+    
+    try:
+        if args.reparse:
+            print(f"Re-parsing cached pages with {args.parse_workers or os.cpu_count()} processes")
+            reparse_cached(pending, reviews_folder, state_file, state, cache, args.parse_workers or None,
+                           args.parser, store)
+        elif args.catalog:
+            from amg_catalog import Catalog, crawl_from_catalog, sync_catalog
+            catalog = Catalog(args.catalog)
+            print(f"Syncing the review catalog in {args.catalog}...")
+            session = create_session(pool_size=1)
+            limiter = HostRateLimiter(args.rate, args.burst)
+            stored, _ = sync_catalog(catalog, session, limiter=limiter, backend=args.parser)
+            print(f"{stored} new or changed reviews, {catalog.count()} in the catalog")
+            crawl_from_catalog(pending, reviews_folder, state_file, state, catalog, store,
+                               session, cache, limiter, args.parser)
+            catalog.close()
+        elif args.use_async:
+            print(f"Crawling with {args.concurrency} concurrent albums at {args.rate} requests/sec")
+            asyncio.run(crawl_albums(pending, reviews_folder, state_file, state, args.concurrency, args.rate,
+                                     args.burst, cache, args.parser, store, args.parse_workers))
+        else:
+            crawl_albums_serially(pending, reviews_folder, state_file, state, cache, args.parser, store)
+        copy_duplicate_reviews(albums, duplicates, reviews_folder, state_file, state, store)
+    finally:
+        compact_crawl_state(state_file, state)
+        if cache is not None:
+            cache.close()
     
     # Save updated CSV with AlbumID and AMG_Rating
     output_csv = 'tidal_favorite_albums_with_ratings.csv'
@@ -179,8 +605,13 @@ def main():
         writer.writerows(albums)
     
     print(f"\nUpdated CSV saved to {output_csv}")
-    print(f"Review texts saved to {reviews_folder}/ directory")
-    print(f"Processed {total_albums} albums in total")
+    if store is not None:
+        store.upsert_albums(albums)
+        store.close()
+        print(f"Albums, ratings and reviews saved to {args.store}")
+    else:
+        print(f"Review texts saved to {reviews_folder}/ directory")
+    print(f"Processed {len(pending)} of {total_albums} albums")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,278 @@
+# amg_catalog.py
+"""Local catalog of Angry Metal Guy reviews, synced through the WordPress REST API.
+
+Looking an album up on the site costs two full HTML pages (a ?s= search and
+the review). The site runs WordPress, so instead `sync` pages through
+/wp-json/wp/v2/posts, 100 posts per request with `_fields` trimmed to what is
+needed, and keeps every review's title, URL, text and rating in
+amg_catalog.sqlite. Albums are then resolved against the catalog without any
+request, using the fuzzy title index in matching.py: confident matches are
+taken as they are, and only albums with an uncertain best match are searched
+for on the site. Posts are fetched oldest change first, so an interrupted sync picks
+up where it stopped, and later syncs only ask for posts modified after the
+newest one in the catalog (`modified_after`). `sync --full` fetches
+everything again and drops posts that were deleted on the site.
+
+    python amg_catalog.py sync
+    python amg_catalog.py lookup "Artist" "Album"
+    python amg.py --catalog
+"""
+import argparse
+import html
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import amg
+import metrics
+from amg_parsers import BACKEND_FACTORIES, DEFAULT_BACKEND
+from matching import TitleIndex
+from ratelimit import HostRateLimiter
+from reviews import review_fields, save_review
+
+DEFAULT_CATALOG_FILE = 'amg_catalog.sqlite'
+POSTS_PATH = '/wp-json/wp/v2/posts'
+POST_FIELDS = 'id,link,modified,title,content'
+PER_PAGE = 100  # The most WordPress returns per request
+
+# Review posts are titled "Artist – Album Review"
+TITLE_PATTERN = re.compile(r'^(?P<artist>.+?)\s+[–—-]\s+(?P<album>.+?)\s+Review\s*$', re.I)
+
+class Catalog:
+    """SQLite table of review posts; albums are matched against it with match_index"""
+
+    def __init__(self, path=DEFAULT_CATALOG_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                link TEXT NOT NULL,
+                text BLOB,
+                rating TEXT,
+                modified TEXT NOT NULL
+            );
+        """)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def put_posts(self, posts):
+        """Insert or replace posts given as dicts with id, title, link, text, rating and modified"""
+        values = [(post['id'], post['title'], post['link'],
+                   zlib.compress(post['text'].encode('utf-8')) if post['text'] else None,
+                   post['rating'], post['modified']) for post in posts]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO posts (id, title, link, text, rating, modified) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", values)
+            self.conn.commit()
+        return len(values)
+
+    def retain(self, post_ids):
+        """Delete every post not in `post_ids`; returns how many were deleted"""
+        with self.lock:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen (id INTEGER PRIMARY KEY)")
+            self.conn.execute("DELETE FROM seen")
+            self.conn.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((post_id,) for post_id in post_ids))
+            deleted = self.conn.execute("DELETE FROM posts WHERE id NOT IN (SELECT id FROM seen)").rowcount
+            self.conn.commit()
+        return deleted
+
+    def last_modified(self):
+        """Modification time of the newest post, or None for an empty catalog"""
+        with self.lock:
+            return self.conn.execute("SELECT MAX(modified) FROM posts").fetchone()[0]
+
+    def modified_times(self):
+        """Post ID -> modification time of every post"""
+        with self.lock:
+            return dict(self.conn.execute("SELECT id, modified FROM posts"))
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def _entry(self, where, params):
+        with self.lock:
+            row = self.conn.execute(f"SELECT id, title, link, text, rating, modified FROM posts WHERE {where} "
+                                    "ORDER BY modified DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        post_id, title, link, text, rating, modified = row
+        return {'id': post_id, 'title': title, 'link': link, 'rating': rating, 'modified': modified,
+                'text': zlib.decompress(text).decode('utf-8') if text else None}
+
+    def get(self, post_id):
+        return self._entry("id = ?", (post_id,))
+
+    def get_by_link(self, link):
+        return self._entry("link = ?", (link,))
+
+    def match_index(self):
+        """Fuzzy index over the artist and album names of the review titles, keyed by post ID"""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, title FROM posts").fetchall()
+        entries = []
+        for post_id, title in rows:
+            match = TITLE_PATTERN.match(title)
+            if match:
+                entries.append((post_id, match.group('artist'), match.group('album')))
+        return TitleIndex(entries)
+
+def parse_post(post, backend=DEFAULT_BACKEND):
+    """Catalog entry for a post from the REST API: the rendered content goes through the review page parser"""
+    content = (post.get('content') or {}).get('rendered', '')
+    text, rating = amg.parse_review_page(f'<div class="entry-content">{content}</div>', backend)
+    return {
+        'id': post['id'],
+        'title': html.unescape((post.get('title') or {}).get('rendered', '')),
+        'link': post['link'],
+        'text': text,
+        'rating': rating,
+        'modified': post['modified'],
+    }
+
+def fetch_posts_page(session, url, params, limiter=None):
+    """One page of posts and the total page count, or (None, 0) past the last page"""
+    host = urlsplit(url).netloc
+    if limiter is not None:
+        with metrics.timer('rate_limit_wait', host=host):
+            limiter.acquire(url)
+    with metrics.timer('http_request', host=host):
+        response = session.get(url, params=params)
+    metrics.count('http_responses', host=host, status=response.status_code)
+    if response.status_code == 400 and 'rest_post_invalid_page_number' in response.text:
+        return None, 0
+    response.raise_for_status()
+    return response.json(), int(response.headers.get('X-WP-TotalPages', 1))
+
+def sync_catalog(catalog, session=None, base_url=None, per_page=PER_PAGE, full=False, limiter=None,
+                 backend=DEFAULT_BACKEND):
+    """Fetch new and changed review posts into the catalog; returns (posts stored, posts deleted)"""
+    session = session or amg.create_session(pool_size=1)
+    url = (base_url or amg.AMG_BASE_URL) + POSTS_PATH
+    params = {'per_page': per_page, '_fields': POST_FIELDS, 'orderby': 'modified', 'order': 'asc'}
+    since = None if full else catalog.last_modified()
+    if since:
+        # A second of overlap: posts sharing the newest timestamp may not all have been stored yet
+        params['modified_after'] = (datetime.fromisoformat(since) - timedelta(seconds=1)).isoformat()
+
+    stored = 0
+    seen = []
+    page = 1
+    total_pages = 1
+    while page <= total_pages:
+        posts, total_pages = fetch_posts_page(session, url, {**params, 'page': page}, limiter)
+        if not posts:
+            break
+        entries = [parse_post(post, backend) for post in posts]
+        # Stored page by page, so an interrupted sync resumes from the newest post it got
+        stored += catalog.put_posts(entries)
+        seen.extend(entry['id'] for entry in entries)
+        metrics.count('catalog_posts', len(entries))
+        print(f"Page {page}/{total_pages}: {stored} posts")
+        page += 1
+
+    deleted = catalog.retain(seen) if full else 0
+    return stored, deleted
+
+def lookup_on_site(album, catalog, session, cache, limiter, backend):
+    """Search the site for an album the catalog can't settle; the review itself usually comes from the catalog"""
+    review_url = amg.find_review_url(album['Album'], album['Artist'], session, cache, limiter, backend)
+    if review_url is None:
+        return None
+    entry = catalog.get_by_link(review_url)
+    if entry is None:
+        review = amg.fetch_review_fields(review_url, session, cache, limiter, backend)
+        entry = {'link': review_url, 'fields': review, **review}
+    return entry
+
+def crawl_from_catalog(albums, reviews_folder, state_file, state, catalog, store=None, session=None, cache=None,
+                       limiter=None, backend=DEFAULT_BACKEND):
+    """Resolve every album against the catalog and save the reviews found, like amg.crawl_albums.
+
+    Only albums whose best match is uncertain cost requests to the site.
+    """
+    index = catalog.match_index()
+    session = session or amg.create_session(pool_size=1)
+    total_albums = len(albums)
+    for i, album in enumerate(albums):
+        prefix = f"[{i+1}/{total_albums}] {album['Artist']} - {album['Album']} (ID: {album['AlbumID']})"
+        with metrics.timer('catalog_match'):
+            result, post_id, _ = index.resolve(album['Artist'], album['Album'])
+        metrics.count('catalog_matches', result=result)
+        entry = None
+        if result == 'match':
+            entry = catalog.get(post_id)
+        elif result == 'ambiguous':
+            try:
+                entry = lookup_on_site(album, catalog, session, cache, limiter, backend)
+            except Exception as e:
+                print(f"{prefix}: failed, will retry on the next run ({e})")
+                amg.append_crawl_state(state_file, state, amg.crawl_record(album, 'error'))
+                continue
+
+        if entry is None:
+            print(f"{prefix}: no review found")
+            amg.append_crawl_state(state_file, state, amg.crawl_record(album, 'not_found'))
+        elif not entry['text']:
+            print(f"{prefix}: could not extract review from {entry['link']}")
+            amg.append_crawl_state(state_file, state, amg.crawl_record(album, 'no_text', entry['link']))
+        else:
+            # Catalog posts carry the review text only, so the fields come from its facts box
+            fields = entry.get('fields') or {**review_fields(entry['text']), 'rating': entry['rating']}
+            review_filename = save_review(reviews_folder, album, entry['link'], entry['text'], store, fields)
+            if entry['rating']:
+                album['AMG_Rating'] = entry['rating']
+            amg.append_crawl_state(state_file, state,
+                                   amg.crawl_record(album, 'found', entry['link'], entry['rating']))
+            print(f"{prefix}: saved to {review_filename} (rating: {entry['rating'] or 'not found'})")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync and query a local catalog of Angry Metal Guy reviews")
+    parser.add_argument('--catalog', default=DEFAULT_CATALOG_FILE,
+                        help=f"Catalog file (default: {DEFAULT_CATALOG_FILE})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync_parser = subparsers.add_parser('sync', help="Fetch new and changed reviews from the site")
+    sync_parser.add_argument('--full', action='store_true',
+                             help="Fetch every post again and drop the ones deleted on the site")
+    sync_parser.add_argument('--per-page', type=int, default=PER_PAGE,
+                             help=f"Posts per request (default: {PER_PAGE}, the most WordPress allows)")
+    sync_parser.add_argument('--rate', type=float, default=1.0, help="Requests per second (default: 1.0)")
+    sync_parser.add_argument('--parser', default=DEFAULT_BACKEND, choices=sorted(BACKEND_FACTORIES),
+                             help=f"HTML parser backend (default: {DEFAULT_BACKEND})")
+    lookup_parser = subparsers.add_parser('lookup', help="Find the reviews in the catalog closest to an album")
+    lookup_parser.add_argument('artist')
+    lookup_parser.add_argument('album')
+    subparsers.add_parser('stats', help="Show what the catalog holds")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    catalog = Catalog(args.catalog)
+    if args.command == 'sync':
+        start = time.perf_counter()
+        stored, deleted = sync_catalog(catalog, full=args.full, per_page=args.per_page,
+                                       limiter=HostRateLimiter(args.rate), backend=args.parser)
+        print(f"Stored {stored} posts" + (f", deleted {deleted}" if deleted else "")
+              + f" ({time.perf_counter() - start:.1f}s)")
+    elif args.command == 'lookup':
+        index = catalog.match_index()
+        result, _, _ = index.resolve(args.artist, args.album)
+        print(f"{args.artist} - {args.album}: {result}")
+        for score, post_id in index.candidates(args.artist, args.album):
+            entry = catalog.get(post_id)
+            print(f"{score:.2f}  {entry['title']}  {entry['link']}  (rating: {entry['rating'] or 'not found'})")
+    print(f"{args.catalog}: {catalog.count()} posts, newest modified {catalog.last_modified() or 'never'}")
+    catalog.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# amg_parsers.py
+"""HTML parser backends for Angry Metal Guy pages.
+
+Each backend only pulls the raw pieces out of a page; the matching and rating
+logic lives in amg.py so every backend produces the same results:
+
+- search_results(html) -> list of (title text, link href) for each
+  `article.post` that has an `h2.entry-title`
+- review_parts(html) -> (text of `div.entry-content` joined with blank lines,
+  text of `div.rating`, page details), the first two of which may be None.
+  The details are the `reviewer` (the `rel="author"` link) and the `tags`
+  and `categories` (`rel="tag"` and `rel="category tag"` links) of the
+  article around the review.
+"""
+from bs4 import BeautifulSoup, SoupStrainer
+
+DEFAULT_BACKEND = 'html.parser'
+
+# Strings inside these tags are not part of get_text() output in BeautifulSoup
+NON_TEXT_TAGS = {'script', 'style', 'template'}
+
+def _has_class(*names):
+    """Class matcher for SoupStrainer.
+
+    While the page is being parsed the class attribute can still be the raw
+    string ("post type-post"), so a plain class_='post' would miss elements
+    with several classes.
+    """
+    def match(value):
+        if not value:
+            return False
+        classes = value.split() if isinstance(value, str) else value
+        return any(name in classes for name in names)
+    return match
+
+SEARCH_STRAINER = SoupStrainer('article', class_=_has_class('post'))
+# The whole article, for the author and tag links around the review text
+REVIEW_STRAINER = SoupStrainer(['article', 'div'], class_=_has_class('post', 'entry-content', 'rating'))
+
+def _soup_search_results(soup):
+    results = []
+    for result in soup.find_all('article', class_='post'):
+        title_element = result.find('h2', class_='entry-title')
+        if not title_element:
+            continue
+        link = title_element.find('a')
+        results.append((title_element.text.strip(), link['href'] if link else None))
+    return results
+
+def _details(links, author):
+    """Page details from (text, rel values) of the article's tag links and the author's name"""
+    return {'reviewer': author or None,
+            'tags': [text for text, rel in links if 'category' not in rel],
+            'categories': [text for text, rel in links if 'category' in rel]}
+
+def _soup_review_parts(soup):
+    review_content = soup.find('div', class_='entry-content')
+    if not review_content:
+        return None, None, _details([], None)
+    review_text = review_content.get_text(separator="\n\n", strip=True)
+    rating_div = soup.find('div', class_='rating')
+    article = review_content.find_parent('article')
+    links, author = [], None
+    if article is not None:
+        links = [(link.get_text(strip=True), link.get('rel')) for link in article.find_all('a', rel='tag')]
+        author_link = article.find('a', rel='author')
+        author = author_link.get_text(strip=True) if author_link else None
+    return review_text, rating_div.text.strip() if rating_div else None, _details(links, author)
+
+def make_soup_backend(features, partial=False):
+    """BeautifulSoup backend; `partial` only builds the elements the extractors use"""
+    def search_results(html):
+        strainer = SEARCH_STRAINER if partial else None
+        return _soup_search_results(BeautifulSoup(html, features, parse_only=strainer))
+
+    def review_parts(html):
+        strainer = REVIEW_STRAINER if partial else None
+        return _soup_review_parts(BeautifulSoup(html, features, parse_only=strainer))
+
+    return search_results, review_parts
+
+def make_selectolax_backend():
+    """selectolax (Lexbor) backend, the fastest option when installed"""
+    from selectolax.lexbor import LexborHTMLParser
+
+    def node_strings(node):
+        # Mirror BeautifulSoup's get_text(): visible text nodes, comments excluded
+        for child in node.traverse(include_text=True):
+            if child.tag != '-text':
+                continue
+            parent = child.parent
+            if parent is not None and parent.tag in NON_TEXT_TAGS:
+                continue
+            yield child.text_content
+
+    def search_results(html):
+        results = []
+        for result in LexborHTMLParser(html).css('article.post'):
+            title_element = result.css_first('h2.entry-title')
+            if title_element is None:
+                continue
+            link = title_element.css_first('a')
+            title = ''.join(node_strings(title_element)).strip()
+            results.append((title, link.attributes.get('href') if link is not None else None))
+        return results
+
+    def node_text(node):
+        return ''.join(text.strip() for text in node_strings(node))
+
+    def review_parts(html):
+        tree = LexborHTMLParser(html)
+        review_content = tree.css_first('div.entry-content')
+        if review_content is None:
+            return None, None, _details([], None)
+        strings = (text.strip() for text in node_strings(review_content))
+        review_text = "\n\n".join(text for text in strings if text)
+        rating_div = tree.css_first('div.rating')
+        rating_text = ''.join(node_strings(rating_div)).strip() if rating_div is not None else None
+        article = review_content.parent
+        while article is not None and article.tag != 'article':
+            article = article.parent
+        links, author = [], None
+        if article is not None:
+            links = [(node_text(link), link.attributes.get('rel', '').split())
+                     for link in article.css('a[rel~="tag"]')]
+            author_link = article.css_first('a[rel~="author"]')
+            author = node_text(author_link) if author_link is not None else None
+        return review_text, rating_text, _details(links, author)
+
+    return search_results, review_parts
+
+BACKEND_FACTORIES = {
+    'html.parser': lambda: make_soup_backend('html.parser'),
+    'strainer': lambda: make_soup_backend('html.parser', partial=True),
+    'lxml': lambda: make_soup_backend('lxml'),
+    'lxml-strainer': lambda: make_soup_backend('lxml', partial=True),
+    'selectolax': make_selectolax_backend,
+}
+
+_backends = {}
+
+def get_backend(name=DEFAULT_BACKEND):
+    """Return the (search_results, review_parts) functions for a backend name"""
+    if name not in _backends:
+        if name not in BACKEND_FACTORIES:
+            raise ValueError(f"Unknown parser backend '{name}', choose from: {', '.join(BACKEND_FACTORIES)}")
+        _backends[name] = BACKEND_FACTORIES[name]()
+    return _backends[name]
+
+def available_backends():
+    """Names of the backends whose optional dependencies are installed"""
+    names = []
+    for name in BACKEND_FACTORIES:
+        try:
+            search_results, _ = get_backend(name)
+            search_results('<html></html>')
+        except Exception:
+            continue
+        names.append(name)
+    return names
@@ -0,0 +1,181 @@
+# benchmarks/amg_pages.py
+"""Synthetic Angry Metal Guy pages for offline benchmarks.
+
+The pages follow the WordPress markup the scraper relies on (search results in
+`article.post` with an `h2.entry-title` link, review text in
+`div.entry-content`, an optional `div.rating`) and pad it with the kind of
+head, navigation, sidebar and footer markup a real page carries. Everything
+is generated from a seed, so the same call always returns the same pages.
+"""
+import random
+
+WORDS = ("riff riffs doom black death thrash melodic atmospheric dissonant blast "
+         "beats vocals growls shrieks production master guitar bass drums tremolo "
+         "picking album record band debut sophomore release songs tracks chorus "
+         "bridge solo solos heavy crushing slow mid-paced gallop epic progressive "
+         "folk symphonic keyboards orchestral length runtime filler highlight "
+         "standout closer opener listen listener metal genre scene label").split()
+
+LABELS = ["Profound Lore", "Relapse Records", "Nuclear Blast", "Season of Mist",
+          "Century Media", "20 Buck Spin", "Dark Descent", "Prosthetic Records"]
+TAGS = ["Black Metal", "Death Metal", "Doom Metal", "Progressive Metal", "Thrash Metal",
+        "Sludge", "Melodic Death Metal", "Atmospheric Black Metal", "Heavy Metal"]
+REVIEWERS = ["Steel Druhm", "Angry Metal Guy", "Dr. A.N. Grier", "Holdeneye", "Kenstrosity"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December"]
+
+def _sentence(rng, min_words=8, max_words=24):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    words[0] = words[0].capitalize()
+    return ' '.join(words) + rng.choice(['.', '.', '.', '!', '?'])
+
+def _paragraph(rng, sentences=None):
+    return ' '.join(_sentence(rng) for _ in range(sentences or rng.randint(3, 7)))
+
+def album_names(count, seed=0):
+    """Return `count` (artist, album) pairs"""
+    rng = random.Random(seed)
+    pairs = []
+    for i in range(count):
+        artist = ' '.join(w.capitalize() for w in rng.sample(WORDS, rng.randint(1, 2)))
+        album = ' '.join(w.capitalize() for w in rng.sample(WORDS, rng.randint(1, 3)))
+        pairs.append((f"{artist} {i}", album))
+    return pairs
+
+def _page(title, body, rng):
+    scripts = '\n'.join(
+        f'<script type="text/javascript">var wp_{i} = {{"ajax":"/wp-admin/admin-ajax.php","n":{rng.randint(0, 9999)}}};</script>'
+        for i in range(8))
+    styles = '\n'.join(
+        f'<link rel="stylesheet" id="style-{i}-css" href="/wp-content/themes/amg/style-{i}.css?ver=6.4" type="text/css" media="all" />'
+        for i in range(12))
+    nav = '\n'.join(f'<li class="menu-item menu-item-{i}"><a href="/category/{t.lower().replace(" ", "-")}/">{t}</a></li>'
+                    for i, t in enumerate(TAGS))
+    sidebar = '\n'.join(
+        f'<li class="recent-post"><a href="/recent-{i}/">{_sentence(rng, 3, 6)}</a>'
+        f'<span class="date">{rng.choice(MONTHS)} {rng.randint(1, 28)}, 2024</span></li>'
+        for i in range(40))
+    footer = '\n'.join(f'<div class="widget"><h4>Widget {i}</h4><p>{_paragraph(rng, 2)}</p></div>' for i in range(6))
+    return f"""<!DOCTYPE html>
+<html lang="en-US">
+<head>
+<meta charset="UTF-8" />
+<title>{title} | Angry Metal Guy</title>
+{styles}
+{scripts}
+<style>.entry-content p {{ margin: 0 0 1em; }}</style>
+</head>
+<body class="wordpress">
+<div id="page">
+<header id="masthead"><nav><ul class="menu">{nav}</ul></nav></header>
+<div id="content" class="site-content">
+<div id="primary" class="content-area"><main id="main" class="site-main">
+{body}
+</main></div>
+<aside id="secondary" class="widget-area"><ul class="recent-posts">{sidebar}</ul></aside>
+</div>
+<footer id="colophon">{footer}</footer>
+</div>
+<!-- Page generated by a caching plugin -->
+<script>window.dataLayer = window.dataLayer || []; function gtag(){{dataLayer.push(arguments);}}</script>
+</body>
+</html>
+"""
+
+def _review_content(rng, album, rating, rating_in_text):
+    paragraphs = []
+    for i in range(rng.randint(8, 14)):
+        text = _paragraph(rng)
+        if i == 2:
+            text += ' Rock &amp; roll isn&#8217;t dead &#8211; it&#8217;s <em>heavier</em> than ever.'
+        if i == 4:
+            paragraphs.append(f'<blockquote><p>{_sentence(rng)}</p></blockquote>')
+        if i == 6:
+            paragraphs.append(f'<h3>{_sentence(rng, 2, 4)}</h3>')
+            paragraphs.append('<!-- ad slot -->')
+            paragraphs.append('<script>console.log("inline ad");</script>')
+        paragraphs.append(f'<p>{text}</p>')
+    paragraphs.append(
+        f'<p><strong>Rating:</strong> {"" if not rating_in_text else rating + "/5.0"}<br />\n'
+        f'<strong>DR:</strong> {rng.randint(4, 10)} | <strong>Reviewed Format:</strong> 320 kb/s mp3<br />\n'
+        f'<strong>Label:</strong> <a href="https://example.com/">{rng.choice(LABELS)}</a><br />\n'
+        f'<strong>Releases Worldwide:</strong> {rng.choice(MONTHS)} {rng.randint(1, 28)}th, 20{rng.randint(10, 24)}</p>')
+    return (f'<p><img src="/wp-content/uploads/cover.jpg" alt="{album} cover" width="300" height="300" /></p>\n'
+            + '\n'.join(paragraphs))
+
+def review_content(artist, album, seed=0):
+    """The review's HTML as WordPress stores it: what review_page puts inside div.entry-content"""
+    rng = random.Random(f"review-{seed}-{artist}-{album}")
+    rating = f"{rng.randint(1, 4)}.{rng.choice([0, 5])}"
+    return _review_content(rng, album, rating, True)
+
+def review_page(artist, album, seed=0, rating_in_text=True, with_rating_div=False):
+    """HTML of a review page for an album"""
+    rng = random.Random(f"review-{seed}-{artist}-{album}")
+    rating = f"{rng.randint(1, 4)}.{rng.choice([0, 5])}"
+    content = _review_content(rng, album, rating, rating_in_text)
+    rating_div = f'<div class="rating"><span>Rating: {rating}/5.0</span></div>' if with_rating_div else ''
+    tags = ' '.join(f'<a href="/tag/{t.lower().replace(" ", "-")}/" rel="tag">{t}</a>'
+                    for t in rng.sample(TAGS, 3))
+    body = f"""<article id="post-{rng.randint(1000, 99999)}" class="post type-post status-publish format-standard hentry category-reviews">
+<header class="entry-header">
+<h1 class="entry-title">{artist} &#8211; {album} Review</h1>
+<div class="entry-meta">By <span class="author vcard"><a class="url fn n" rel="author" href="/author/x/">{rng.choice(REVIEWERS)}</a></span>
+<span class="cat-links"><a href="/category/reviews/" rel="category tag">Reviews</a></span></div>
+</header>
+<div class="entry-content">
+{content}
+</div>
+{rating_div}
+<footer class="entry-footer"><span class="tags-links">{tags}</span></footer>
+</article>
+<div id="comments" class="comments-area">{''.join(f'<div class="comment"><p>{_paragraph(rng, 2)}</p></div>' for _ in range(rng.randint(5, 30)))}</div>"""
+    return _page(f"{artist} &#8211; {album} Review", body, rng)
+
+def review_slug(artist, album):
+    """Path of an album's review page on the site"""
+    return f"/{artist}-{album}-review/".lower().replace(' ', '-')
+
+def search_page(artist, album, seed=0, found=True, base_url="https://www.angrymetalguy.com"):
+    """HTML of a search results page, optionally containing the album's review"""
+    rng = random.Random(f"search-{seed}-{artist}-{album}")
+    results = []
+    others = album_names(rng.randint(5, 9), seed=rng.randint(0, 10 ** 6))
+    if found:
+        others.insert(rng.randint(0, len(others)), (artist, album))
+    for i, (other_artist, other_album) in enumerate(others):
+        results.append(f"""<article id="post-{i}" class="post type-post hentry">
+<header class="entry-header"><h2 class="entry-title"><a href="{base_url}{review_slug(other_artist, other_album)}" rel="bookmark">{other_artist} &#8211; {other_album} Review</a></h2></header>
+<div class="entry-summary"><p>{_paragraph(rng, 2)}</p></div>
+</article>""")
+    if not found and rng.random() < 0.5:
+        results = ['<section class="no-results"><h1 class="page-title">Nothing Found</h1></section>']
+    return _page(f"You searched for {artist} {album}", '\n'.join(results), rng)
+
+def favorite_rows(count, seed=0):
+    """Rows of a synthetic Tidal favorites CSV, standing in for tidal.py's export"""
+    rng = random.Random(f"favorites-{seed}")
+    rows = []
+    for i, (artist, album) in enumerate(album_names(count, seed)):
+        year = rng.randint(1985, 2024)
+        release_date = f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        rows.append({
+            'Album': album,
+            'Artist': artist,
+            'Release Date': release_date,
+            'Year': str(year),
+            'Cover URL': f"https://resources.tidal.com/images/{i:08x}/640x640.jpg",
+            'Tidal ID': str(100000000 + i),
+            'Date Added': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        })
+    return rows
+
+def write_fixtures(folder, count=20, seed=0):
+    """Write `count` review pages and `count` search pages to a folder"""
+    import os
+    os.makedirs(folder, exist_ok=True)
+    for i, (artist, album) in enumerate(album_names(count, seed)):
+        with open(os.path.join(folder, f"review_{i:03d}.html"), 'w', encoding='utf-8') as f:
+            f.write(review_page(artist, album, seed, rating_in_text=i % 4 != 0, with_rating_div=i % 2 == 0))
+        with open(os.path.join(folder, f"search_{i:03d}.html"), 'w', encoding='utf-8') as f:
+            f.write(search_page(artist, album, seed, found=i % 3 != 0))
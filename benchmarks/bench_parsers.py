@@ -0,0 +1,130 @@
+# benchmarks/bench_parsers.py
+"""Compare the speed and output of the HTML parser backends in amg_parsers.py.
+
+Run from the project root:
+
+    python -m benchmarks.bench_parsers
+    python -m benchmarks.bench_parsers --from-cache http_cache.sqlite
+
+Pages are read from the fixtures folder (review_*.html and search_*.html).
+--from-cache fills it with real pages from the crawler's response cache.
+Those are full review texts from angrymetalguy.com, so they stay local and
+out of git. Without captured pages, synthetic ones (benchmarks/amg_pages.py)
+are written to a folder of their own and the check runs on those. They only
+follow the markup the scraper relies on, so passing on them says less than
+passing on real pages. Every backend's output
+is checked against the html.parser reference and the script exits with an
+error if any page differs, including the review fields other than the text
+(rating, label, release date, reviewer, tags and categories).
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import time
+import zlib
+
+import amg
+import amg_parsers
+from benchmarks.amg_pages import write_fixtures
+
+DEFAULT_FIXTURES = os.path.join('benchmarks', 'fixtures', 'amg')
+SYNTHETIC_FIXTURES = os.path.join('benchmarks', 'fixtures', 'synthetic')
+
+def export_from_cache(cache_file, folder):
+    """Save every cached page as a fixture, named by page type"""
+    os.makedirs(folder, exist_ok=True)
+    conn = sqlite3.connect(cache_file)
+    count = 0
+    for i, (url, body) in enumerate(conn.execute("SELECT url, body FROM responses ORDER BY url")):
+        kind = 'search' if '?s=' in url else 'review'
+        with open(os.path.join(folder, f"{kind}_cache_{i:05d}.html"), 'w', encoding='utf-8') as f:
+            f.write(zlib.decompress(body).decode('utf-8'))
+        count += 1
+    conn.close()
+    return count
+
+def load_fixtures(folder):
+    pages = {}
+    for kind in ('search', 'review'):
+        pages[kind] = []
+        for path in sorted(glob.glob(os.path.join(folder, f"{kind}_*.html"))):
+            with open(path, 'r', encoding='utf-8') as f:
+                pages[kind].append((os.path.basename(path), f.read()))
+    return pages
+
+def time_backend(name, pages, repeat):
+    """Parse every page `repeat` times; return seconds per page and the outputs of the last pass"""
+    search_results, _ = amg_parsers.get_backend(name)
+    timings = {}
+    outputs = {}
+    for kind, parse in (('search', search_results),
+                        ('review', lambda html: amg.parse_review(html, name))):
+        if not pages[kind]:
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            outputs[kind] = [parse(html) for _, html in pages[kind]]
+        timings[kind] = (time.perf_counter() - start) / (repeat * len(pages[kind]))
+    return timings, outputs
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HTML parser backends")
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES,
+                        help=f"Folder with captured review_*.html and search_*.html pages (default: {DEFAULT_FIXTURES})")
+    parser.add_argument('--from-cache', metavar='CACHE_FILE',
+                        help="Save the pages in a response cache file as fixtures first")
+    parser.add_argument('--repeat', type=int, default=5, help="Passes over the fixtures per backend (default: 5)")
+    parser.add_argument('--backends', nargs='+', help="Backends to compare (default: all installed)")
+    args = parser.parse_args()
+
+    if args.from_cache:
+        count = export_from_cache(args.from_cache, args.fixtures)
+        print(f"Saved {count} cached pages to {args.fixtures}")
+
+    pages = load_fixtures(args.fixtures)
+    if not pages['search'] and not pages['review']:
+        print(f"No captured pages in {args.fixtures} (save some with --from-cache after a crawl); "
+              f"comparing on synthetic pages in {SYNTHETIC_FIXTURES}")
+        pages = load_fixtures(SYNTHETIC_FIXTURES)
+        if not pages['search'] and not pages['review']:
+            write_fixtures(SYNTHETIC_FIXTURES)
+            pages = load_fixtures(SYNTHETIC_FIXTURES)
+
+    backends = args.backends or amg_parsers.available_backends()
+    reference = amg_parsers.DEFAULT_BACKEND
+    if reference in backends:
+        backends.remove(reference)
+    backends.insert(0, reference)
+
+    print(f"{len(pages['search'])} search pages, {len(pages['review'])} review pages, {args.repeat} passes\n")
+    print(f"{'Backend':<16} {'Search ms/page':>15} {'Review ms/page':>15} {'Speedup':>8}  Output")
+    print("-" * 72)
+
+    results = {}
+    mismatches = 0
+    for name in backends:
+        timings, outputs = time_backend(name, pages, args.repeat)
+        results[name] = (timings, outputs)
+        ref_timings, ref_outputs = results[reference]
+
+        differing = []
+        for kind in outputs:
+            for (filename, _), got, expected in zip(pages[kind], outputs[kind], ref_outputs[kind]):
+                if got != expected:
+                    differing.append(filename)
+        mismatches += len(differing)
+
+        total = sum(timings.values())
+        speedup = sum(ref_timings.values()) / total if total else 0
+        status = "identical" if not differing else f"{len(differing)} pages differ: {', '.join(differing[:3])}"
+        print(f"{name:<16} {timings.get('search', 0) * 1000:>15.2f} {timings.get('review', 0) * 1000:>15.2f} "
+              f"{speedup:>7.1f}x  {status}")
+
+    if mismatches:
+        print(f"\n{mismatches} pages differ from the {reference} output")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
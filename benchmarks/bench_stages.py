@@ -0,0 +1,385 @@
+# benchmarks/bench_stages.py
+"""Measure every stage of the project offline and keep the results per commit.
+
+Run from the project root:
+
+    python -m benchmarks.bench_stages
+    python -m benchmarks.bench_stages --stages crawl ollama --albums 200 --ollama-tps 50
+    python -m benchmarks.bench_stages --replay http_cache.sqlite --favorites tidal_favorite_albums.csv
+
+A synthetic favorites set (benchmarks.amg_pages.favorite_rows) stands in for
+tidal.py, and the stubs in benchmarks/stub_servers.py stand in for
+angrymetalguy.com, Ollama and OpenAI, so nothing leaves the machine:
+
+    parse         parse the search and review page fixtures (see bench_parsers.py),
+                  in a pool of --parse-workers processes if given
+    crawl         search_angry_metal_guy + extract_review_and_rating against the AMG stub
+    catalog       sync the review catalog from the AMG stub's REST API, then match every album to it
+    ollama        generate_review against the Ollama /api/generate stub
+    openai-chat   process_review_with_gpt against the OpenAI chat completions stub
+    openai-batch  run_batch_mode against the OpenAI files and batches stub
+
+Each stage runs in a fresh process so its peak RSS and CPU time are its own,
+and reports albums/sec and p50/p99 latency per album. Results are appended to
+benchmarks/results.jsonl with the git commit and compared with the last run of
+another commit under the same settings, flagging regressions.
+"""
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from itertools import zip_longest
+
+from amg_parsers import BACKEND_FACTORIES, DEFAULT_BACKEND
+from benchmarks.amg_pages import favorite_rows, review_page
+from benchmarks.bench_parsers import DEFAULT_FIXTURES, load_fixtures
+from benchmarks.stub_servers import start_amg_stub, start_ollama_stub, start_openai_stub
+
+STAGES = ['parse', 'crawl', 'catalog', 'ollama', 'openai-chat', 'openai-batch']
+DEFAULT_RESULTS = os.path.join('benchmarks', 'results.jsonl')
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def summarize(albums, seconds, latencies, cpu_seconds, failed=0):
+    return {
+        'albums': albums,
+        'failed': failed,
+        'seconds': round(seconds, 3),
+        'albums_per_sec': round(albums / seconds, 2) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+def measure(items, handle, workers=1):
+    """Run `handle` on every item with `workers` threads; a falsy return counts as a failure"""
+    def timed(item):
+        start = time.perf_counter()
+        ok = handle(item)
+        return time.perf_counter() - start, ok
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(timed, items))
+    else:
+        outcomes = [timed(item) for item in items]
+    seconds = time.perf_counter() - start
+    return summarize(len(items), seconds, [latency for latency, _ in outcomes],
+                     time.process_time() - cpu_start, sum(1 for _, ok in outcomes if not ok))
+
+def review_texts(albums, seed):
+    """(artist, album, review text) for each album, parsed from its synthetic review page"""
+    import amg
+    return [(artist, album, amg.parse_review_page(review_page(artist, album, seed))[0])
+            for artist, album in albums]
+
+def parse_pair(pair, backend):
+    """Parse a search page and a review page; returns (seconds, ok)"""
+    import amg
+    import amg_parsers
+    search_results, _ = amg_parsers.get_backend(backend)
+    start = time.perf_counter()
+    search, review = pair
+    if search is not None:
+        search_results(search[1])
+    ok = review is None or amg.parse_review_page(review[1], backend)[0] is not None
+    return time.perf_counter() - start, ok
+
+def bench_parse(options):
+    pages = load_fixtures(options['fixtures'])
+    pairs = list(zip_longest(pages['search'], pages['review'])) * options['repeat']
+    if not options['parse_workers']:
+        return measure(pairs, lambda pair: parse_pair(pair, options['backend'])[1])
+
+    import amg
+    # Workers are started and warmed up outside the timing, like the in-process parsers
+    with amg.create_parse_pool(options['parse_workers']) as pool:
+        list(pool.map(parse_pair, pairs[:options['parse_workers']], [options['backend']] * options['parse_workers']))
+        cpu_start = time.process_time() + sum(os.times()[2:4])
+        start = time.perf_counter()
+        outcomes = list(pool.map(parse_pair, pairs, [options['backend']] * len(pairs), chunksize=4))
+        seconds = time.perf_counter() - start
+    # Worker CPU time (warm-up included) only shows up in the children's times once the pool has shut down
+    cpu_seconds = time.process_time() + sum(os.times()[2:4]) - cpu_start
+    return summarize(len(pairs), seconds, [latency for latency, _ in outcomes], cpu_seconds,
+                     sum(1 for _, ok in outcomes if not ok))
+
+def bench_crawl(options):
+    import amg
+    amg.AMG_BASE_URL = options['amg_url']
+    session = amg.create_session(options['workers'])
+
+    def crawl(pair):
+        artist, album = pair
+        review_url = amg.search_angry_metal_guy(album, artist, session)
+        if review_url:
+            review_text, _ = amg.extract_review_and_rating(review_url, session)
+            return review_text is not None
+        # Albums without a review are a normal outcome, not a failure
+        return True
+
+    return measure(options['albums'], crawl, options['workers'])
+
+def bench_catalog(options):
+    import amg_catalog
+    catalog = amg_catalog.Catalog(os.path.join(tempfile.mkdtemp(prefix='bench_catalog_'), 'catalog.sqlite'))
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    amg_catalog.sync_catalog(catalog, base_url=options['amg_url'])
+    index = catalog.match_index()
+    latencies = []
+    for artist, album in options['albums']:
+        lookup_start = time.perf_counter()
+        result, post_id, _ = index.resolve(artist, album)
+        if result == 'match':
+            catalog.get(post_id)
+        latencies.append(time.perf_counter() - lookup_start)
+    seconds = time.perf_counter() - start
+    # The sync and the index are shared by all albums, so they count in albums/sec but not in the per-album latency
+    return summarize(len(options['albums']), seconds, latencies, time.process_time() - cpu_start)
+
+def bench_ollama(options):
+    import ollama_reviews
+    jobs = review_texts(options['albums'], options['seed'])
+    session = ollama_reviews.create_session(options['workers'])
+
+    def reformat(job):
+        artist, album, text = job
+        return ollama_reviews.process_review_with_ollama(text, artist, album, session=session,
+                                                         url=options['ollama_url']) is not None
+
+    return measure(jobs, reformat, options['workers'])
+
+def bench_openai_chat(options):
+    from openai import OpenAI
+    import fix_reviews
+    jobs = review_texts(options['albums'], options['seed'])
+    client = OpenAI(api_key='stub', base_url=options['openai_url'])
+
+    def reformat(job):
+        artist, album, text = job
+        return fix_reviews.process_review_with_gpt(client, text, artist, album) is not None
+
+    return measure(jobs, reformat, options['workers'])
+
+def bench_openai_batch(options):
+    from openai import OpenAI
+    import fix_reviews
+    from reviews import format_metadata
+    jobs = []
+    # run_batch_mode keeps its state in batches/ under the working directory
+    os.chdir(tempfile.mkdtemp(prefix='bench_batch_'))
+    os.makedirs('album_reviews')
+    os.makedirs('reformatted_reviews')
+    for i, (artist, album, text) in enumerate(review_texts(options['albums'], options['seed'])):
+        filename = f"{i:05d}.txt"
+        metadata = format_metadata(artist, album, f"{i:05d}", '')
+        with open(os.path.join('album_reviews', filename), 'w', encoding='utf-8') as f:
+            f.write(metadata + "\n\n" + text)
+        jobs.append((filename, artist, album, metadata, text))
+    client = OpenAI(api_key='stub', base_url=options['openai_url'])
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    fix_reviews.run_batch_mode(client, jobs, 'album_reviews', 'reformatted_reviews', poll_interval=0.1)
+    seconds = time.perf_counter() - start
+    # Every review in a batch is done when the batch is
+    saved = len(os.listdir('reformatted_reviews'))
+    return summarize(len(jobs), seconds, [seconds] * len(jobs), time.process_time() - cpu_start,
+                     len(jobs) - saved)
+
+STAGE_FUNCTIONS = {
+    'parse': bench_parse,
+    'crawl': bench_crawl,
+    'catalog': bench_catalog,
+    'ollama': bench_ollama,
+    'openai-chat': bench_openai_chat,
+    'openai-batch': bench_openai_batch,
+}
+
+def run_stage(stage, options):
+    """Entry point of a stage's worker process; the scripts' progress output is discarded"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return STAGE_FUNCTIONS[stage](options)
+
+def run_in_fresh_process(stage, options):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_stage, stage, options).result()
+
+def git_commit():
+    """Short hash of HEAD, with -dirty appended if the tree has uncommitted changes"""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def load_results(results_file):
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def find_baseline(history, commit, settings):
+    """The latest run with the same settings, preferring one from another commit"""
+    comparable = [run for run in history if run['settings'] == settings]
+    other_commits = [run for run in comparable if run['commit'] != commit]
+    return (other_commits or comparable or [None])[-1]
+
+def change(new, old):
+    return (new - old) / old if old else 0.0
+
+def regressions(result, baseline, threshold):
+    """Metrics of a stage that got worse than the baseline by more than `threshold`"""
+    worse = []
+    if change(result['albums_per_sec'], baseline['albums_per_sec']) < -threshold:
+        worse.append('albums/sec')
+    for key, label in (('p99_ms', 'p99'), ('cpu_seconds', 'CPU'), ('peak_rss_mb', 'RSS')):
+        if change(result[key], baseline[key]) > threshold:
+            worse.append(label)
+    return worse
+
+def load_favorites(csv_file):
+    with open(csv_file, 'r', encoding='utf-8') as csvfile:
+        return [(row['Artist'], row['Album']) for row in csv.DictReader(csvfile)]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages against local stubs")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                        help="Stages to run (default: all)")
+    parser.add_argument('--albums', type=int, default=40, help="Synthetic favorite albums (default: 40)")
+    parser.add_argument('--favorites', metavar='CSV', help="Use the albums in a favorites CSV instead")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4, help="Albums processed at once (default: 4)")
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES,
+                        help=f"Page fixtures for the parse stage (default: {DEFAULT_FIXTURES})")
+    parser.add_argument('--repeat', type=int, default=5, help="Passes over the fixtures (default: 5)")
+    parser.add_argument('--parse-workers', type=int, default=0,
+                        help="Processes for the parse stage, as in amg.py --parse-workers (default: 0, in-process)")
+    parser.add_argument('--parser', default=DEFAULT_BACKEND, choices=sorted(BACKEND_FACTORIES),
+                        help=f"HTML parser backend (default: {DEFAULT_BACKEND})")
+    parser.add_argument('--replay', metavar='CACHE_FILE',
+                        help="Serve pages recorded in a response cache file from the AMG stub")
+    stubs = parser.add_argument_group('Stubs')
+    stubs.add_argument('--amg-latency', type=float, default=0.02, help="Seconds per page (default: 0.02)")
+    stubs.add_argument('--ollama-latency', type=float, default=0.05,
+                       help="Seconds to the first token (default: 0.05)")
+    stubs.add_argument('--ollama-tps', type=float, default=2000.0,
+                       help="Tokens per second per request (default: 2000)")
+    stubs.add_argument('--ollama-parallel', type=int, default=4, help="Requests generating at once (default: 4)")
+    stubs.add_argument('--openai-latency', type=float, default=0.05,
+                       help="Seconds per chat completion (default: 0.05)")
+    stubs.add_argument('--rpm', type=int, help="OpenAI requests per minute (default: unlimited)")
+    stubs.add_argument('--tpm', type=int, help="OpenAI tokens per minute (default: unlimited)")
+    stubs.add_argument('--batch-delay', type=float, default=1.0,
+                       help="Seconds until an OpenAI batch completes (default: 1)")
+    results = parser.add_argument_group('Results')
+    results.add_argument('--results', default=DEFAULT_RESULTS,
+                         help=f"File the runs are appended to (default: {DEFAULT_RESULTS})")
+    results.add_argument('--no-save', action='store_true', help="Compare, but don't record this run")
+    results.add_argument('--threshold', type=float, default=0.15,
+                         help="Relative change counted as a regression (default: 0.15)")
+    results.add_argument('--fail-on-regression', action='store_true',
+                         help="Exit with an error if any stage regressed")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    albums = (load_favorites(args.favorites) if args.favorites else
+              [(row['Artist'], row['Album']) for row in favorite_rows(args.albums, args.seed)])
+
+    if 'parse' in args.stages and not any(load_fixtures(args.fixtures).values()):
+        from benchmarks.amg_pages import write_fixtures
+        write_fixtures(args.fixtures)
+        print(f"No fixtures found, wrote synthetic pages to {args.fixtures}")
+
+    options = {'albums': albums, 'seed': args.seed, 'workers': args.workers, 'backend': args.parser,
+               'fixtures': args.fixtures, 'repeat': args.repeat, 'parse_workers': args.parse_workers}
+    servers = []
+    if 'crawl' in args.stages or 'catalog' in args.stages:
+        server, options['amg_url'] = start_amg_stub(albums, seed=args.seed, latency=args.amg_latency,
+                                                    cache_file=args.replay)
+        servers.append(server)
+    if 'ollama' in args.stages:
+        server, options['ollama_url'] = start_ollama_stub(latency=args.ollama_latency,
+                                                          tokens_per_sec=args.ollama_tps,
+                                                          parallel=args.ollama_parallel)
+        servers.append(server)
+    if 'openai-chat' in args.stages or 'openai-batch' in args.stages:
+        server, options['openai_url'] = start_openai_stub(latency=args.openai_latency, rpm=args.rpm,
+                                                          tpm=args.tpm, window=60.0,
+                                                          batch_delay=args.batch_delay)
+        servers.append(server)
+
+    # Runs are only compared with runs under the same settings
+    settings = {name: value for name, value in sorted(vars(args).items())
+                if name not in ('stages', 'results', 'no_save', 'threshold', 'fail_on_regression')}
+    commit = git_commit()
+    baseline = find_baseline(load_results(args.results), commit, settings)
+
+    print(f"{len(albums)} albums, {args.workers} workers, commit {commit}"
+          + (f", compared with {baseline['commit']} ({baseline['time']})" if baseline else "") + "\n")
+    print(f"{'Stage':<14} {'Albums/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'CPU s':>7} {'RSS MB':>7} "
+          f"{'Failed':>6}  vs baseline")
+    print("-" * 88)
+
+    stage_results = {}
+    regressed = []
+    try:
+        for stage in args.stages:
+            result = run_in_fresh_process(stage, options)
+            stage_results[stage] = result
+            comparison = ""
+            previous = (baseline or {}).get('stages', {}).get(stage)
+            if previous:
+                comparison = (f"{change(result['albums_per_sec'], previous['albums_per_sec']):+.0%} albums/s, "
+                              f"{change(result['p99_ms'], previous['p99_ms']):+.0%} p99")
+                worse = regressions(result, previous, args.threshold)
+                if worse:
+                    regressed.append(stage)
+                    comparison += f"  REGRESSION: {', '.join(worse)}"
+            print(f"{stage:<14} {result['albums_per_sec']:>9.1f} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                  f"{result['cpu_seconds']:>7.2f} {result['peak_rss_mb']:>7.1f} {result['failed']:>6}  {comparison}")
+    finally:
+        for server in servers:
+            server.shutdown()
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.results) or '.', exist_ok=True)
+        record = {'commit': commit, 'time': datetime.now().isoformat(timespec='seconds'),
+                  'settings': settings, 'stages': stage_results}
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"\nSaved results to {args.results}")
+
+    if regressed:
+        print(f"\nRegressed stages: {', '.join(regressed)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
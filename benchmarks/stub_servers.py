@@ -0,0 +1,614 @@
+# benchmarks/stub_servers.py
+"""Local stand-ins for the remote APIs the project talks to.
+
+Run from the project root, for example:
+
+    python -m benchmarks.stub_servers openai --port 8001 --batch-delay 5
+    python -m benchmarks.stub_servers ollama --port 11435 --tokens-per-sec 50 --parallel 2
+    python -m benchmarks.stub_servers amg --port 8002 --albums 100
+
+and point the scripts at it with `base_url: http://127.0.0.1:8001/v1` under
+`openai:` in config.yaml, or `--url http://127.0.0.1:11435` for Ollama.
+Replies echo the review text back, so the full request/response cycle can be
+exercised without network access or cost. The stubs can also simulate
+latency, rate limits and server errors.
+"""
+import argparse
+import email
+import email.policy
+import hashlib
+import itertools
+import json
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.amg_pages import album_names, review_content, review_page, review_slug, search_page
+
+AMG_SITE = "https://www.angrymetalguy.com"
+
+def fake_reformat(messages):
+    """Deterministic stand-in for a model's answer: the review text between the --- markers"""
+    prompt = messages[-1]['content'] if messages else ''
+    match = re.search(r'---\n(.*)\n---', prompt, re.S)
+    return "REFORMATTED\n\n" + (match.group(1).strip() if match else prompt.strip())
+
+def chat_completion(body, completion_id):
+    """Build a chat.completion response for a request body"""
+    content = fake_reformat(body.get('messages', []))
+    prompt_tokens = sum(len(m.get('content', '')) for m in body.get('messages', [])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        'id': f"chatcmpl-{completion_id}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+    }
+
+class OpenAIStub:
+    """In-memory state behind the OpenAI stub: uploaded files, batches and rate limits.
+
+    Chat completions take `latency` seconds and are limited to `rpm` requests
+    and `tpm` tokens per `window` seconds, answering with the same
+    x-ratelimit-* headers and 429 errors as the real API. `error_rate` is the
+    fraction of requests that fail with a 500.
+    """
+
+    def __init__(self, batch_delay=2.0, latency=0.0, rpm=None, tpm=None, window=60.0, error_rate=0.0):
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self.error_rate = error_rate
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.requests_used = 0
+        self.tokens_used = 0
+        self.stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    def admit(self, body):
+        """Count a chat request against the quotas; returns (allowed, rate-limit headers)"""
+        tokens = sum(len(m.get('content', '')) for m in body.get('messages', [])) // 4
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.requests_used = 0
+                self.tokens_used = 0
+            allowed = ((self.rpm is None or self.requests_used < self.rpm) and
+                       (self.tpm is None or self.tokens_used + tokens <= self.tpm))
+            if allowed:
+                self.requests_used += 1
+                self.tokens_used += tokens
+            reset = f"{max(0.0, self.window - (now - self.window_start)):.3f}s"
+            headers = {}
+            if self.rpm is not None:
+                headers['x-ratelimit-limit-requests'] = str(self.rpm)
+                headers['x-ratelimit-remaining-requests'] = str(max(0, self.rpm - self.requests_used))
+                headers['x-ratelimit-reset-requests'] = reset
+            if self.tpm is not None:
+                headers['x-ratelimit-limit-tokens'] = str(self.tpm)
+                headers['x-ratelimit-remaining-tokens'] = str(max(0, self.tpm - self.tokens_used))
+                headers['x-ratelimit-reset-tokens'] = reset
+            self.stats['requests'] += 1
+            if not allowed:
+                self.stats['rate_limited'] += 1
+        return allowed, headers
+
+    def new_id(self, prefix):
+        with self.lock:
+            return f"{prefix}-{next(self.ids):06d}"
+
+    def add_file(self, filename, data, purpose):
+        file_id = self.new_id('file')
+        self.files[file_id] = {
+            'id': file_id,
+            'object': 'file',
+            'bytes': len(data),
+            'created_at': int(time.time()),
+            'filename': filename,
+            'purpose': purpose,
+            'status': 'processed',
+            'data': data,
+        }
+        return file_id
+
+    def file_object(self, file_id):
+        return {k: v for k, v in self.files[file_id].items() if k != 'data'}
+
+    def create_batch(self, body):
+        batch_id = self.new_id('batch')
+        lines = [line for line in self.files[body['input_file_id']]['data'].decode('utf-8').splitlines() if line.strip()]
+        self.batches[batch_id] = {
+            'id': batch_id,
+            'object': 'batch',
+            'endpoint': body['endpoint'],
+            'input_file_id': body['input_file_id'],
+            'completion_window': body['completion_window'],
+            'status': 'validating',
+            'created_at': int(time.time()),
+            'output_file_id': None,
+            'error_file_id': None,
+            'request_counts': {'total': len(lines), 'completed': 0, 'failed': 0},
+        }
+        return self.batches[batch_id]
+
+    def get_batch(self, batch_id):
+        """Return a batch, moving it along validating -> in_progress -> completed over time"""
+        batch = self.batches[batch_id]
+        age = time.time() - batch['created_at']
+        if batch['status'] == 'validating' and age >= self.batch_delay / 2:
+            batch['status'] = 'in_progress'
+        if batch['status'] == 'in_progress' and age >= self.batch_delay:
+            self.complete_batch(batch)
+        return batch
+
+    def complete_batch(self, batch):
+        outputs = []
+        for line in self.files[batch['input_file_id']]['data'].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            outputs.append(json.dumps({
+                'id': self.new_id('batch_req'),
+                'custom_id': request['custom_id'],
+                'response': {
+                    'status_code': 200,
+                    'request_id': self.new_id('req'),
+                    'body': chat_completion(request['body'], self.new_id('c')),
+                },
+                'error': None,
+            }))
+        batch['output_file_id'] = self.add_file('batch_output.jsonl', ('\n'.join(outputs) + '\n').encode('utf-8'), 'batch_output')
+        batch['request_counts']['completed'] = len(outputs)
+        batch['status'] = 'completed'
+        batch['completed_at'] = int(time.time())
+
+def make_openai_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, obj, headers=None):
+            data = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        def do_POST(self):
+            body = self.read_body()
+            if self.path == '/v1/files':
+                # Parse the multipart upload with the email package (the cgi module is gone)
+                message = email.message_from_bytes(
+                    b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body,
+                    policy=email.policy.HTTP)
+                fields = {}
+                for part in message.iter_parts():
+                    name = part.get_param('name', header='content-disposition')
+                    fields[name] = (part.get_filename(), part.get_payload(decode=True))
+                filename, data = fields['file']
+                purpose = fields['purpose'][1].decode('utf-8')
+                self.send_json(200, stub.file_object(stub.add_file(filename, data, purpose)))
+            elif self.path == '/v1/batches':
+                self.send_json(200, stub.create_batch(json.loads(body)))
+            elif self.path == '/v1/chat/completions':
+                self.chat_completions(json.loads(body))
+            else:
+                self.send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+        def chat_completions(self, body):
+            allowed, headers = stub.admit(body)
+            if not allowed:
+                headers['retry-after'] = str(max(1, round(float(headers.get('x-ratelimit-reset-requests', '1s')[:-1]))))
+                self.send_json(429, {'error': {'message': "Rate limit reached", 'type': 'requests',
+                                               'code': 'rate_limit_exceeded'}}, headers)
+                return
+            if stub.error_rate and random.random() < stub.error_rate:
+                stub.stats['errors'] += 1
+                self.send_json(500, {'error': {'message': "The server had an error", 'type': 'server_error'}})
+                return
+            with stub.lock:
+                stub.stats['in_flight'] += 1
+                stub.stats['max_in_flight'] = max(stub.stats['max_in_flight'], stub.stats['in_flight'])
+            try:
+                time.sleep(stub.latency)
+                self.send_json(200, chat_completion(body, stub.new_id('c')), headers)
+            finally:
+                with stub.lock:
+                    stub.stats['in_flight'] -= 1
+
+        def do_GET(self):
+            if self.path.split('?')[0] == '/v1/batches':
+                # Newest first, like the real list; everything fits on one page here
+                batches = [stub.get_batch(batch_id) for batch_id in reversed(list(stub.batches))]
+                self.send_json(200, {'object': 'list', 'data': batches, 'has_more': False})
+                return
+            match = re.fullmatch(r'/v1/batches/([\w-]+)', self.path)
+            if match and match.group(1) in stub.batches:
+                self.send_json(200, stub.get_batch(match.group(1)))
+                return
+            match = re.fullmatch(r'/v1/files/([\w-]+)/content', self.path)
+            if match and match.group(1) in stub.files:
+                data = stub.files[match.group(1)]['data']
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            self.send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+
+    return Handler
+
+class OllamaStub:
+    """State behind the Ollama stub.
+
+    A generation waits `latency` seconds before its first token, then streams
+    one word per token at `tokens_per_sec` (0 streams as fast as possible).
+    Like a real server with OLLAMA_NUM_PARALLEL set, at most `parallel`
+    requests generate at once and the rest wait their turn.
+    """
+
+    def __init__(self, latency=0.0, tokens_per_sec=0.0, parallel=None, error_rate=0.0, dim=768):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.slots = threading.BoundedSemaphore(parallel) if parallel else None
+        self.error_rate = error_rate
+        self.dim = dim
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'tokens': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+            if name == 'in_flight':
+                self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+
+    def embedding(self, text):
+        """Deterministic unit vector for a text"""
+        rng = random.Random(hashlib.sha1(text.encode('utf-8')).digest())
+        vector = [rng.gauss(0, 1) for _ in range(self.dim)]
+        norm = sum(x * x for x in vector) ** 0.5
+        return [x / norm for x in vector]
+
+def make_ollama_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, obj):
+            data = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_chunk(self, obj):
+            data = json.dumps(obj).encode('utf-8') + b'\n'
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b'\r\n')
+            self.wfile.flush()
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            stub.count('requests')
+            if stub.error_rate and random.random() < stub.error_rate:
+                stub.count('errors')
+                self.send_json(500, {'error': "model runner has unexpectedly stopped"})
+            elif self.path == '/api/generate':
+                if stub.slots is not None:
+                    stub.slots.acquire()
+                stub.count('in_flight')
+                try:
+                    self.generate(body)
+                finally:
+                    stub.count('in_flight', -1)
+                    if stub.slots is not None:
+                        stub.slots.release()
+            elif self.path == '/api/embed':
+                inputs = body.get('input', [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self.send_json(200, {'model': body.get('model', 'stub'),
+                                     'embeddings': [stub.embedding(text) for text in inputs]})
+            else:
+                self.send_json(404, {'error': f"Unknown path {self.path}"})
+
+        def generate(self, body):
+            prompt = body.get('prompt', '')
+            tokens = re.findall(r'\S+\s*', fake_reformat([{'content': prompt}]))
+            model = body.get('model', 'stub')
+            start = time.perf_counter()
+            time.sleep(stub.latency)
+            first_token_at = time.perf_counter()
+
+            if not body.get('stream', True):
+                if stub.tokens_per_sec:
+                    time.sleep(len(tokens) / stub.tokens_per_sec)
+                stub.count('tokens', len(tokens))
+                self.send_json(200, {'model': model, 'response': ''.join(tokens), 'done': True,
+                                     'prompt_eval_count': len(prompt) // 4, 'eval_count': len(tokens)})
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i, token in enumerate(tokens):
+                if stub.tokens_per_sec:
+                    # Sleep until this token is due rather than a fixed amount, so the rate holds
+                    delay = first_token_at + i / stub.tokens_per_sec - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.send_chunk({'model': model, 'response': token, 'done': False})
+            end = time.perf_counter()
+            stub.count('tokens', len(tokens))
+            self.send_chunk({
+                'model': model, 'response': '', 'done': True, 'done_reason': 'stop',
+                'total_duration': int((end - start) * 1e9),
+                'prompt_eval_count': len(prompt) // 4,
+                'eval_count': len(tokens),
+                'eval_duration': int(max(end - first_token_at, 1e-6) * 1e9),
+            })
+            self.wfile.write(b'0\r\n\r\n')
+
+    return Handler
+
+class AMGStub:
+    """Pages of a fake Angry Metal Guy site for a list of (artist, album) pairs.
+
+    Searching for an album returns a results page linking to its review,
+    except for a `miss_rate` fraction of albums (picked deterministically)
+    that have none. Pages recorded in a response cache file (http_cache.py)
+    are served instead of synthetic ones where the URL matches, with links
+    pointing back at the stub.
+
+    The reviews are also served as posts by a WordPress REST API at
+    /wp-json/wp/v2/posts, last modified a day apart from 2020-01-01 in album
+    order; `touch()` marks one as edited now.
+    """
+
+    def __init__(self, albums, seed=0, latency=0.0, miss_rate=0.25, cache_file=None):
+        self.seed = seed
+        self.latency = latency
+        self.miss_rate = miss_rate
+        self.queries = {f"{artist} {album}".lower(): (artist, album) for artist, album in albums}
+        self.reviews = {review_slug(artist, album): (artist, album) for artist, album in albums}
+        first_post = datetime(2020, 1, 1, 12, 0, 0)
+        self.posts = [{'id': 1000 + i, 'artist': artist, 'album': album,
+                       'date': (first_post + timedelta(days=i)).isoformat(),
+                       'modified': (first_post + timedelta(days=i)).isoformat()}
+                      for i, (artist, album) in enumerate(albums) if self.has_review(artist, album)]
+        self.recorded = {}
+        if cache_file:
+            conn = sqlite3.connect(cache_file)
+            for url, body in conn.execute("SELECT url, body FROM responses"):
+                if url.startswith(AMG_SITE):
+                    self.recorded[url[len(AMG_SITE):]] = zlib.decompress(body).decode('utf-8')
+            conn.close()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'recorded': 0, 'not_found': 0, 'api_requests': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def has_review(self, artist, album):
+        return random.Random(f"miss-{self.seed}-{artist}-{album}").random() >= self.miss_rate
+
+    def touch(self, artist, album):
+        """Mark an album's review post as modified now"""
+        for post in self.posts:
+            if (post['artist'], post['album']) == (artist, album):
+                post['modified'] = datetime.now().isoformat(timespec='seconds')
+
+    def rest_posts(self, query, base_url):
+        """(status, JSON body, headers) for a GET /wp-json/wp/v2/posts request"""
+        self.count('api_requests')
+        params = {name: values[0] for name, values in urllib.parse.parse_qs(query).items()}
+        per_page = int(params.get('per_page', 10))
+        page = int(params.get('page', 1))
+        if not 1 <= per_page <= 100:
+            return 400, {'code': 'rest_invalid_param', 'message': "Invalid parameter(s): per_page",
+                         'data': {'status': 400}}, {}
+        with self.lock:
+            posts = list(self.posts)
+        if 'modified_after' in params:
+            posts = [post for post in posts if post['modified'] > params['modified_after']]
+        posts.sort(key=lambda post: post[params.get('orderby', 'date')],
+                   reverse=params.get('order', 'desc') == 'desc')
+        total_pages = (len(posts) + per_page - 1) // per_page
+        if page > max(total_pages, 1):
+            return 400, {'code': 'rest_post_invalid_page_number',
+                         'message': "The page number requested is larger than the number of pages available.",
+                         'data': {'status': 400}}, {}
+        fields = params['_fields'].split(',') if '_fields' in params else None
+        results = []
+        for post in posts[(page - 1) * per_page:page * per_page]:
+            slug = review_slug(post['artist'], post['album'])
+            item = {
+                'id': post['id'],
+                'date': post['date'],
+                'modified': post['modified'],
+                'slug': slug.strip('/'),
+                'link': base_url + slug,
+                'title': {'rendered': f"{post['artist']} &#8211; {post['album']} Review"},
+                'content': {'rendered': review_content(post['artist'], post['album'], self.seed),
+                            'protected': False},
+            }
+            results.append({name: value for name, value in item.items() if fields is None or name in fields})
+        return 200, results, {'X-WP-Total': str(len(posts)), 'X-WP-TotalPages': str(total_pages)}
+
+    def page(self, path, base_url):
+        """HTML for a request path, or None for a 404"""
+        if path in self.recorded:
+            self.count('recorded')
+            return self.recorded[path].replace(AMG_SITE, base_url)
+        url = urllib.parse.urlsplit(path)
+        query = urllib.parse.parse_qs(url.query).get('s')
+        if url.path == '/' and query:
+            match = self.queries.get(query[0].lower())
+            if match is None:
+                return search_page(query[0], '', self.seed, found=False, base_url=base_url)
+            return search_page(*match, self.seed, found=self.has_review(*match), base_url=base_url)
+        if url.path in self.reviews:
+            return review_page(*self.reviews[url.path], self.seed)
+        return None
+
+def make_amg_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            stub.count('requests')
+            time.sleep(stub.latency)
+            url = urllib.parse.urlsplit(self.path)
+            if url.path.rstrip('/') == '/wp-json/wp/v2/posts':
+                status, body, headers = stub.rest_posts(url.query, f"http://{self.headers['Host']}")
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            html = stub.page(self.path, f"http://{self.headers['Host']}")
+            status = 200
+            if html is None:
+                stub.count('not_found')
+                html = "<html><body><h1>Page not found</h1></body></html>"
+                status = 404
+            data = html.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=UTF-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping their keep-alive connections when they exit is not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def start_server(handler, port=0):
+    """Serve a handler on localhost in a background thread; returns the server"""
+    server = StubServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_openai_stub(port=0, **options):
+    """Start the OpenAI stub; returns (server, base_url). The stub state is `server.stub`"""
+    stub = OpenAIStub(**options)
+    server = start_server(make_openai_handler(stub), port)
+    server.stub = stub
+    return server, f"http://127.0.0.1:{server.server_port}/v1"
+
+def start_ollama_stub(port=0, **options):
+    """Start the Ollama stub; returns (server, url). The stub state is `server.stub`"""
+    stub = OllamaStub(**options)
+    server = start_server(make_ollama_handler(stub), port)
+    server.stub = stub
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def start_amg_stub(albums, port=0, **options):
+    """Start the Angry Metal Guy stub; returns (server, base_url). Point amg.AMG_BASE_URL at base_url"""
+    stub = AMGStub(albums, **options)
+    server = start_server(make_amg_handler(stub), port)
+    server.stub = stub
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stub of a remote API")
+    subparsers = parser.add_subparsers(dest='api', required=True)
+    openai_parser = subparsers.add_parser('openai', help="OpenAI files, batches and chat completions")
+    openai_parser.add_argument('--port', type=int, default=8001)
+    openai_parser.add_argument('--batch-delay', type=float, default=2.0,
+                               help="Seconds until a submitted batch completes (default: 2)")
+    openai_parser.add_argument('--latency', type=float, default=0.0,
+                               help="Seconds each chat completion takes (default: 0)")
+    openai_parser.add_argument('--rpm', type=int, help="Requests allowed per window (default: unlimited)")
+    openai_parser.add_argument('--tpm', type=int, help="Tokens allowed per window (default: unlimited)")
+    openai_parser.add_argument('--window', type=float, default=60.0,
+                               help="Length of the rate-limit window in seconds (default: 60)")
+    openai_parser.add_argument('--error-rate', type=float, default=0.0,
+                               help="Fraction of chat completions that fail with a 500 (default: 0)")
+    ollama_parser = subparsers.add_parser('ollama', help="Ollama /api/generate and /api/embed")
+    ollama_parser.add_argument('--port', type=int, default=11435)
+    ollama_parser.add_argument('--latency', type=float, default=0.0,
+                               help="Seconds before the first token (default: 0)")
+    ollama_parser.add_argument('--tokens-per-sec', type=float, default=0.0,
+                               help="Generation speed per request (default: unlimited)")
+    ollama_parser.add_argument('--parallel', type=int, help="Requests generating at once (default: unlimited)")
+    ollama_parser.add_argument('--error-rate', type=float, default=0.0,
+                               help="Fraction of requests that fail with a 500 (default: 0)")
+    amg_parser = subparsers.add_parser('amg', help="Angry Metal Guy search and review pages")
+    amg_parser.add_argument('--port', type=int, default=8002)
+    amg_parser.add_argument('--albums', type=int, default=100,
+                            help="Synthetic albums with pages, as in `benchmarks.amg_pages.favorite_rows` (default: 100)")
+    amg_parser.add_argument('--seed', type=int, default=0)
+    amg_parser.add_argument('--latency', type=float, default=0.0, help="Seconds each page takes (default: 0)")
+    amg_parser.add_argument('--miss-rate', type=float, default=0.25,
+                            help="Fraction of albums without a review (default: 0.25)")
+    amg_parser.add_argument('--replay', metavar='CACHE_FILE',
+                            help="Serve the pages recorded in a response cache file where they match")
+    args = parser.parse_args()
+
+    if args.api == 'openai':
+        server, base_url = start_openai_stub(args.port, batch_delay=args.batch_delay, latency=args.latency,
+                                             rpm=args.rpm, tpm=args.tpm, window=args.window,
+                                             error_rate=args.error_rate)
+    elif args.api == 'ollama':
+        server, base_url = start_ollama_stub(args.port, latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                                             parallel=args.parallel, error_rate=args.error_rate)
+    else:
+        server, base_url = start_amg_stub(album_names(args.albums, args.seed), args.port, seed=args.seed,
+                                          latency=args.latency, miss_rate=args.miss_rate, cache_file=args.replay)
+    print(f"Stub {args.api} API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# chunking.py
+"""Split long reviews so every model request fits the context window.
+
+Reviews are split on the blank lines that extract_review_and_rating puts
+between paragraphs, the chunks are reformatted in parallel and the results
+are joined back together in order. Reviews that fit in one request are
+returned as a single chunk and take the normal path.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    """tiktoken's encoding if it is installed, loaded on first use"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('o200k_base')
+        except Exception:
+            _encoding = None  # Not installed, or its data can't be downloaded
+    return _encoding
+
+def count_tokens(text):
+    """Number of tokens in a text; an estimate of 4 characters per token without tiktoken"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def _split_long_paragraph(paragraph, max_tokens):
+    """Split a paragraph that is too long on its own at sentence, then word boundaries"""
+    pieces = []
+    current = ''
+    for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+        if count_tokens(sentence) > max_tokens:
+            # A single run-on sentence: fall back to splitting between words
+            if current:
+                pieces.append(current)
+            current = ''
+            for word in sentence.split(' '):
+                candidate = f"{current} {word}" if current else word
+                if current and count_tokens(candidate) > max_tokens:
+                    pieces.append(current)
+                    candidate = word
+                current = candidate
+            continue
+        candidate = f"{current} {sentence}" if current else sentence
+        if current and count_tokens(candidate) > max_tokens:
+            pieces.append(current)
+            candidate = sentence
+        current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_review(review_text, max_tokens):
+    """Split a review into chunks of at most `max_tokens` tokens on paragraph boundaries"""
+    if count_tokens(review_text) <= max_tokens:
+        return [review_text]
+
+    paragraphs = []
+    for paragraph in review_text.split("\n\n"):
+        if count_tokens(paragraph) > max_tokens:
+            paragraphs.extend(_split_long_paragraph(paragraph, max_tokens))
+        else:
+            paragraphs.append(paragraph)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in paragraphs:
+        tokens = count_tokens(paragraph)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def reformat_chunks(chunks, reformat_chunk, workers=4):
+    """Run `reformat_chunk(text, part, total)` over all chunks in parallel and join the results.
+
+    Returns None if any chunk fails, so a review is never saved with a piece missing.
+    """
+    total = len(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, total))) as executor:
+        results = list(executor.map(lambda item: reformat_chunk(item[1], item[0] + 1, total),
+                                    enumerate(chunks)))
+    if any(result is None for result in results):
+        return None
+    return "\n\n".join(result.strip() for result in results)
@@ -0,0 +1,62 @@
+# config.py
+"""Settings from config.yaml, read and validated once per process.
+
+    openai:
+      api_key: sk-...
+      base_url: http://127.0.0.1:8001/v1   # optional, e.g. the stub server in benchmarks/
+
+yaml and openai are only imported when a config or a client is needed.
+"""
+import os
+
+CONFIG_FILE = 'config.yaml'
+PLACEHOLDER_KEY = 'YOUR_API_KEY_HERE'
+
+_configs = {}
+
+def read_config(config_file=CONFIG_FILE):
+    """Load and validate a config file; creates a template and returns None when there is none"""
+    import yaml
+
+    # Check if config file exists
+    if not os.path.exists(config_file):
+        # Create a template config file
+        default_config = {
+            'openai': {
+                'api_key': PLACEHOLDER_KEY
+            }
+        }
+
+        with open(config_file, 'w') as f:
+            yaml.dump(default_config, f, default_flow_style=False)
+
+        print(f"Config file '{config_file}' created. Please edit it with your actual API key.")
+        return None
+
+    # Load config from file
+    with open(config_file, 'r') as f:
+        config = yaml.safe_load(f)
+
+    # Validate config
+    if not config or 'openai' not in config or 'api_key' not in config['openai']:
+        print(f"Error: Config file '{config_file}' is missing required fields.")
+        return None
+
+    # Check if the API key is still the default placeholder
+    if config['openai']['api_key'] == PLACEHOLDER_KEY:
+        print(f"Error: Please update '{config_file}' with your actual OpenAI API key.")
+        return None
+
+    return config
+
+def load_config(config_file=CONFIG_FILE):
+    """The validated config, or None after printing what is wrong; the file is only read the first time"""
+    path = os.path.abspath(config_file)
+    if path not in _configs:
+        _configs[path] = read_config(config_file)
+    return _configs[path]
+
+def create_client(config):
+    """Create an OpenAI client; `openai.base_url` in the config points it at another server, e.g. a local mock"""
+    from openai import OpenAI
+    return OpenAI(api_key=config['openai']['api_key'], base_url=config['openai'].get('base_url'))
@@ -0,0 +1,318 @@
+# covers.py
+"""Local cache of album cover art from the "Cover URL" column of the Tidal export.
+
+`python covers.py sync` downloads the covers of new favorites over a pooled
+session, several at a time, and forgets the albums that are no longer
+favorites. Images are stored by the SHA-256 of their bytes, so albums sharing
+the same art (reissues, deluxe editions) share one file:
+
+    covers/objects/ab/abcdef....jpg           original images
+    covers/thumbs/320/ab/abcdef....jpg        thumbnails, made once per size
+    covers/index.sqlite                       cover URL -> image, album -> cover URL
+
+Thumbnails are made with Pillow the first time a size is asked for and kept
+in a disk cache bounded by `max_thumb_bytes`; the least recently served ones
+are deleted first and made again from the original if they're needed later.
+"""
+import argparse
+import csv
+import hashlib
+import importlib.util
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from reviews import album_key
+
+DEFAULT_COVERS_FOLDER = 'covers'
+DEFAULT_SIZES = (160, 320)
+FAVORITES_CSV = 'tidal_favorite_albums.csv'
+
+def create_session(pool_size=8):
+    """Create a requests session that keeps `pool_size` connections to the image host alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def write_atomically(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, path)
+
+def make_thumbnail(source_path, size):
+    """JPEG bytes of an image scaled to fit in size x size pixels; needs Pillow"""
+    import io
+    from PIL import Image
+    with Image.open(source_path) as image:
+        image = image.convert('RGB')
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=85, optimize=True)
+    return output.getvalue()
+
+class CoverCache:
+    """Content-addressed cover images with an LRU-bounded thumbnail cache"""
+
+    def __init__(self, folder=DEFAULT_COVERS_FOLDER, max_thumb_bytes=200 * 1024 * 1024):
+        self.folder = folder
+        self.max_thumb_bytes = max_thumb_bytes
+        os.makedirs(folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(folder, 'index.sqlite'), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS images_digest ON images (digest);
+            CREATE TABLE IF NOT EXISTS albums (
+                album_id TEXT PRIMARY KEY,
+                url TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS thumbs (
+                digest TEXT NOT NULL,
+                pixels INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (digest, pixels)
+            );
+            CREATE INDEX IF NOT EXISTS thumbs_accessed ON thumbs (accessed_at);
+        """)
+        self.thumb_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM thumbs").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def object_path(self, digest):
+        return os.path.join(self.folder, 'objects', digest[:2], f"{digest}.jpg")
+
+    def thumb_path(self, digest, pixels):
+        return os.path.join(self.folder, 'thumbs', str(pixels), digest[:2], f"{digest}.jpg")
+
+    def digest_for(self, url):
+        """Digest of the image downloaded from a URL, if it is still on disk"""
+        with self.lock:
+            row = self.conn.execute("SELECT digest FROM images WHERE url = ?", (url,)).fetchone()
+        if row is None or not os.path.exists(self.object_path(row[0])):
+            return None
+        return row[0]
+
+    def put_image(self, url, data):
+        """Store downloaded image bytes; identical images are only written once"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            with metrics.timer('file_write', kind='cover', target='file'):
+                write_atomically(path, data)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                              (url, digest, len(data), time.time()))
+            self.conn.commit()
+        return digest
+
+    def set_albums(self, album_urls):
+        """Point albums at their cover URLs, replacing the previous favorites"""
+        with self.lock:
+            self.conn.execute("DELETE FROM albums")
+            self.conn.executemany("INSERT INTO albums VALUES (?, ?)", album_urls.items())
+            self.conn.commit()
+
+    def album_digest(self, album_id):
+        with self.lock:
+            row = self.conn.execute("SELECT images.digest FROM albums JOIN images USING (url) "
+                                    "WHERE album_id = ?", (album_id,)).fetchone()
+        return row[0] if row else None
+
+    def prune(self):
+        """Delete images and thumbnails no album refers to; returns the number of images removed"""
+        with self.lock:
+            self.conn.execute("DELETE FROM images WHERE url NOT IN (SELECT url FROM albums)")
+            orphans = [row[0] for row in self.conn.execute(
+                "SELECT DISTINCT digest FROM thumbs WHERE digest NOT IN (SELECT digest FROM images)")]
+            self.conn.commit()
+            kept = {row[0] for row in self.conn.execute("SELECT digest FROM images")}
+        removed = 0
+        objects_folder = os.path.join(self.folder, 'objects')
+        for root, _, files in os.walk(objects_folder):
+            for name in files:
+                if name.endswith('.jpg') and name[:-4] not in kept:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+        for digest in orphans:
+            self._drop_thumbs(digest)
+        return removed
+
+    def _drop_thumbs(self, digest):
+        with self.lock:
+            rows = self.conn.execute("SELECT pixels, size FROM thumbs WHERE digest = ?", (digest,)).fetchall()
+            self.conn.execute("DELETE FROM thumbs WHERE digest = ?", (digest,))
+            self.conn.commit()
+            self.thumb_bytes -= sum(size for _, size in rows)
+        for pixels, _ in rows:
+            if os.path.exists(self.thumb_path(digest, pixels)):
+                os.remove(self.thumb_path(digest, pixels))
+
+    def thumbnail(self, digest, pixels):
+        """Path of an image's thumbnail, made from the original if it isn't cached"""
+        path = self.thumb_path(digest, pixels)
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM thumbs WHERE digest = ? AND pixels = ?",
+                                    (digest, pixels)).fetchone()
+            if row is not None and os.path.exists(path):
+                self.conn.execute("UPDATE thumbs SET accessed_at = ? WHERE digest = ? AND pixels = ?",
+                                  (time.time(), digest, pixels))
+                self.conn.commit()
+                metrics.count('cover_thumbs', result='hit')
+                return path
+
+        with metrics.timer('cover_thumbnail', pixels=pixels):
+            data = make_thumbnail(self.object_path(digest), pixels)
+        write_atomically(path, data)
+        metrics.count('cover_thumbs', result='made')
+        with self.lock:
+            # Another thread may have made the same thumbnail meanwhile
+            old = self.conn.execute("SELECT size FROM thumbs WHERE digest = ? AND pixels = ?",
+                                    (digest, pixels)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO thumbs VALUES (?, ?, ?, ?)",
+                              (digest, pixels, len(data), time.time()))
+            self.thumb_bytes += len(data) - (old[0] if old else 0)
+            if self.thumb_bytes > self.max_thumb_bytes:
+                self._evict()
+            self.conn.commit()
+        return path
+
+    def _evict(self):
+        """Delete least recently served thumbnails until the cache is back under 90% of its budget"""
+        target = self.max_thumb_bytes * 0.9
+        rows = self.conn.execute("SELECT digest, pixels, size FROM thumbs ORDER BY accessed_at").fetchall()
+        for digest, pixels, size in rows:
+            if self.thumb_bytes <= target:
+                break
+            self.conn.execute("DELETE FROM thumbs WHERE digest = ? AND pixels = ?", (digest, pixels))
+            self.thumb_bytes -= size
+            path = self.thumb_path(digest, pixels)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def album_thumbnail(self, album_id, pixels):
+        """Path of an album's cover thumbnail, or None if its cover isn't cached"""
+        digest = self.album_digest(album_id)
+        if digest is None or not os.path.exists(self.object_path(digest)):
+            return None
+        return self.thumbnail(digest, pixels)
+
+    def stats(self):
+        with self.lock:
+            albums = self.conn.execute("SELECT COUNT(*) FROM albums").fetchone()[0]
+            urls, images, image_bytes = self.conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT digest), COALESCE(SUM(size), 0) FROM images").fetchone()
+            thumbs = self.conn.execute("SELECT COUNT(*) FROM thumbs").fetchone()[0]
+        return {'albums': albums, 'urls': urls, 'images': images, 'image_bytes': image_bytes,
+                'thumbs': thumbs, 'thumb_bytes': self.thumb_bytes}
+
+def download_cover(url, session):
+    """Image bytes at a URL; network errors are raised to the caller"""
+    host = urlsplit(url).netloc
+    with metrics.timer('http_request', host=host):
+        response = session.get(url, timeout=30)
+    metrics.count('http_responses', host=host, status=response.status_code)
+    response.raise_for_status()
+    metrics.count('http_bytes', len(response.content), host=host)
+    return response.content
+
+def sync_covers(albums, cache, workers=8, sizes=DEFAULT_SIZES, session=None):
+    """Download the covers of new favorites and make their thumbnails.
+
+    `albums` maps album IDs to cover URLs. Covers already downloaded are kept,
+    albums missing from `albums` are forgotten, and images no album uses any
+    more are deleted. Returns (downloaded, failed, removed).
+    """
+    if sizes and importlib.util.find_spec('PIL') is None:
+        print("Pillow is not installed, so no thumbnails are made (pip install Pillow)")
+        sizes = ()
+    album_urls = {album_id: url for album_id, url in albums.items() if url}
+    cache.set_albums(album_urls)
+    missing = sorted({url for url in album_urls.values() if cache.digest_for(url) is None})
+    session = session or create_session(workers)
+
+    def fetch(url):
+        digest = cache.put_image(url, download_cover(url, session))
+        # Thumbnails are made here so the first request for them doesn't wait
+        for pixels in sizes:
+            cache.thumbnail(digest, pixels)
+        return digest
+
+    downloaded, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, url): url for url in missing}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                downloaded += 1
+                metrics.count('cover_downloads', result='ok')
+            except Exception as e:
+                failed += 1
+                metrics.count('cover_downloads', result='error')
+                print(f"Error downloading cover {futures[future]}: {e}")
+    return downloaded, failed, cache.prune()
+
+def load_cover_urls(csv_file=FAVORITES_CSV):
+    """Album ID -> cover URL for every album in a favorites CSV from tidal.py"""
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        return {album_key(row['Artist'], row['Album']): row.get('Cover URL', '') for row in csv.DictReader(f)}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download and serve album cover art from the Tidal favorites")
+    parser.add_argument('--folder', default=DEFAULT_COVERS_FOLDER,
+                        help=f"Cover cache folder (default: {DEFAULT_COVERS_FOLDER})")
+    parser.add_argument('--max-thumb-mb', type=int, default=200,
+                        help="Disk space for thumbnails in MB (default: 200)")
+    metrics.add_arguments(parser)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync_parser = subparsers.add_parser('sync', help="Download the covers of new favorites")
+    sync_parser.add_argument('--csv', default=FAVORITES_CSV, help=f"Favorites CSV (default: {FAVORITES_CSV})")
+    sync_parser.add_argument('--workers', type=int, default=8, help="Downloads at once (default: 8)")
+    sync_parser.add_argument('--sizes', type=int, nargs='*', default=list(DEFAULT_SIZES),
+                             help="Thumbnail sizes to make right away (default: 160 320)")
+    get_parser = subparsers.add_parser('get', help="Print the path of an album's cover thumbnail")
+    get_parser.add_argument('album_id')
+    get_parser.add_argument('--size', type=int, default=320, help="Thumbnail size in pixels (default: 320)")
+    subparsers.add_parser('stats', help="Show what the cache holds")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
+    cache = CoverCache(args.folder, args.max_thumb_mb * 1024 * 1024)
+    if args.command == 'sync':
+        albums = load_cover_urls(args.csv)
+        start = time.perf_counter()
+        downloaded, failed, removed = sync_covers(albums, cache, args.workers, args.sizes)
+        print(f"Downloaded {downloaded} covers ({failed} failed), removed {removed} unused "
+              f"({time.perf_counter() - start:.1f}s)")
+    elif args.command == 'get':
+        path = cache.album_thumbnail(args.album_id, args.size)
+        print(path or f"No cover cached for {args.album_id}")
+    stats = cache.stats()
+    print(f"{stats['albums']} albums, {stats['images']} images ({stats['image_bytes'] / 1e6:.1f} MB), "
+          f"{stats['thumbs']} thumbnails ({stats['thumb_bytes'] / 1e6:.1f} MB)")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
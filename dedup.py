@@ -0,0 +1,193 @@
+# dedup.py
+"""Group near-duplicate albums and review texts so the expensive stages run once per group.
+
+Favorites often hold the same record several times, as deluxe, remastered or
+anniversary editions. Each album or review becomes a set of shingles
+(character trigrams of the normalized artist and album names, or word
+5-grams of a review) and a MinHash signature of 128 values, computed with
+NumPy. Locality-sensitive hashing then splits the signatures into 16 bands
+of 8 values: items sharing a band land in the same bucket, and only those
+are compared, by the exact Jaccard similarity of their shingles. The work
+grows linearly with the number of items instead of comparing every pair.
+
+Every group gets one canonical member. amg.py only looks up the canonical
+album and copies its review to the other editions; fix_reviews.py and
+ollama_reviews.py only reformat the canonical review text and copy the
+result to the other members, each with its own metadata header. The LLM
+cache doesn't make this redundant: its keys cover the whole prompt, artist
+and album names included, so another edition's copy of a review misses it,
+and so does a text that differs by a corrected typo.
+"""
+import os
+import re
+import zlib
+
+import numpy as np
+
+import metrics
+from matching import normalize_name, trigrams
+from reviews import read_review_file
+from store import read_saved_review
+
+NUM_PERM = 128
+BANDS = 16
+# Albums must share nearly all trigrams, so "Vol. 1" and "Vol. 2" or a sequel stay apart
+ALBUM_THRESHOLD = 0.9
+REVIEW_THRESHOLD = 0.9
+SHINGLE_WORDS = 5
+# Modulus of the random hash functions; values stay below 2**31, so a*x + b fits in 64 bits
+PRIME = (1 << 31) - 1
+WORD_PATTERN = re.compile(r"\w+")
+NUMBER_PATTERN = re.compile(r"\d+")
+
+class MinHasher:
+    """MinHash signatures from `num_perm` random hash functions (a*x + b) mod PRIME"""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, shingles):
+        if not shingles:
+            return np.full(len(self.a), PRIME, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles)) % PRIME
+        return ((np.outer(hashes, self.a) + self.b) % PRIME).min(axis=0)
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def group_near_duplicates(shingle_sets, threshold, hasher=None, bands=BANDS, accept=None):
+    """Groups (lists of at least two indices) of shingle sets with a Jaccard similarity of `threshold` or more.
+
+    `accept(i, j)` can veto a pair that is similar enough but known to differ.
+    """
+    hasher = hasher or MinHasher()
+    rows = len(hasher.a) // bands
+    buckets = {}
+    for i, shingles in enumerate(shingle_sets):
+        if not shingles:
+            continue
+        signature = hasher.signature(shingles)
+        for band in range(bands):
+            key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+            buckets.setdefault(key, []).append(i)
+
+    parent = list(range(len(shingle_sets)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for members in buckets.values():
+        # Comparing against the first member is enough for sets this similar, and keeps buckets linear
+        first = members[0]
+        for i in members[1:]:
+            if find(i) == find(first):
+                continue
+            if jaccard(shingle_sets[first], shingle_sets[i]) >= threshold and (accept is None or accept(first, i)):
+                parent[find(i)] = find(first)
+
+    groups = {}
+    for i in range(len(shingle_sets)):
+        groups.setdefault(find(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+def album_shingles(artist, album):
+    """Trigrams of the artist and album names without edition notes"""
+    return trigrams(f"{normalize_name(artist)} | {normalize_name(album)}")
+
+def text_shingles(text, size=SHINGLE_WORDS):
+    """Word n-grams of a review text"""
+    words = WORD_PATTERN.findall((text or '').casefold())
+    if len(words) <= size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def duplicate_albums(albums, threshold=ALBUM_THRESHOLD):
+    """{AlbumID: canonical AlbumID} for albums that are another edition of an album in the list.
+
+    The canonical album is the one with the shortest name, usually the
+    original edition, which is also the easiest to find on the site.
+    """
+    names = [normalize_name(album['Album']) for album in albums]
+    shingle_sets = [album_shingles(album['Artist'], album['Album']) for album in albums]
+
+    def same_numbers(i, j):
+        return NUMBER_PATTERN.findall(names[i]) == NUMBER_PATTERN.findall(names[j])
+
+    duplicates = {}
+    for group in group_near_duplicates(shingle_sets, threshold, accept=same_numbers):
+        canonical = min(group, key=lambda i: (len(albums[i]['Album']), i))
+        for i in group:
+            if albums[i]['AlbumID'] != albums[canonical]['AlbumID']:
+                duplicates[albums[i]['AlbumID']] = albums[canonical]['AlbumID']
+    metrics.count('dedup_members', len(duplicates), kind='album')
+    return duplicates
+
+def duplicate_texts(texts, threshold=REVIEW_THRESHOLD):
+    """{key: canonical key} for texts, given as {key: text}, that nearly repeat another one"""
+    keys = list(texts)
+    groups = group_near_duplicates([text_shingles(texts[key]) for key in keys], threshold)
+    duplicates = {keys[i]: keys[group[0]] for group in groups for i in group[1:]}
+    metrics.count('dedup_members', len(duplicates), kind='review')
+    return duplicates
+
+def duplicate_review_files(reviews_folder, filenames, threshold=REVIEW_THRESHOLD, store=None):
+    """{filename: canonical filename} for review files (or reviews in the store) that nearly repeat another one"""
+    texts = {filename: read_saved_review(reviews_folder, filename, store)[1] for filename in filenames}
+    return duplicate_texts(texts, threshold)
+
+def reviews_to_reformat(reviews_folder, review_files, albums_data, store=None, dedup=True):
+    """Split review files into (files to reformat, {filename: canonical filename} of the near-duplicates).
+
+    Other editions of an album share their review text, so only one review of
+    each group is reformatted; copy_reformatted gives the others the result.
+    """
+    if not dedup:
+        return review_files, {}
+    known_files = [filename for filename in review_files if filename.split('.')[0] in albums_data]
+    duplicates = duplicate_review_files(reviews_folder, known_files, store=store)
+    if duplicates:
+        review_files = [filename for filename in review_files if filename not in duplicates]
+        print(f"{len(duplicates)} reviews repeat another review and will get a copy of its reformatted version")
+    return review_files, duplicates
+
+def copy_reformatted(reviews_folder, reformatted_folder, duplicates, store=None):
+    """Give every group member the canonical's reformatted review under its own metadata header.
+
+    Returns how many were copied; members whose canonical failed to reformat are
+    left out, and members that already have the same copy are not written again.
+    """
+    copied = 0
+    for filename, canonical in duplicates.items():
+        if store is not None:
+            reformatted = store.get_reformatted(canonical.split('.')[0])
+            if reformatted is not None and store.get_reformatted(filename.split('.')[0]) != reformatted:
+                store.put_reformatted(filename.split('.')[0], *reformatted)
+                copied += 1
+            continue
+        canonical_path = os.path.join(reformatted_folder, canonical)
+        if not os.path.exists(canonical_path):
+            continue
+        _, reformatted = read_review_file(canonical_path)
+        metadata, _ = read_review_file(os.path.join(reviews_folder, filename))
+        content = metadata + "\n\n" + reformatted
+        path = os.path.join(reformatted_folder, filename)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                if f.read() == content:
+                    continue
+        tmp_path = path + '.tmp'
+        with metrics.timer('file_write', kind='reformatted', target='file'):
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        copied += 1
+    metrics.count('dedup_copies', copied, kind='reformatted')
+    return copied
@@ -0,0 +1,460 @@
+# embeddings.py
+"""Embedding index of the album reviews, used to find albums like a given one.
+
+Every review in album_reviews/ is embedded once and stored as a row of a
+float32 matrix in review_index/vectors.f32, which is memory-mapped rather
+than loaded. review_index/index.json maps rows to AlbumIDs and keeps a hash
+of each review, so later runs only embed reviews that are new or changed.
+Vectors are L2-normalized, so cosine similarity with every album is a single
+matrix-vector product. Large catalogs also get an inverted-file (IVF) index
+that only scores the albums in the clusters closest to the query.
+
+Embeddings come from an Ollama embedding model, or from TF-IDF + truncated
+SVD computed with NumPy when no model server is available.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import requests
+
+from reviews import REVIEWS_FOLDER, TOKENIZER_VERSION, load_reviews, tokenize
+
+INDEX_FOLDER = 'review_index'
+OLLAMA_URL = 'http://localhost:11434'
+OLLAMA_EMBED_MODEL = 'nomic-embed-text'
+LSA_DIM = 256
+# Catalogs with at least this many albums are searched through the IVF index
+APPROX_THRESHOLD = 20000
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def normalize_rows(vectors):
+    """Scale each row to unit length so dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+class OllamaEmbedder:
+    """Embeddings from an Ollama embedding model, requested `batch_size` texts at a time"""
+
+    def __init__(self, model=OLLAMA_EMBED_MODEL, url=OLLAMA_URL, session=None, batch_size=32):
+        self.model = model
+        self.url = url
+        self.session = session or requests.Session()
+        self.batch_size = batch_size
+
+    def describe(self):
+        return {'backend': 'ollama', 'model': self.model}
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.session.post(f"{self.url}/api/embed",
+                                         json={'model': self.model, 'input': texts[start:start + self.batch_size]},
+                                         timeout=300)
+            response.raise_for_status()
+            vectors.extend(response.json()['embeddings'])
+        return normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+class LSAEmbedder:
+    """TF-IDF + truncated SVD (latent semantic analysis), CPU only.
+
+    The vocabulary, IDF weights and SVD components are fitted once and saved
+    with the index; reviews added later are projected with the same model, so
+    existing rows never have to be recomputed. The model records the
+    reviews.TOKENIZER_VERSION its vocabulary was built with, so it is refitted
+    once tokenize() changes.
+    """
+
+    def __init__(self, vocabulary, idf, components, tokenizer_version=TOKENIZER_VERSION):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.components = components
+        self.tokenizer_version = tokenizer_version
+
+    def describe(self):
+        return {'backend': 'lsa', 'model': f"tfidf-svd-{self.components.shape[0]}"}
+
+    def tfidf_blocks(self, texts, block_size=512):
+        """Sublinear TF-IDF rows, a dense block at a time to bound memory"""
+        for start in range(0, len(texts), block_size):
+            block = np.zeros((len(texts[start:start + block_size]), len(self.vocabulary)), dtype=np.float32)
+            for row, text in enumerate(texts[start:start + block_size]):
+                columns = [self.vocabulary[token] for token in tokenize(text) if token in self.vocabulary]
+                if columns:
+                    columns, counts = np.unique(columns, return_counts=True)
+                    block[row, columns] = 1 + np.log(counts)
+            block *= self.idf
+            yield normalize_rows(block)
+
+    def embed(self, texts):
+        if not texts:
+            return np.zeros((0, self.components.shape[0]), dtype=np.float32)
+        return normalize_rows(np.vstack([block @ self.components.T for block in self.tfidf_blocks(texts)]))
+
+    @classmethod
+    def fit(cls, texts, dim=LSA_DIM, max_features=20000, min_df=2, power_iterations=3, seed=0):
+        """Fit the vocabulary, IDF and a randomized truncated SVD of the TF-IDF matrix"""
+        if not texts:
+            raise ValueError("No reviews to fit the TF-IDF model on")
+        document_frequency = {}
+        for text in texts:
+            for token in set(tokenize(text)):
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        terms = [t for t, df in document_frequency.items() if df >= min(min_df, len(texts))]
+        terms.sort(key=lambda t: (-document_frequency[t], t))
+        terms = terms[:max_features]
+        if not terms:
+            raise ValueError("The reviews have no words to fit the TF-IDF model on")
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        df = np.array([document_frequency[term] for term in terms], dtype=np.float32)
+        idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+        model = cls(vocabulary, idf, np.zeros((0, len(terms)), dtype=np.float32))
+
+        # Randomized SVD (Halko et al.), touching the TF-IDF matrix only in blocks
+        dim = max(1, min(dim, len(texts), len(terms)))
+        sketch = min(dim + 10, len(texts), len(terms))
+        rng = np.random.default_rng(seed)
+
+        def times(matrix):  # X @ matrix
+            return np.vstack([block @ matrix for block in model.tfidf_blocks(texts)])
+
+        def transposed_times(matrix):  # X.T @ matrix
+            result = np.zeros((len(terms), matrix.shape[1]), dtype=np.float32)
+            start = 0
+            for block in model.tfidf_blocks(texts):
+                result += block.T @ matrix[start:start + len(block)]
+                start += len(block)
+            return result
+
+        basis, _ = np.linalg.qr(times(rng.standard_normal((len(terms), sketch)).astype(np.float32)))
+        for _ in range(power_iterations):
+            basis, _ = np.linalg.qr(times(np.linalg.qr(transposed_times(basis))[0]))
+        _, _, vt = np.linalg.svd(transposed_times(basis).T, full_matrices=False)
+        model.components = vt[:dim].astype(np.float32)
+        return model
+
+    def save(self, path):
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez(path, terms=np.array(terms), idf=self.idf, components=self.components,
+                 tokenizer_version=self.tokenizer_version)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        vocabulary = {str(term): i for i, term in enumerate(data['terms'])}
+        # Models saved before the version was recorded were fitted with older tokens
+        tokenizer_version = int(data['tokenizer_version']) if 'tokenizer_version' in data else None
+        return cls(vocabulary, data['idf'], data['components'], tokenizer_version)
+
+class ReviewIndex:
+    """Memory-mapped matrix of review embeddings with its AlbumID map.
+
+    Rows are only ever appended or overwritten in place; the file grows by
+    doubling, so adding reviews never rewrites the existing vectors. Removed
+    albums leave an empty row behind until the next rebuild.
+    """
+
+    def __init__(self, folder=INDEX_FOLDER):
+        self.folder = folder
+        self.meta_path = os.path.join(folder, 'index.json')
+        self.vectors_path = os.path.join(folder, 'vectors.f32')
+        self.ivf_path = os.path.join(folder, 'ivf.npz')
+        self.meta = {'backend': None, 'model': None, 'dim': 0, 'count': 0, 'ids': [], 'albums': {}, 'hashes': {}}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        self.rows = {album_id: row for row, album_id in enumerate(self.meta['ids']) if album_id is not None}
+        self._matrix = None
+        self._live = None
+        self._ivf = None
+
+    @property
+    def count(self):
+        return self.meta['count']
+
+    def capacity(self):
+        if not self.meta['dim'] or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.meta['dim'])
+
+    def matrix(self, writable=False):
+        """The used rows of the memory-mapped vectors file"""
+        if self._matrix is None or (writable and not self._matrix.flags.writeable):
+            if not self.capacity():
+                return np.zeros((0, self.meta['dim']), dtype=np.float32)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+' if writable else 'r',
+                                     shape=(self.capacity(), self.meta['dim']))
+        return self._matrix[:self.count]
+
+    def live(self):
+        """Boolean mask of the rows that belong to an album still in the index"""
+        if self._live is None:
+            self._live = np.array([album_id is not None for album_id in self.meta['ids']], dtype=bool)
+        return self._live
+
+    def reset(self, backend, model, dim):
+        """Drop every vector, e.g. because the embedding model changed"""
+        self._matrix = None
+        self._live = None
+        self._ivf = None
+        for path in (self.vectors_path, self.ivf_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.meta = {'backend': backend, 'model': model, 'dim': dim, 'count': 0, 'ids': [], 'albums': {}, 'hashes': {}}
+        self.rows = {}
+
+    def _grow(self, rows_needed):
+        capacity = self.capacity()
+        if rows_needed <= capacity:
+            return
+        new_capacity = max(rows_needed, 2 * capacity, 1024)
+        self._matrix = None
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(new_capacity * self.meta['dim'] * 4)
+
+    def add(self, reviews, vectors):
+        """Store the vectors of new or changed reviews"""
+        new = [review['AlbumID'] for review in reviews if review['AlbumID'] not in self.rows]
+        self._grow(self.count + len(new))
+        self.matrix(writable=True)
+        for review, vector in zip(reviews, vectors):
+            album_id = review['AlbumID']
+            row = self.rows.get(album_id)
+            if row is None:
+                row = self.meta['count']
+                self.rows[album_id] = row
+                self.meta['ids'].append(album_id)
+                self.meta['count'] += 1
+            self._matrix[row] = vector
+            self.meta['albums'][album_id] = [review['Artist'], review['Album']]
+            self.meta['hashes'][album_id] = text_hash(review['text'])
+        self._matrix.flush()
+        self._live = None
+        self._ivf = None  # Rows are reassigned to the saved centroids on next use
+
+    def remove(self, album_ids):
+        """Blank out the rows of albums whose review is gone"""
+        if not album_ids:
+            return
+        self.matrix(writable=True)
+        for album_id in album_ids:
+            row = self.rows.pop(album_id)
+            self._matrix[row] = 0
+            self.meta['ids'][row] = None
+            self.meta['albums'].pop(album_id, None)
+            self.meta['hashes'].pop(album_id, None)
+        self._matrix.flush()
+        self._live = None
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def find(self, query):
+        """AlbumIDs matching an album ID or an "Artist - Album" substring"""
+        if query in self.rows:
+            return [query]
+        query = query.casefold()
+        return [album_id for album_id, (artist, album) in self.meta['albums'].items()
+                if query in f"{artist} - {album}".casefold()]
+
+    def build_ivf(self, lists=None, iterations=10, seed=0):
+        """Cluster the vectors with spherical k-means for approximate search"""
+        matrix = np.asarray(self.matrix())
+        live = self.live()
+        lists = lists or max(1, int(np.sqrt(live.sum())))
+        rng = np.random.default_rng(seed)
+        centroids = matrix[rng.choice(np.flatnonzero(live), size=lists, replace=False)]
+        for _ in range(iterations):
+            assignments = self._assign(matrix, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments[live], matrix[live])
+            empty = np.linalg.norm(sums, axis=1) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        np.savez(self.ivf_path, centroids=centroids, trained_count=self.count)
+        self._ivf = self._inverted_lists(matrix, centroids)
+
+    @staticmethod
+    def _assign(matrix, centroids, block_size=65536):
+        return np.concatenate([np.argmax(matrix[start:start + block_size] @ centroids.T, axis=1)
+                               for start in range(0, max(len(matrix), 1), block_size)]).astype(np.int32)
+
+    @classmethod
+    def _inverted_lists(cls, matrix, centroids):
+        """(centroids, rows sorted by cluster, start of each cluster's rows)"""
+        assignments = cls._assign(matrix, centroids)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        return centroids, order, offsets
+
+    def ivf(self):
+        """The inverted lists of the IVF index, or None if there is none"""
+        if self._ivf is None and os.path.exists(self.ivf_path):
+            self._ivf = self._inverted_lists(self.matrix(), np.load(self.ivf_path)['centroids'])
+        return self._ivf
+
+    def search(self, vector, k=10, exclude=(), exact=False, probes=8):
+        """Top-k (AlbumID, similarity) for a normalized query vector"""
+        matrix = self.matrix()
+        # Removed rows and the query albums themselves are never returned
+        valid = self.live().copy()
+        valid[[self.rows[album_id] for album_id in exclude if album_id in self.rows]] = False
+
+        ivf = None if exact or self.count < APPROX_THRESHOLD else self.ivf()
+        if ivf is not None:
+            centroids, order, offsets = ivf
+            probe = np.argsort(-(centroids @ vector))[:probes]
+            rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+            rows = rows[valid[rows]]
+            scores = matrix[rows] @ vector
+        else:
+            rows = np.flatnonzero(valid)
+            scores = (matrix @ vector)[rows]
+
+        k = min(k, len(rows))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.meta['ids'][rows[i]], float(scores[i])) for i in top]
+
+    def similar(self, album_ids, k=10, exact=False):
+        """Albums closest to the average of the given albums' review vectors"""
+        matrix = self.matrix()
+        query = normalize_rows(np.mean([matrix[self.rows[album_id]] for album_id in album_ids],
+                                       axis=0, keepdims=True))[0]
+        return self.search(query, k, exclude=album_ids, exact=exact)
+
+def create_embedder(args, index, reviews):
+    """The embedder for the requested backend; LSA is refitted on a full rebuild or a tokenizer change"""
+    if args.backend == 'ollama':
+        return OllamaEmbedder(args.model or OLLAMA_EMBED_MODEL, args.url, batch_size=args.batch_size)
+    model_path = os.path.join(index.folder, 'lsa.npz')
+    if not args.rebuild and index.meta['backend'] == 'lsa' and os.path.exists(model_path):
+        embedder = LSAEmbedder.load(model_path)
+        if embedder.tokenizer_version == TOKENIZER_VERSION:
+            return embedder
+        print("The TF-IDF model was fitted with an older tokenizer, refitting it")
+    print(f"Fitting TF-IDF + SVD on {len(reviews)} reviews...")
+    embedder = LSAEmbedder.fit([review['text'] for review in reviews], dim=args.dim)
+    os.makedirs(index.folder, exist_ok=True)
+    embedder.save(model_path)
+    index.reset(**embedder.describe(), dim=embedder.components.shape[0])
+    return embedder
+
+def update_index(index, embedder, reviews, batch_size=32):
+    """Embed new and changed reviews and drop removed ones; returns (added, removed)"""
+    description = embedder.describe()
+    if (index.meta['backend'], index.meta['model']) != (description['backend'], description['model']):
+        if index.count:
+            print(f"Embedding model changed to {description['model']}, rebuilding the index")
+        index.reset(description['backend'], description['model'], 0)
+
+    pending = [review for review in reviews
+               if index.meta['hashes'].get(review['AlbumID']) != text_hash(review['text'])]
+    current = {review['AlbumID'] for review in reviews}
+    removed = [album_id for album_id in index.rows if album_id not in current]
+    index.remove(removed)
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        vectors = embedder.embed([review['text'] for review in batch])
+        if not index.meta['dim']:
+            index.meta['dim'] = vectors.shape[1]
+        index.add(batch, vectors)
+        index.save()
+        print(f"Embedded {min(start + batch_size, len(pending))}/{len(pending)} reviews")
+    index.save()
+
+    # Retrain the clusters once the catalog has doubled since they were built
+    if index.count >= APPROX_THRESHOLD:
+        trained = int(np.load(index.ivf_path)['trained_count']) if os.path.exists(index.ivf_path) else 0
+        if index.count >= 2 * trained:
+            print("Building the approximate (IVF) index...")
+            index.build_ivf()
+    return len(pending), len(removed)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Embed album reviews and find albums like a given one")
+    parser.add_argument('--index', default=INDEX_FOLDER, help=f"Index folder (default: {INDEX_FOLDER})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Embed new and changed reviews")
+    build_parser.add_argument('--reviews', default=REVIEWS_FOLDER,
+                              help=f"Folder with the review files (default: {REVIEWS_FOLDER})")
+    build_parser.add_argument('--store', metavar='FILE',
+                              help="Read the reviews from this library store (see store.py) instead of --reviews")
+    build_parser.add_argument('--backend', choices=['lsa', 'ollama'], default='lsa',
+                              help="TF-IDF + SVD on the CPU, or an Ollama embedding model (default: lsa)")
+    build_parser.add_argument('--model', help=f"Ollama embedding model (default: {OLLAMA_EMBED_MODEL})")
+    build_parser.add_argument('--url', default=OLLAMA_URL, help=f"Ollama server (default: {OLLAMA_URL})")
+    build_parser.add_argument('--dim', type=int, default=LSA_DIM,
+                              help=f"Dimensions of the LSA embeddings (default: {LSA_DIM})")
+    build_parser.add_argument('--batch-size', type=int, default=32,
+                              help="Reviews embedded per request (default: 32)")
+    build_parser.add_argument('--rebuild', action='store_true',
+                              help="Re-embed every review, refitting the LSA model")
+
+    similar_parser = subparsers.add_parser('similar', help="Albums whose reviews are closest to the given ones")
+    similar_parser.add_argument('albums', nargs='+', help="Album IDs or parts of \"Artist - Album\"")
+    similar_parser.add_argument('-k', type=int, default=10, help="Number of albums to show (default: 10)")
+    similar_parser.add_argument('--exact', action='store_true',
+                                help="Score every album even when an approximate index exists")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    index = ReviewIndex(args.index)
+
+    if args.command == 'build':
+        if args.store:
+            from store import LibraryStore
+            reviews = list(LibraryStore(args.store).iter_reviews())
+        else:
+            reviews = load_reviews(args.reviews)
+        if args.rebuild:
+            index.reset(None, None, 0)
+        try:
+            embedder = create_embedder(args, index, reviews)
+        except ValueError as e:
+            print(e)
+            return
+        start = time.perf_counter()
+        added, removed = update_index(index, embedder, reviews, args.batch_size)
+        print(f"{added} reviews embedded, {removed} removed, {len(index.rows)} in the index "
+              f"({time.perf_counter() - start:.1f}s)")
+        return
+
+    if not index.count:
+        print(f"The index in '{args.index}' is empty, run 'python embeddings.py build' first")
+        return
+    seeds = []
+    for query in args.albums:
+        matches = index.find(query)
+        if not matches:
+            print(f"No album in the index matches '{query}'")
+            return
+        seeds.extend(matches)
+
+    start = time.perf_counter()
+    results = index.similar(seeds, args.k, args.exact)
+    elapsed = (time.perf_counter() - start) * 1000
+    print("Albums like " + ", ".join(" - ".join(index.meta['albums'][album_id]) for album_id in seeds) + ":")
+    for album_id, score in results:
+        artist, album = index.meta['albums'][album_id]
+        print(f"  {score:.3f}  {artist} - {album} (ID: {album_id})")
+    print(f"({elapsed:.1f} ms over {len(index.rows)} albums)")
+
+if __name__ == "__main__":
+    main()
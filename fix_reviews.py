@@ -1,49 +1,25 @@
 import os
-import csv
-import yaml
-from openai import OpenAI
+import json
+import argparse
+import asyncio
+import random
+import re
+from openai import AsyncOpenAI, APIConnectionError, InternalServerError, RateLimitError
 import time
 
-def load_config():
-    """Load configuration from config.yaml file"""
-    config_file = 'config.yaml'
-    
-    # Check if config file exists
-    if not os.path.exists(config_file):
-        # Create a template config file
-        default_config = {
-            'openai': {
-                'api_key': 'YOUR_API_KEY_HERE'
-            }
-        }
-        
-        with open(config_file, 'w') as f:
-            yaml.dump(default_config, f, default_flow_style=False)
-        
-        print(f"Config file '{config_file}' created. Please edit it with your actual API key.")
-        return None
-    
-    # Load config from file
-    with open(config_file, 'r') as f:
-        config = yaml.safe_load(f)
-    
-    # Validate config
-    if not config or 'openai' not in config or 'api_key' not in config['openai']:
-        print(f"Error: Config file '{config_file}' is missing required fields.")
-        return None
-    
-    # Check if the API key is still the default placeholder
-    if config['openai']['api_key'] == 'YOUR_API_KEY_HERE':
-        print(f"Error: Please update '{config_file}' with your actual OpenAI API key.")
-        return None
-    
-    return config
+import metrics
+from chunking import reformat_chunks, split_review
+from config import create_client, load_config
+from dedup import copy_reformatted, reviews_to_reformat
+from llm_cache import LLMCache, DEFAULT_CACHE_FILE, cache_key
+from reviews import load_albums_data
+from store import LibraryStore, has_reformatted, read_saved_review, review_filenames
 
-# Function to process a review with GPT-4.5
-def process_review_with_gpt(client, review_text, artist, album):
-    try:
-        # Create a prompt for GPT to reformat the review
-        prompt = f"""
+MODEL = "gpt-4.5-preview"
+TEMPERATURE = 0.2  # Low temperature for more consistent formatting
+SYSTEM_PROMPT = "You are a helpful assistant that specializes in reformatting music reviews to make them more readable while preserving all original content."
+
+PROMPT_TEMPLATE = """
 I have a music review for the album "{album}" by "{artist}" from Angry Metal Guy website.
 Please reformat this review to make it easier to read in a .txt file, with:
 1. Clear sections
@@ -58,35 +34,582 @@ Here is the review:
 Provide only the reformatted review without any additional commentary.
 """
 
+# Used instead of PROMPT_TEMPLATE for each part of a review that is too long for one request
+CHUNK_PROMPT_TEMPLATE = """
+I have a music review for the album "{album}" by "{artist}" from Angry Metal Guy website.
+The review is long, so you are getting it in parts. This is part {part} of {total}.
+Please reformat this part to make it easier to read in a .txt file, with:
+1. Clear sections
+2. Better paragraph organization
+4. Keep all the original content but make it more reader-friendly
+
+Here is part {part} of the review:
+---
+{review_text}
+---
+
+Provide only the reformatted text of this part without any additional commentary.
+"""
+
+# Reviews longer than this are split into parts that are reformatted in parallel.
+# The answer is about as long as the input, so this also bounds the output length.
+MAX_CHUNK_TOKENS = 8000
+
+def build_messages(review_text, artist, album, part=1, total=1):
+    """Create the chat messages asking GPT to reformat the review, or one part of it"""
+    if total > 1:
+        prompt = CHUNK_PROMPT_TEMPLATE.format(album=album, artist=artist, review_text=review_text,
+                                              part=part, total=total)
+    else:
+        prompt = PROMPT_TEMPLATE.format(album=album, artist=artist, review_text=review_text)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def review_cache_key(review_text, artist, album, part=1, total=1, model=MODEL):
+    """Key for this review (or part of a review) in the shared LLM result cache"""
+    return cache_key(build_messages(review_text, artist, album, part, total), model, {'temperature': TEMPERATURE})
+
+def review_requests(review_text, artist, album, max_chunk_tokens=MAX_CHUNK_TOKENS, model=MODEL):
+    """The (text, part, total, cache key) of every request needed for a review"""
+    chunks = split_review(review_text, max_chunk_tokens)
+    total = len(chunks)
+    return [(chunk, part, total, review_cache_key(chunk, artist, album, part, total, model))
+            for part, chunk in enumerate(chunks, 1)]
+
+def cached_review(cache, review_text, artist, album, max_chunk_tokens=MAX_CHUNK_TOKENS, model=MODEL):
+    """The reformatted review if every part of it is in the cache, otherwise None"""
+    if cache is None:
+        return None
+    parts = []
+    for _, _, _, key in review_requests(review_text, artist, album, max_chunk_tokens, model):
+        part = cache.get(key)
+        if part is None:
+            return None
+        parts.append(part)
+    return "\n\n".join(part.strip() for part in parts)
+
+def cache_response(cache, key, response, latency=None, model=MODEL):
+    """Store a chat completion's text and usage in the cache"""
+    if cache is None:
+        return
+    usage = response.usage
+    cache.put(key, model, response.choices[0].message.content.strip(),
+              usage.prompt_tokens if usage else None,
+              usage.completion_tokens if usage else None,
+              latency)
+
+def record_usage(usage, mode, model=MODEL):
+    """Count a chat completion's prompt and completion tokens in the metrics"""
+    if usage:
+        metrics.count('llm_tokens', usage.prompt_tokens, backend='openai', model=model, mode=mode, direction='in')
+        metrics.count('llm_tokens', usage.completion_tokens, backend='openai', model=model, mode=mode,
+                      direction='out')
+
+# Function to process a review with GPT-4.5
+def process_review_with_gpt(client, review_text, artist, album, cache=None, max_chunk_tokens=MAX_CHUNK_TOKENS,
+                            model=MODEL):
+    requests = review_requests(review_text, artist, album, max_chunk_tokens, model)
+    
+    def reformat_part(chunk, part, total):
+        key = review_cache_key(chunk, artist, album, part, total, model)
+        if cache is not None:
+            cached_part = cache.get(key)
+            if cached_part is not None:
+                metrics.count('llm_cache_hits', backend='openai')
+                return cached_part
+        
         # Call the OpenAI API with GPT-4.5
-        response = client.chat.completions.create(
-            model="gpt-4.5-preview",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that specializes in reformatting music reviews to make them more readable while preserving all original content."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2  # Low temperature for more consistent formatting
-        )
+        start = time.perf_counter()
+        with metrics.timer('llm_request', backend='openai', model=model, mode='serial'):
+            response = client.chat.completions.create(
+                model=model,
+                messages=build_messages(chunk, artist, album, part, total),
+                temperature=TEMPERATURE
+            )
+        record_usage(response.usage, 'serial', model)
+        cache_response(cache, key, response, time.perf_counter() - start, model)
         
         # Extract the reformatted review from the response
-        reformatted_review = response.choices[0].message.content.strip()
-        return reformatted_review
+        return response.choices[0].message.content.strip()
+    
+    try:
+        if len(requests) == 1:
+            return reformat_part(review_text, 1, 1)
+        # Long review: reformat the parts in parallel and join them
+        return reformat_chunks([chunk for chunk, _, _, _ in requests], reformat_part)
         
     except Exception as e:
         print(f"Error processing review with GPT: {e}")
         return None
 
+def save_reformatted_review(reformatted_path, metadata, reformatted_review, store=None, model=MODEL):
+    """Write a reformatted review under the original metadata, or put it in the library store"""
+    if store is not None:
+        with metrics.timer('file_write', kind='reformatted', target='store'):
+            store.put_reformatted(os.path.basename(reformatted_path).split('.')[0], model, reformatted_review)
+        return
+    with metrics.timer('file_write', kind='reformatted', target='file'):
+        with open(reformatted_path, 'w', encoding='utf-8') as f:
+            # Keep the original metadata
+            f.write(metadata + "\n\n")
+            f.write(f"--- REFORMATTED BY {model.upper()} ---\n\n")
+            f.write(reformatted_review)
+
+# Batch API mode: all pending reviews go into one JSONL file that OpenAI
+# processes asynchronously at a lower price than individual requests.
+BATCH_FOLDER = "batches"
+BATCH_STATE_FILE = os.path.join(BATCH_FOLDER, "batch_state.json")
+BATCH_MAX_REQUESTS = 50000  # OpenAI's limit per batch
+BATCH_FINAL_STATES = ('applied', 'failed', 'expired', 'cancelled')
+
+def load_batch_state():
+    if not os.path.exists(BATCH_STATE_FILE):
+        return {'batches': []}
+    with open(BATCH_STATE_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_batch_state(state):
+    os.makedirs(BATCH_FOLDER, exist_ok=True)
+    tmp_file = BATCH_STATE_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, BATCH_STATE_FILE)
+
+def batch_requests(job, cache=None, max_chunk_tokens=MAX_CHUNK_TOKENS):
+    """Batch API requests for the parts of a review that aren't cached yet.
+
+    custom_id is the review file name, with "#part/total" appended when a long
+    review is split into parts.
+    """
+    filename, artist, album, _, original_review = job
+    requests = []
+    for chunk, part, total, key in review_requests(original_review, artist, album, max_chunk_tokens):
+        if cache is not None and cache.get(key) is not None:
+            continue
+        requests.append({
+            'custom_id': filename if total == 1 else f"{filename}#{part}/{total}",
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': {
+                'model': MODEL,
+                'messages': build_messages(chunk, artist, album, part, total),
+                'temperature': TEMPERATURE,
+            },
+        })
+    return requests
+
+def start_batch(client, entry, state):
+    """Create the batch for an uploaded input file and record its id"""
+    batch = client.batches.create(
+        input_file_id=entry['input_file_id'],
+        endpoint='/v1/chat/completions',
+        completion_window='24h'
+    )
+    entry.update(id=batch.id, status=batch.status)
+    save_batch_state(state)
+    return batch
+
+def submit_batches(client, jobs, state, cache=None, max_chunk_tokens=MAX_CHUNK_TOKENS):
+    """Upload pending jobs as batch files and start the batches, recording each step.
+
+    The uploaded file is recorded before its batch is created, so a run that
+    stops in between can find the batch again (see reconcile_batches) instead
+    of submitting the reviews twice.
+    """
+    os.makedirs(BATCH_FOLDER, exist_ok=True)
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    
+    # Pack whole reviews into batches of at most BATCH_MAX_REQUESTS requests
+    groups = [[]]
+    for job in jobs:
+        requests = batch_requests(job, cache, max_chunk_tokens)
+        if groups[-1] and len(groups[-1]) + len(requests) > BATCH_MAX_REQUESTS:
+            groups.append([])
+        groups[-1].extend(requests)
+    
+    submitted = []
+    for i, group in enumerate(groups):
+        if not group:
+            continue
+        input_path = os.path.join(BATCH_FOLDER, f"batch_input_{timestamp}_{i}.jsonl")
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for request in group:
+                f.write(json.dumps(request) + "\n")
+        
+        with open(input_path, 'rb') as f:
+            input_file = client.files.create(file=f, purpose='batch')
+        entry = {'id': None, 'input_file': input_path, 'input_file_id': input_file.id, 'status': 'uploaded'}
+        state['batches'].append(entry)
+        save_batch_state(state)
+        batch = start_batch(client, entry, state)
+        submitted.append(entry)
+        metrics.count('batch_requests_submitted', len(group), backend='openai')
+        print(f"Submitted batch {batch.id} with {len(group)} requests")
+    return submitted
+
+def reconcile_batches(client, state):
+    """Give uploaded files whose batch was never recorded the id of their batch.
+
+    The batch is looked up by its input file among the account's batches; if
+    it was never created, it is created now from the file already uploaded.
+    """
+    unrecorded = {entry['input_file_id']: entry for entry in state['batches']
+                  if entry['id'] is None and entry['status'] not in BATCH_FINAL_STATES}
+    if not unrecorded:
+        return
+    for batch in client.batches.list(limit=100):
+        entry = unrecorded.pop(batch.input_file_id, None)
+        if entry is not None:
+            entry.update(id=batch.id, status=batch.status)
+            print(f"Found batch {batch.id} for {entry['input_file']}")
+        if not unrecorded:
+            break
+    save_batch_state(state)
+    for entry in unrecorded.values():
+        batch = start_batch(client, entry, state)
+        print(f"Started batch {batch.id} for {entry['input_file']}, uploaded by an interrupted run")
+
+def batch_filenames(entry):
+    """Review files with requests in a batch, from its input file"""
+    if not os.path.exists(entry['input_file']):
+        return set()
+    with open(entry['input_file'], 'r', encoding='utf-8') as f:
+        return {json.loads(line)['custom_id'].partition('#')[0] for line in f if line.strip()}
+
+def apply_batch_results(client, batch, albums, reviews_folder, reformatted_folder, cache=None,
+                        max_chunk_tokens=MAX_CHUNK_TOKENS, store=None):
+    """Download a finished batch's output and write each result to reformatted_reviews/<id>.txt or the store.
+
+    `albums` maps review file names to (artist, album), which the prompts and cache keys name.
+    """
+    # Reformatted text of each returned part, per review file
+    results = {}
+    if batch.output_file_id:
+        output = client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            filename, _, part = result['custom_id'].partition('#')
+            part = int(part.split('/')[0]) if part else 1
+            response = result.get('response') or {}
+            if response.get('status_code') != 200:
+                print(f"Batch request for {result['custom_id']} failed: {result.get('error') or response.get('body')}")
+                continue
+            results.setdefault(filename, {})[part] = response['body']
+    
+    saved = 0
+    for filename, parts in results.items():
+        if filename not in albums:
+            print(f"No album data for {filename}, its batch results are not saved")
+            continue
+        artist, album = albums[filename]
+        metadata, original_review = read_saved_review(reviews_folder, filename, store)
+        reformatted_parts = []
+        for chunk, part, total, key in review_requests(original_review, artist, album, max_chunk_tokens):
+            if part in parts:
+                text = parts[part]['choices'][0]['message']['content'].strip()
+                usage = parts[part].get('usage') or {}
+                metrics.count('llm_tokens', usage.get('prompt_tokens', 0), backend='openai', model=MODEL,
+                              mode='batch', direction='in')
+                metrics.count('llm_tokens', usage.get('completion_tokens', 0), backend='openai', model=MODEL,
+                              mode='batch', direction='out')
+                if cache is not None:
+                    cache.put(key, MODEL, text, usage.get('prompt_tokens'), usage.get('completion_tokens'))
+            else:
+                # Parts answered earlier were not resubmitted
+                text = cache.get(key) if cache is not None else None
+            reformatted_parts.append(text)
+        
+        if any(text is None for text in reformatted_parts):
+            print(f"Some parts of {filename} are missing, it will be resubmitted on the next run")
+            continue
+        save_reformatted_review(os.path.join(reformatted_folder, filename), metadata,
+                                "\n\n".join(reformatted_parts), store)
+        saved += 1
+    
+    if batch.error_file_id:
+        errors = client.files.content(batch.error_file_id).text
+        for line in errors.splitlines():
+            if line.strip():
+                result = json.loads(line)
+                print(f"Batch request for {result.get('custom_id')} failed: {result.get('error') or result.get('response')}")
+    return saved
+
+def run_batch_mode(client, jobs, reviews_folder, reformatted_folder, poll_interval=60, cache=None,
+                   max_chunk_tokens=MAX_CHUNK_TOKENS, store=None):
+    """Submit pending reviews through the Batch API and wait for the results.
+
+    Batches that were already submitted (recorded in batches/batch_state.json)
+    are resumed instead of being sent again, so an interrupted run can simply
+    be restarted; reviews that are in none of them are submitted alongside.
+    """
+    state = load_batch_state()
+    reconcile_batches(client, state)
+    active = [b for b in state['batches'] if b['status'] not in BATCH_FINAL_STATES]
+    in_batches = set().union(*(batch_filenames(entry) for entry in active))
+    if active:
+        print(f"Resuming {len(active)} batch(es) from {BATCH_STATE_FILE}")
+    
+    albums = {filename: (artist, album) for filename, artist, album, _, _ in jobs}
+    pending = []
+    for job in jobs:
+        filename, artist, album, metadata, original_review = job
+        reformatted_path = os.path.join(reformatted_folder, filename)
+        if filename in in_batches or has_reformatted(reformatted_path, store):
+            continue
+        reformatted_review = cached_review(cache, original_review, artist, album, max_chunk_tokens)
+        if reformatted_review is not None:
+            save_reformatted_review(reformatted_path, metadata, reformatted_review, store)
+            continue
+        pending.append(job)
+    if pending:
+        print(f"Submitting {len(pending)} reviews to the Batch API...")
+        active += submit_batches(client, pending, state, cache, max_chunk_tokens)
+    elif not active:
+        print("All reviews are already reformatted.")
+        return
+    
+    while active:
+        for entry in list(active):
+            batch = client.batches.retrieve(entry['id'])
+            counts = batch.request_counts
+            progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+            print(f"Batch {batch.id}: {batch.status}{progress}")
+            
+            if batch.status == 'completed':
+                if batch.completed_at:
+                    metrics.observe('batch_turnaround', batch.completed_at - batch.created_at, backend='openai')
+                saved = apply_batch_results(client, batch, albums, reviews_folder, reformatted_folder, cache,
+                                            max_chunk_tokens, store)
+                print(f"Saved {saved} reformatted reviews from batch {batch.id}")
+                entry['status'] = 'applied'
+            elif batch.status in ('failed', 'expired', 'cancelled'):
+                # Expired batches still return the requests that finished in time
+                if batch.status == 'expired':
+                    apply_batch_results(client, batch, albums, reviews_folder, reformatted_folder, cache,
+                                        max_chunk_tokens, store)
+                entry['status'] = batch.status
+            else:
+                entry['status'] = batch.status
+            save_batch_state(state)
+            
+            if entry['status'] in BATCH_FINAL_STATES:
+                active.remove(entry)
+        
+        if active:
+            time.sleep(poll_interval)
+
+# Async mode: many requests in flight, with the in-flight limit steered by
+# the x-ratelimit-* headers OpenAI sends back on every response.
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+MAX_ATTEMPTS = 6
+
+def parse_reset(value):
+    """Turn a reset header like "1s", "6m0s" or "250ms" into seconds"""
+    if not value:
+        return None
+    seconds = 0.0
+    for amount, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        seconds += float(amount) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return seconds
+
+class AdaptiveLimiter:
+    """Limit on concurrent requests that follows the account's rate-limit headroom.
+
+    The limit grows by one after a full window of successful requests while
+    more than `low_water` of the request and token quotas remain, halves when
+    the quota runs low or a 429 comes back, and all requests pause until the
+    quota resets once it is exhausted.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, low_water=0.1):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.low_water = low_water
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        wait = self.paused_until - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def decrease(self):
+        self.limit = max(self.minimum, self.limit // 2)
+        self.successes = 0
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def on_success(self, headers):
+        """Adjust the limit from the remaining-quota headers of a successful response"""
+        headroom = []
+        for kind in ('requests', 'tokens'):
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            limit = headers.get(f'x-ratelimit-limit-{kind}')
+            if remaining is None or not limit:
+                continue
+            headroom.append(int(remaining) / int(limit))
+            if int(remaining) == 0:
+                self.pause(parse_reset(headers.get(f'x-ratelimit-reset-{kind}')) or 1.0)
+        
+        if headroom and min(headroom) < self.low_water:
+            self.decrease()
+            return
+        self.successes += 1
+        if self.successes >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+            self.successes = 0
+
+    def on_rate_limited(self, retry_after):
+        self.decrease()
+        self.pause(retry_after)
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retrying: Retry-After if the server sent one, otherwise exponential backoff with full jitter"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, 0.5)
+            except ValueError:
+                pass
+        reset = parse_reset(response.headers.get('x-ratelimit-reset-requests'))
+        if reset:
+            return reset + random.uniform(0, 0.5)
+    return random.uniform(0, min(60, 2 ** attempt))
+
+async def request_with_retries(client, limiter, messages):
+    """Send one chat completion, retrying rate limits and transient failures"""
+    for attempt in range(MAX_ATTEMPTS):
+        async with limiter:
+            try:
+                start = time.perf_counter()
+                with metrics.timer('llm_request', backend='openai', model=MODEL, mode='async'):
+                    raw = await client.chat.completions.with_raw_response.create(
+                        model=MODEL, messages=messages, temperature=TEMPERATURE)
+                latency = time.perf_counter() - start
+                limiter.on_success(raw.headers)
+                response = raw.parse()
+                record_usage(response.usage, 'async')
+                return response, latency
+            except RETRYABLE_ERRORS as e:
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                metrics.count('llm_retries', backend='openai', reason=type(e).__name__)
+                delay = retry_delay(e, attempt)
+                if isinstance(e, RateLimitError):
+                    limiter.on_rate_limited(delay)
+        # Wait outside the limiter so other requests can use the slot
+        await asyncio.sleep(delay)
+
+async def run_async_mode(config, jobs, reformatted_folder, cache=None, initial_concurrency=4, max_concurrency=32,
+                         max_chunk_tokens=MAX_CHUNK_TOKENS, store=None):
+    """Reformat all jobs concurrently with AsyncOpenAI under an adaptive in-flight limit"""
+    client = AsyncOpenAI(api_key=config['openai']['api_key'], base_url=config['openai'].get('base_url'),
+                         max_retries=0)  # Retries are handled here so backoff can adapt concurrency
+    limiter = AdaptiveLimiter(initial_concurrency, maximum=max_concurrency)
+    done = 0
+    failed = 0
+    
+    async def run(job):
+        nonlocal done, failed
+        filename, artist, album, metadata, original_review = job
+        reformatted_path = os.path.join(reformatted_folder, filename)
+        
+        async def reformat_part(chunk, part, total, key):
+            cached_part = cache.get(key) if cache is not None else None
+            if cached_part is not None:
+                metrics.count('llm_cache_hits', backend='openai')
+                return cached_part, 0.0
+            response, latency = await request_with_retries(
+                client, limiter, build_messages(chunk, artist, album, part, total))
+            cache_response(cache, key, response, latency)
+            return response.choices[0].message.content.strip(), latency
+        
+        reformatted_review = cached_review(cache, original_review, artist, album, max_chunk_tokens)
+        source = "cache"
+        if reformatted_review is None:
+            # Long reviews are split and their parts sent concurrently
+            try:
+                results = await asyncio.gather(*(reformat_part(*request) for request in
+                                                 review_requests(original_review, artist, album,
+                                                                 max_chunk_tokens)))
+            except Exception as e:
+                failed += 1
+                done += 1
+                print(f"[{done}/{len(jobs)}] Failed to reformat review for {artist} - {album}: {e}")
+                return
+            reformatted_review = "\n\n".join(text.strip() for text, _ in results)
+            source = f"{max(latency for _, latency in results):.1f}s"
+            if len(results) > 1:
+                source += f", {len(results)} parts"
+        
+        save_reformatted_review(reformatted_path, metadata, reformatted_review, store)
+        done += 1
+        target = store.path if store is not None else reformatted_path
+        print(f"[{done}/{len(jobs)}] {artist} - {album}: saved to {target} "
+              f"({source}, {limiter.limit} in flight allowed)")
+    
+    try:
+        await asyncio.gather(*(run(job) for job in jobs))
+    finally:
+        await client.close()
+    print(f"{len(jobs) - failed} reviews reformatted, {failed} failed")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reformat album reviews with the OpenAI API")
+    parser.add_argument('--batch', action='store_true',
+                        help="Send all pending reviews through the Batch API instead of one request at a time")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Send reviews concurrently, adapting to the account's rate limits")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="Initial number of requests in flight in async mode (default: 4)")
+    parser.add_argument('--max-concurrency', type=int, default=32,
+                        help="Upper bound on requests in flight in async mode (default: 32)")
+    parser.add_argument('--poll-interval', type=int, default=60,
+                        help="Seconds between batch status checks (default: 60)")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE,
+                        help=f"Shared LLM result cache (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Send every review to the model even if an identical request was cached")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="Reformat near-identical reviews (other editions of an album) separately "
+                             "instead of copying one result")
+    parser.add_argument('--store', metavar='FILE',
+                        help="Read reviews from this library store (see store.py) and save the results there "
+                             "instead of in text files")
+    parser.add_argument('--max-chunk-tokens', type=int, default=MAX_CHUNK_TOKENS,
+                        help=f"Split reviews longer than this many tokens into parts (default: {MAX_CHUNK_TOKENS})")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
+    
     # Load configuration
     config = load_config()
     if not config:
         return
     
-    # Get API key from config
-    api_key = config['openai']['api_key']
-    
     # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
+    client = create_client(config)
     
     # Setup directories
     reviews_folder = "album_reviews"
@@ -96,30 +619,46 @@ def main():
     if not os.path.exists(reformatted_folder):
         os.makedirs(reformatted_folder)
     
-    # Read the albums data from CSV
-    albums_data = {}
-    
+    # Read the albums data from CSV, or from the store
+    store = LibraryStore(args.store) if args.store else None
     try:
-        with open('tidal_favorite_albums_with_ratings.csv', 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                album_id = row.get('AlbumID')
-                if album_id:
-                    albums_data[album_id] = {
-                        'Artist': row.get('Artist', ''),
-                        'Album': row.get('Album', ''),
-                        'AMG_Rating': row.get('AMG_Rating', '')
-                    }
+        albums_data = store.albums_data() if store is not None else load_albums_data()
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         return
     
+    cache = None if args.no_cache else LLMCache(args.cache)
+    
     # Process all review files
-    review_files = [f for f in os.listdir(reviews_folder) if f.endswith('.txt')]
+    review_files = review_filenames(reviews_folder, store)
+    
+    # Other editions of an album share their review text; reformat it once and copy the result
+    review_files, duplicates = reviews_to_reformat(reviews_folder, review_files, albums_data, store,
+                                                   not args.no_dedup)
+    
+    if args.batch or args.use_async:
+        jobs = []
+        for filename in review_files:
+            album_id = filename.split('.')[0]
+            if album_id not in albums_data:
+                print(f"Warning: No album data found for ID {album_id}, skipping")
+                continue
+            metadata, original_review = read_saved_review(reviews_folder, filename, store)
+            jobs.append((filename, albums_data[album_id]['Artist'], albums_data[album_id]['Album'],
+                         metadata, original_review))
+        if args.batch:
+            run_batch_mode(client, jobs, reviews_folder, reformatted_folder, args.poll_interval, cache,
+                           args.max_chunk_tokens, store)
+        else:
+            asyncio.run(run_async_mode(config, jobs, reformatted_folder, cache,
+                                       args.concurrency, args.max_concurrency, args.max_chunk_tokens, store))
+        copied = copy_reformatted(reviews_folder, reformatted_folder, duplicates, store)
+        if copied:
+            print(f"Copied reformatted reviews to {copied} near-identical reviews")
+        return
     
     for i, filename in enumerate(review_files):
         album_id = filename.split('.')[0]  # Extract album ID from filename
-        review_file_path = os.path.join(reviews_folder, filename)
         
         # Check if we have album data for this ID
         if album_id not in albums_data:
@@ -131,30 +670,23 @@ def main():
         
         print(f"\n[{i+1}/{len(review_files)}] Processing review for: {artist} - {album}")
         
+        cached = False
         try:
             # Read the original review
-            with open(review_file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-                # Extract review metadata (first 4 lines) and the review text
-                lines = content.split('\n')
-                metadata = '\n'.join(lines[:4])
-                original_review = '\n'.join(lines[4:]).strip()
+            metadata, original_review = read_saved_review(reviews_folder, filename, store)
             
-            # Process with GPT-4.5
-            print(f"Sending to GPT for reformatting...")
-            reformatted_review = process_review_with_gpt(client, original_review, artist, album)
+            # Process with GPT-4.5, unless the same request was answered before
+            cached = cached_review(cache, original_review, artist, album, args.max_chunk_tokens) is not None
+            print("Using cached reformatted review" if cached else "Sending to GPT for reformatting...")
+            reformatted_review = process_review_with_gpt(client, original_review, artist, album, cache,
+                                                         args.max_chunk_tokens)
             
             if reformatted_review:
                 # Save the reformatted review
                 reformatted_path = os.path.join(reformatted_folder, filename)
-                with open(reformatted_path, 'w', encoding='utf-8') as f:
-                    # Keep the original metadata
-                    f.write(metadata + "\n\n")
-                    f.write("--- REFORMATTED BY GPT ---\n\n")
-                    f.write(reformatted_review)
+                save_reformatted_review(reformatted_path, metadata, reformatted_review, store)
                 
-                print(f"Reformatted review saved to: {reformatted_path}")
+                print(f"Reformatted review saved to: {args.store if store is not None else reformatted_path}")
             else:
                 print(f"Failed to reformat review for {artist} - {album}")
                 
@@ -162,7 +694,12 @@ def main():
             print(f"Error processing file {filename}: {e}")
         
         # Sleep to avoid hitting rate limits
-        time.sleep(1)
+        if not cached:
+            time.sleep(1)
+    
+    copied = copy_reformatted(reviews_folder, reformatted_folder, duplicates, store)
+    if copied:
+        print(f"Copied reformatted reviews to {copied} near-identical reviews")
     
     print("\nProcessing complete! All reviews have been reformatted.")
 
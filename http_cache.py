@@ -0,0 +1,153 @@
+# http_cache.py
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_FILE = 'http_cache.sqlite'
+
+# How long a cached page is used without asking the server again
+SEARCH_TTL = 7 * 24 * 3600      # Search results change when new reviews are published
+REVIEW_TTL = 90 * 24 * 3600     # Published reviews almost never change
+NEGATIVE_TTL = 3 * 24 * 3600    # Re-check "no review found" searches after a few days
+
+class HTTPCache:
+    """SQLite-backed cache of HTML responses keyed by URL.
+
+    Stale entries are revalidated with ETag/Last-Modified, the total size of
+    stored bodies is bounded by evicting the least recently used pages, and a
+    separate table remembers lookups that found nothing.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, max_bytes=500 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+            CREATE TABLE IF NOT EXISTS negative (
+                key TEXT PRIMARY KEY,
+                created_at REAL NOT NULL
+            );
+        """)
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get(self, url):
+        """Return the cached entry for a URL as a dict, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM responses WHERE url = ?",
+                (url,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+        body, etag, last_modified, fetched_at = row
+        return {
+            'body': zlib.decompress(body).decode('utf-8'),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+        }
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """Store a response body, evicting old pages if the cache grows too large"""
+        data = zlib.compress(body.encode('utf-8'))
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, data, etag, last_modified, now, now, len(data)))
+            self.total_bytes += len(data) - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def touch(self, url):
+        """Mark a cached page as fresh again after a 304 Not Modified"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self.conn.commit()
+
+    def delete(self, url):
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            if old:
+                self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.total_bytes -= old[0]
+                self.conn.commit()
+
+    def _evict(self):
+        """Drop least recently used pages until the cache is back under 90% of its budget"""
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall()
+        for url, size in rows:
+            if self.total_bytes <= target:
+                break
+            self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.total_bytes -= size
+
+    def is_negative(self, key, ttl=NEGATIVE_TTL):
+        """Check whether a lookup recently came back empty"""
+        with self.lock:
+            row = self.conn.execute("SELECT created_at FROM negative WHERE key = ?", (key,)).fetchone()
+        return row is not None and time.time() - row[0] < ttl
+
+    def set_negative(self, key):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO negative VALUES (?, ?)", (key, time.time()))
+            self.conn.commit()
+
+    def fetch(self, url, get, ttl):
+        """Return the body for a URL, going to the network only when needed.
+
+        `get(url, headers)` performs the actual request and returns a
+        requests-style response. Fresh entries are returned as-is; stale ones
+        are revalidated with a conditional request.
+        """
+        entry = self.get(url)
+        if entry and time.time() - entry['fetched_at'] < ttl:
+            return entry['body']
+
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        response = get(url, headers)
+        if response.status_code == 304 and entry:
+            self.touch(url)
+            return entry['body']
+        response.raise_for_status()
+
+        self.put(url, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.text
+
+    def stats(self):
+        with self.lock:
+            pages = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            misses = self.conn.execute("SELECT COUNT(*) FROM negative").fetchone()[0]
+        return {'pages': pages, 'bytes': self.total_bytes, 'negative': misses,
+                'file_bytes': os.path.getsize(self.path) if os.path.exists(self.path) else 0}
@@ -0,0 +1,128 @@
+# llm_cache.py
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_FILE = 'llm_cache.sqlite'
+
+def cache_key(prompt, model, options=None):
+    """Content hash of everything that determines a model's answer.
+
+    `prompt` is the request exactly as sent (the rendered prompt, or the chat
+    messages), so the album, artist and part number it names are part of the
+    key; `options` are the generation settings, such as temperature or num_ctx.
+    """
+    payload = json.dumps([prompt, model, options or {}], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class LLMCache:
+    """SQLite store of reformatted reviews shared by the OpenAI and Ollama scripts.
+
+    Entries are keyed by cache_key(), so a review is only sent to a model again
+    when the prompt sent for it, the model or the generation options changed.
+    Token usage and latency are kept with each result.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                output TEXT NOT NULL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                latency REAL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_created ON results (created_at);
+            CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at);
+        """)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get(self, key):
+        """Return the cached output for a key, or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT output FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        return row[0]
+
+    def put(self, key, model, output, prompt_tokens=None, completion_tokens=None, latency=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, output, prompt_tokens, completion_tokens, latency, now, now,
+                 len(output.encode('utf-8'))))
+            self.conn.commit()
+
+    def prune(self, max_age_days=None, max_bytes=None):
+        """Delete entries older than `max_age_days`, then least recently used ones above `max_bytes`"""
+        removed = 0
+        with self.lock:
+            if max_age_days is not None:
+                cutoff = time.time() - max_age_days * 24 * 3600
+                removed += self.conn.execute("DELETE FROM results WHERE created_at < ?", (cutoff,)).rowcount
+            if max_bytes is not None:
+                total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+                rows = self.conn.execute("SELECT key, size FROM results ORDER BY accessed_at").fetchall()
+                for key, size in rows:
+                    if total <= max_bytes:
+                        break
+                    self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+        return removed
+
+    def stats(self):
+        """Per-model entry counts, sizes, token usage and average latency"""
+        with self.lock:
+            rows = self.conn.execute("""
+                SELECT model, COUNT(*), SUM(size), SUM(prompt_tokens), SUM(completion_tokens), AVG(latency)
+                FROM results GROUP BY model ORDER BY model
+            """).fetchall()
+        return [{'model': model, 'entries': count, 'bytes': size or 0,
+                 'prompt_tokens': prompt_tokens or 0, 'completion_tokens': completion_tokens or 0,
+                 'avg_latency': avg_latency}
+                for model, count, size, prompt_tokens, completion_tokens, avg_latency in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the shared LLM result cache")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE, help=f"Cache file (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument('--max-age-days', type=float, help="Delete results older than this many days")
+    parser.add_argument('--max-mb', type=float, help="Delete least recently used results above this size")
+    args = parser.parse_args()
+
+    cache = LLMCache(args.cache)
+    if args.max_age_days is not None or args.max_mb is not None:
+        max_bytes = int(args.max_mb * 1024 * 1024) if args.max_mb is not None else None
+        removed = cache.prune(args.max_age_days, max_bytes)
+        print(f"Removed {removed} cached results")
+
+    print(f"{'Model':<30} {'Entries':>8} {'KB':>10} {'Tokens in':>12} {'Tokens out':>12} {'Avg latency':>12}")
+    print("-" * 90)
+    for row in cache.stats():
+        latency = f"{row['avg_latency']:.2f}s" if row['avg_latency'] is not None else "-"
+        print(f"{row['model']:<30} {row['entries']:>8} {row['bytes'] / 1024:>10.1f} "
+              f"{row['prompt_tokens']:>12} {row['completion_tokens']:>12} {latency:>12}")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# matching.py
+"""Fuzzy matching of Tidal album names against Angry Metal Guy review titles.
+
+Names are normalized first: accents removed, case folded, punctuation turned
+into spaces, "&" read as "and", and edition suffixes such as "(Deluxe
+Edition)", "[Remastered 2015]" or "- Bonus Track Version" dropped. A
+`TitleIndex` then maps the character trigrams of every known artist and
+album to the titles containing them, so the few titles sharing the most
+trigrams with a query are found with one numpy bincount, and only those are
+scored. The score is the harmonic mean of the artist and album trigram
+similarities (Dice coefficient), so both names have to match reasonably well.
+"""
+import re
+import unicodedata
+
+import numpy as np
+
+# Matches at or above this score are taken without asking the site
+MATCH_SCORE = 0.85
+# Below this, the album is not one of the titles
+CANDIDATE_SCORE = 0.6
+# A confident match also has to beat the runner-up by this much
+MATCH_MARGIN = 0.05
+
+EDITION_WORDS = (r"deluxe|expanded|special|limited|anniversary|collector'?s|bonus|remaster(?:ed)?|"
+                 r"reissue|re-issue|edition|version|explicit|mono|stereo|digipak")
+# "(Deluxe Edition)", "[2015 Remaster]", " - Remastered 2009", " Remastered": brackets or a dash tail
+# naming an edition, or a trailing remaster note
+EDITION_PATTERN = re.compile(
+    rf"\s*(?:[(\[][^)\]]*\b(?:{EDITION_WORDS})\b[^)\]]*[)\]]|\s[-–—]\s[^-–—]*\b(?:{EDITION_WORDS})\b.*$"
+    rf"|\s(?:\d{{4}}\s)?remaster(?:ed)?(?:\s\d{{4}})?$)",
+    re.I)
+NON_WORD = re.compile(r"[\W_]+")
+# Letters that Unicode decomposition doesn't reduce to ASCII
+LETTERS = str.maketrans({'æ': 'ae', 'ø': 'o', 'ß': 'ss', 'đ': 'd', 'ł': 'l', 'þ': 'th', 'ð': 'd', 'œ': 'oe'})
+
+def strip_edition(name):
+    """A release name without edition, remaster and bonus track notes"""
+    stripped = EDITION_PATTERN.sub('', name or '').strip()
+    return stripped or (name or '').strip()
+
+def fold(text):
+    """Lowercase ASCII-folded words of a text, without accents or punctuation"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold().translate(LETTERS)
+    text = text.replace('&', ' and ').replace("'", '')
+    return ' '.join(NON_WORD.sub(' ', text).split())
+
+def normalize_name(name):
+    """Folded artist or album name without edition notes, for comparing spellings of the same release"""
+    return fold(strip_edition(name))
+
+def trigrams(name):
+    """Character trigrams of a normalized name, padded so short names and word starts count"""
+    padded = f"  {name} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def similarity(a, b):
+    """Dice coefficient of two trigram sets"""
+    if not a and not b:
+        return 1.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+def match_score(artist_grams, album_grams, title_artist_grams, title_album_grams):
+    artist = similarity(artist_grams, title_artist_grams)
+    album = similarity(album_grams, title_album_grams)
+    return 2 * artist * album / (artist + album) if artist + album else 0.0
+
+class TitleIndex:
+    """Trigram index over (key, artist, album) entries, e.g. review posts and the names in their titles"""
+
+    def __init__(self, entries):
+        self.keys = []
+        self.grams = []
+        postings = {}
+        for key, artist, album in entries:
+            artist_grams = trigrams(normalize_name(artist))
+            album_grams = trigrams(normalize_name(album))
+            position = len(self.keys)
+            self.keys.append(key)
+            self.grams.append((artist_grams, album_grams))
+            for gram in artist_grams | album_grams:
+                postings.setdefault(gram, []).append(position)
+        self.postings = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def candidates(self, artist, album, k=5, shortlist=20):
+        """The `k` best (score, key) pairs for an album, best first"""
+        artist_grams = trigrams(normalize_name(artist))
+        album_grams = trigrams(normalize_name(album))
+        arrays = [self.postings[gram] for gram in artist_grams | album_grams if gram in self.postings]
+        if not arrays:
+            return []
+        # Titles sharing the most trigrams with the query, then scored properly
+        shared = np.bincount(np.concatenate(arrays), minlength=len(self.keys))
+        count = min(shortlist, len(shared))
+        top = np.argpartition(-shared, count - 1)[:count]
+        scored = sorted(((match_score(artist_grams, album_grams, *self.grams[position]), self.keys[position])
+                         for position in top if shared[position]), reverse=True)
+        return scored[:k]
+
+    def resolve(self, artist, album):
+        """('match', key, score) for a confident match, ('ambiguous', key, score) when a title
+        comes close but it's not certain, or ('none', None, score)"""
+        best = self.candidates(artist, album, k=2)
+        if not best or best[0][0] < CANDIDATE_SCORE:
+            return 'none', None, best[0][0] if best else 0.0
+        score, key = best[0]
+        runner_up = best[1][0] if len(best) > 1 else 0.0
+        if score >= MATCH_SCORE and score - runner_up >= MATCH_MARGIN:
+            return 'match', key, score
+        return 'ambiguous', key, score
@@ -0,0 +1,233 @@
+# metrics.py
+"""Counters and timers around the slow parts of a run, exported for monitoring.
+
+The scripts wrap every HTTP fetch, parse, file write and LLM call in
+`timer(name, **labels)` and count outcomes, tokens and retries with
+`count(name, amount, **labels)`. Nothing is recorded until `enable()` is
+called: until then `timer` returns a shared no-op context manager and `count`
+returns straight away, so leaving the instrumentation in costs next to nothing.
+
+Once enabled, a snapshot is written every `interval` seconds and at exit:
+
+- to a Prometheus textfile (for node_exporter's textfile collector) when the
+  path ends in .prom, replaced atomically on every write
+- otherwise as one JSON line per snapshot, so a run's history can be plotted
+
+Timed sections named in `profile` are also run under cProfile (one profiler
+per thread, merged at exit into profiles/<section>.prof for pstats or
+snakeviz). Sampling profilers like py-spy need no hook: every timed section
+is a plain function call that shows up by name in their stacks.
+"""
+import atexit
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+PREFIX = 'recommender'
+PROFILE_FOLDER = 'profiles'
+
+class Registry:
+    """Counter values and timer statistics (count, total and slowest), keyed by name and labels"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.started_at = time.time()
+
+    def count(self, name, amount, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            stats = self.timers.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def snapshot(self):
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            timers = [{'name': name, 'labels': dict(labels), 'count': count,
+                       'seconds': round(total, 6), 'max_seconds': round(slowest, 6)}
+                      for (name, labels), (count, total, slowest) in sorted(self.timers.items())]
+        now = time.time()
+        return {'time': round(now, 3), 'uptime': round(now - self.started_at, 3),
+                'counters': counters, 'timers': timers}
+
+    def prometheus(self):
+        """The snapshot in the Prometheus text exposition format"""
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def series(name, labels, value):
+            label_text = ','.join(f'{k}="{escape(v)}"' for k, v in sorted(labels.items()))
+            return f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}"
+
+        snapshot = self.snapshot()
+        lines = []
+        seen = set()
+        for counter in snapshot['counters']:
+            name = f"{PREFIX}_{counter['name']}_total"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(series(name, counter['labels'], counter['value']))
+        for timer in snapshot['timers']:
+            name = f"{PREFIX}_{timer['name']}_seconds"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} summary")
+            lines.append(series(f"{name}_count", timer['labels'], timer['count']))
+            lines.append(series(f"{name}_sum", timer['labels'], timer['seconds']))
+        for timer in snapshot['timers']:
+            name = f"{PREFIX}_{timer['name']}_seconds_max"
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(series(name, timer['labels'], timer['max_seconds']))
+        lines.append(f"# TYPE {PREFIX}_uptime_seconds gauge")
+        lines.append(f"{PREFIX}_uptime_seconds {snapshot['uptime']}")
+        return '\n'.join(lines) + '\n'
+
+_registry = None
+_exporter = None
+_profiled = frozenset()
+_profiles = {}
+_profiles_lock = threading.Lock()
+_local = threading.local()
+_NOOP = contextlib.nullcontext()
+
+class Exporter:
+    """Writes the registry to a file every `interval` seconds from a background thread"""
+
+    def __init__(self, registry, path, interval):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='metrics', daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        if self.path.endswith('.prom'):
+            tmp_file = self.path + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(self.registry.prometheus())
+            os.replace(tmp_file, self.path)
+        else:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(self.registry.snapshot()) + "\n")
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+
+def enable(path=None, interval=15.0, profile=()):
+    """Start recording; export to `path` if given and cProfile the timed sections named in `profile`"""
+    global _registry, _exporter, _profiled
+    if _registry is not None:
+        return _registry
+    _registry = Registry()
+    _profiled = frozenset(profile or ())
+    if path:
+        _exporter = Exporter(_registry, path, interval)
+        _exporter.thread.start()
+    atexit.register(close)
+    return _registry
+
+def add_arguments(parser):
+    """Add the --metrics, --metrics-interval and --profile options that enable_from_args reads"""
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="Write counters and timings to FILE while running "
+                             "(.prom for a Prometheus textfile, otherwise JSON lines)")
+    parser.add_argument('--metrics-interval', type=float, default=15.0,
+                        help="Seconds between metrics snapshots (default: 15)")
+    parser.add_argument('--profile', nargs='+', default=[], metavar='SECTION',
+                        help="Run these timed sections under cProfile, e.g. parse; saved to profiles/")
+
+def enable_from_args(args):
+    """Start recording if the options of add_arguments ask for metrics or profiles"""
+    if args.metrics or args.profile:
+        return enable(args.metrics, args.metrics_interval, args.profile)
+
+def close():
+    """Write the final snapshot and the collected profiles"""
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+        _exporter = None
+    with _profiles_lock:
+        profiles = dict(_profiles)
+        _profiles.clear()
+    if profiles:
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        for section, profilers in profiles.items():
+            path = os.path.join(PROFILE_FOLDER, f"{section}.prof")
+            pstats.Stats(*profilers).dump_stats(path)
+            print(f"Saved profile of '{section}' to {path}")
+
+def enabled():
+    return _registry is not None
+
+def count(name, amount=1, **labels):
+    """Add to a counter, e.g. count('llm_tokens', 512, backend='ollama', direction='out')"""
+    if _registry is not None:
+        _registry.count(name, amount, labels)
+
+def observe(name, seconds, **labels):
+    """Record a duration measured elsewhere, such as a model's time to first token"""
+    if _registry is not None:
+        _registry.observe(name, seconds, labels)
+
+def timer(name, **labels):
+    """Context manager timing a section; exceptions are counted as `<name>_errors`"""
+    if _registry is None:
+        return _NOOP
+    return _timed(name, labels)
+
+@contextlib.contextmanager
+def _timed(name, labels):
+    profiler = _start_profile(name) if name in _profiled else None
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        _registry.count(f"{name}_errors", 1, labels)
+        raise
+    finally:
+        _registry.observe(name, time.perf_counter() - start, labels)
+        if profiler is not None:
+            profiler.disable()
+            _local.profiling = False
+
+def _start_profile(section):
+    """Enable this thread's profiler for a section, unless one is already running here"""
+    if getattr(_local, 'profiling', False):
+        return None
+    profilers = getattr(_local, 'profilers', None)
+    if profilers is None:
+        profilers = _local.profilers = {}
+    profiler = profilers.get(section)
+    if profiler is None:
+        profiler = profilers[section] = cProfile.Profile()
+        with _profiles_lock:
+            _profiles.setdefault(section, []).append(profiler)
+    try:
+        profiler.enable()
+    except ValueError:
+        return None  # Another profiler is already active, e.g. python -m cProfile
+    _local.profiling = True
+    return profiler
@@ -1,14 +1,31 @@
 import os
-import csv
+import argparse
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 import time
 import json
 
-def process_review_with_ollama(review_text, artist, album, model="llama3"):
-    """Process a review using a local Ollama model"""
-    try:
-        # Create a prompt for the model to reformat the review
-        prompt = f"""
+import metrics
+from chunking import count_tokens, reformat_chunks, split_review
+from dedup import copy_reformatted, reviews_to_reformat
+from llm_cache import LLMCache, DEFAULT_CACHE_FILE, cache_key
+from reviews import load_albums_data, read_review_file
+from store import LibraryStore, read_saved_review, review_filenames
+
+OLLAMA_URL = 'http://localhost:11434'
+
+def create_session(pool_size=4):
+    """Create a requests session that keeps `pool_size` connections to Ollama alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+PROMPT_TEMPLATE = """
 I have a music review for the album "{album}" by "{artist}" from Angry Metal Guy website.
 Please reformat this review to make it easier to read, with:
 1. Clear sections
@@ -25,106 +42,342 @@ Here is the review:
 Provide only the reformatted review without any additional commentary.
 """
 
-        # Call the Ollama API
-        response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={
-                'model': model,
-                'prompt': prompt,
-                'stream': False
-            }
-        )
+# Used instead of PROMPT_TEMPLATE for each part of a review that is too long for one request
+CHUNK_PROMPT_TEMPLATE = """
+I have a music review for the album "{album}" by "{artist}" from Angry Metal Guy website.
+The review is long, so you are getting it in parts. This is part {part} of {total}.
+Please reformat this part to make it easier to read, with:
+1. Clear sections
+2. Better paragraph organization
+3. Highlighted key points
+4. Keep all the original content but make it more reader-friendly
+
+Here is part {part} of the review:
+---
+{review_text}
+---
+
+Provide only the reformatted text of this part without any additional commentary.
+"""
+
+# Context window requested from Ollama; reviews that don't fit are split into parts
+DEFAULT_NUM_CTX = 4096
+# How long Ollama keeps a model loaded after a request; its own default of 5 minutes
+# unloads the model during pauses and the next review waits for it to load again
+DEFAULT_KEEP_ALIVE = '30m'
+
+def build_prompt(review_text, artist, album, part=1, total=1):
+    """Create a prompt for the model to reformat the review, or one part of it"""
+    if total > 1:
+        return CHUNK_PROMPT_TEMPLATE.format(album=album, artist=artist, review_text=review_text,
+                                            part=part, total=total)
+    return PROMPT_TEMPLATE.format(album=album, artist=artist, review_text=review_text)
+
+def review_cache_key(prompt, model, options=None):
+    """Key for the prompt of a review (or part of a review) in the shared LLM result cache"""
+    return cache_key(prompt, model, options)
+
+def chunk_budget(num_ctx):
+    """Review tokens per request: the context has to hold the prompt, the review and an answer about as long"""
+    return max(256, (num_ctx - count_tokens(PROMPT_TEMPLATE) - 64) // 2)
+
+def stream_ollama(prompt, model="llama3", session=None, on_token=None, url=OLLAMA_URL, options=None,
+                  keep_alive=None):
+    """Run a prompt through /api/generate, consuming the streamed NDJSON response.
+
+    `on_token` is called with each piece of text as it arrives. Returns the
+    full response text and timing stats: time to first token, generated
+    tokens and tokens per second.
+    """
+    http = session or requests
+    start = time.perf_counter()
+    first_token_at = None
+    pieces = []
+    final = {}
+    payload = {'model': model, 'prompt': prompt, 'stream': True}
+    if options:
+        payload['options'] = options
+    if keep_alive is not None:
+        payload['keep_alive'] = keep_alive
+    
+    with metrics.timer('llm_request', backend='ollama', model=model):
+        with http.post(f"{url}/api/generate", json=payload, stream=True) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"{response.status_code} - {response.text}")
         
-        if response.status_code == 200:
-            result = response.json()
-            return result['response']
-        else:
-            print(f"Error: {response.status_code} - {response.text}")
-            return None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise RuntimeError(chunk['error'])
+                token = chunk.get('response', '')
+                if token:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    pieces.append(token)
+                    if on_token:
+                        on_token(token)
+                if chunk.get('done'):
+                    final = chunk
+                    break
+            if not final:
+                # The connection closed before Ollama said it was done: the text is cut off
+                raise RuntimeError(f"Response from {model} ended without a done message after {len(pieces)} tokens")
+    
+    end = time.perf_counter()
+    eval_count = final.get('eval_count', len(pieces))
+    if final.get('eval_duration'):
+        # Ollama reports durations in nanoseconds
+        tokens_per_sec = eval_count / (final['eval_duration'] / 1e9)
+    elif first_token_at is not None and end > first_token_at:
+        tokens_per_sec = eval_count / (end - first_token_at)
+    else:
+        tokens_per_sec = 0.0
+    stats = {
+        'ttft': (first_token_at or end) - start,
+        'total_time': end - start,
+        'prompt_tokens': final.get('prompt_eval_count'),
+        'tokens': eval_count,
+        'tokens_per_sec': tokens_per_sec,
+    }
+    metrics.observe('llm_first_token', stats['ttft'], backend='ollama', model=model)
+    metrics.count('llm_tokens', stats['prompt_tokens'] or 0, backend='ollama', model=model, direction='in')
+    metrics.count('llm_tokens', eval_count, backend='ollama', model=model, direction='out')
+    return ''.join(pieces), stats
+
+def generate_review(review_text, artist, album, model="llama3", session=None, url=OLLAMA_URL,
+                    cache=None, num_ctx=DEFAULT_NUM_CTX, on_token=None, workers=4, keep_alive=None, slots=None):
+    """Reformat a review, splitting it into parts first if it doesn't fit the context window.
+
+    Short reviews are streamed through `on_token` as they are generated; long
+    ones are reformatted part by part in parallel and passed to `on_token` in
+    one piece once every part is done. Returns the text and the generation
+    stats, which are None when everything came from the cache.
+
+    `slots` is a semaphore shared by everything sending to the same server:
+    each request, for a whole review or one part, holds a slot, so reviews
+    reformatted at once and their parts never exceed the server's parallelism.
+    """
+    options = {'num_ctx': num_ctx}
+    chunks = split_review(review_text, chunk_budget(num_ctx))
+    chunked = len(chunks) > 1
+    all_stats = []
+    
+    def generate(chunk, part, total):
+        prompt = build_prompt(chunk, artist, album, part, total)
+        key = review_cache_key(prompt, model, options)
+        if cache is not None:
+            cached_review = cache.get(key)
+            if cached_review is not None:
+                metrics.count('llm_cache_hits', backend='ollama')
+                if not chunked and on_token:
+                    on_token(cached_review)
+                return cached_review
+        
+        with slots if slots is not None else nullcontext():
+            text, stats = stream_ollama(prompt, model, session, None if chunked else on_token, url, options,
+                                        keep_alive)
+        if cache is not None:
+            cache.put(key, model, text, stats['prompt_tokens'], stats['tokens'], stats['total_time'])
+        all_stats.append(stats)
+        return text
+    
+    start = time.perf_counter()
+    if not chunked:
+        reformatted_review = generate(review_text, 1, 1)
+    else:
+        reformatted_review = reformat_chunks(chunks, generate, workers)
+        if on_token:
+            on_token(reformatted_review)
+    
+    if not all_stats:
+        return reformatted_review, None
+    if len(all_stats) == 1:
+        return reformatted_review, all_stats[0]
+    elapsed = time.perf_counter() - start
+    tokens = sum(stats['tokens'] for stats in all_stats)
+    return reformatted_review, {
+        'ttft': min(stats['ttft'] for stats in all_stats),
+        'total_time': elapsed,
+        'prompt_tokens': sum(stats['prompt_tokens'] or 0 for stats in all_stats),
+        'tokens': tokens,
+        'tokens_per_sec': tokens / elapsed if elapsed else 0.0,
+        'parts': len(chunks),
+    }
+
+def warm_up(model, session=None, url=OLLAMA_URL, keep_alive=DEFAULT_KEEP_ALIVE):
+    """Load a model ahead of the first review and keep it loaded; returns the seconds it took"""
+    http = session or requests
+    start = time.perf_counter()
+    # A request without a prompt only loads the model
+    with metrics.timer('llm_warm_up', backend='ollama', model=model):
+        response = http.post(f"{url}/api/generate", json={'model': model, 'stream': False, 'keep_alive': keep_alive})
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.status_code} - {response.text}")
+    return time.perf_counter() - start
+
+def process_review_with_ollama(review_text, artist, album, model="llama3", session=None, url=OLLAMA_URL,
+                               cache=None, num_ctx=DEFAULT_NUM_CTX):
+    """Process a review using a local Ollama model"""
+    try:
+        reformatted_review, _ = generate_review(review_text, artist, album, model, session, url, cache, num_ctx)
+        return reformatted_review
             
     except Exception as e:
         print(f"Error processing review with Ollama: {e}")
         return None
 
+def reformat_review_file(session, review_file_path, reformatted_path, artist, album, model,
+                         url=OLLAMA_URL, cache=None, num_ctx=DEFAULT_NUM_CTX, keep_alive=None, slots=None):
+    """Reformat one review, writing tokens to disk as they are generated.
+
+    Output goes to a .part file that is renamed once the response is complete,
+    so a finished file is never half-written. Returns the generation stats, or
+    None when the result came from the cache.
+    """
+    # Read the original review
+    metadata, original_review = read_review_file(review_file_path)
+    return write_reformatted_review(session, metadata, original_review, reformatted_path, artist, album,
+                                    model, url, cache, num_ctx, keep_alive, slots=slots)
+
+def write_reformatted_review(session, metadata, original_review, reformatted_path, artist, album, model,
+                             url=OLLAMA_URL, cache=None, num_ctx=DEFAULT_NUM_CTX, keep_alive=None, store=None,
+                             slots=None):
+    """Reformat review text that is already in memory; see reformat_review_file.
+
+    With a library store, the finished review is put in the store under the
+    AlbumID of `reformatted_path` instead of being written to that file.
+    """
+    if store is not None:
+        reformatted_review, stats = generate_review(original_review, artist, album, model, session, url, cache,
+                                                    num_ctx, keep_alive=keep_alive, slots=slots)
+        with metrics.timer('file_write', kind='reformatted', target='store'):
+            store.put_reformatted(os.path.basename(reformatted_path).split('.')[0], model, reformatted_review)
+        return stats
+    partial_path = reformatted_path + '.part'
+    try:
+        with open(partial_path, 'w', encoding='utf-8') as f:
+            # Keep the original metadata
+            f.write(metadata + "\n\n")
+            f.write(f"--- REFORMATTED BY {model.upper()} ---\n\n")
+            
+            def write_token(token):
+                f.write(token)
+                f.flush()
+            
+            _, stats = generate_review(original_review, artist, album, model, session, url, cache,
+                                       num_ctx, on_token=write_token, keep_alive=keep_alive, slots=slots)
+        os.replace(partial_path, reformatted_path)
+        return stats
+    except Exception:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reformat album reviews with a local Ollama model")
+    # Llama 3 is recommended for text reformatting
+    parser.add_argument('--model', default="llama3",
+                        help="Ollama model to use (default: llama3). Alternatives: mistral, phi3, gemma:7b, etc.")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Reviews in flight at once; match the server's OLLAMA_NUM_PARALLEL (default: 4)")
+    parser.add_argument('--url', default=OLLAMA_URL, help=f"Ollama server URL (default: {OLLAMA_URL})")
+    parser.add_argument('--num-ctx', type=int, default=DEFAULT_NUM_CTX,
+                        help=f"Context window in tokens; longer reviews are split into parts (default: {DEFAULT_NUM_CTX})")
+    parser.add_argument('--keep-alive', default=DEFAULT_KEEP_ALIVE,
+                        help=f"How long Ollama keeps the model loaded between requests (default: {DEFAULT_KEEP_ALIVE})")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE,
+                        help=f"Shared LLM result cache (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Send every review to the model even if an identical request was cached")
+    parser.add_argument('--store', metavar='FILE',
+                        help="Read reviews from this library store (see store.py) and save the results there "
+                             "instead of in text files")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="Reformat near-identical reviews (other editions of an album) separately "
+                             "instead of copying one result")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
+    
     # Setup directories
     reviews_folder = "album_reviews"
     reformatted_folder = "reformatted_reviews"
-    
-    # Choose which model to use - Llama 3 is recommended for text reformatting
-    model = "llama3"  # Alternatives: "mistral", "phi3", "gemma:7b", etc.
+    model = args.model
     
     # Create reformatted reviews directory if it doesn't exist
     if not os.path.exists(reformatted_folder):
         os.makedirs(reformatted_folder)
     
-    # Read the albums data from CSV
-    albums_data = {}
-    
+    # Read the albums data from CSV, or from the store
+    store = LibraryStore(args.store) if args.store else None
     try:
-        with open('tidal_favorite_albums_with_ratings.csv', 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                album_id = row.get('AlbumID')
-                if album_id:
-                    albums_data[album_id] = {
-                        'Artist': row.get('Artist', ''),
-                        'Album': row.get('Album', ''),
-                        'AMG_Rating': row.get('AMG_Rating', '')
-                    }
+        albums_data = store.albums_data() if store is not None else load_albums_data()
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         return
     
     # Process all review files
-    review_files = [f for f in os.listdir(reviews_folder) if f.endswith('.txt')]
+    review_files = review_filenames(reviews_folder, store)
+    
+    # Other editions of an album share their review text; reformat it once and copy the result
+    review_files, duplicates = reviews_to_reformat(reviews_folder, review_files, albums_data, store,
+                                                   not args.no_dedup)
     
-    for i, filename in enumerate(review_files):
+    jobs = []
+    for filename in review_files:
         album_id = filename.split('.')[0]  # Extract album ID from filename
-        review_file_path = os.path.join(reviews_folder, filename)
         
         # Check if we have album data for this ID
         if album_id not in albums_data:
             print(f"Warning: No album data found for ID {album_id}, skipping")
             continue
-        
-        artist = albums_data[album_id]['Artist']
-        album = albums_data[album_id]['Album']
-        
-        print(f"\n[{i+1}/{len(review_files)}] Processing review for: {artist} - {album}")
-        
-        try:
-            # Read the original review
-            with open(review_file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-                # Extract review metadata (first 4 lines) and the review text
-                lines = content.split('\n')
-                metadata = '\n'.join(lines[:4])
-                original_review = '\n'.join(lines[4:]).strip()
-            
-            # Process with local model
-            print(f"Sending to {model} for reformatting...")
-            reformatted_review = process_review_with_ollama(original_review, artist, album, model)
-            
-            if reformatted_review:
-                # Save the reformatted review
-                reformatted_path = os.path.join(reformatted_folder, filename)
-                with open(reformatted_path, 'w', encoding='utf-8') as f:
-                    # Keep the original metadata
-                    f.write(metadata + "\n\n")
-                    f.write(f"--- REFORMATTED BY {model.upper()} ---\n\n")
-                    f.write(reformatted_review)
-                
-                print(f"Reformatted review saved to: {reformatted_path}")
-            else:
-                print(f"Failed to reformat review for {artist} - {album}")
-                
-        except Exception as e:
-            print(f"Error processing file {filename}: {e}")
-        
-        # Sleep between requests
-        time.sleep(0.5)
+        jobs.append((filename, albums_data[album_id]['Artist'], albums_data[album_id]['Album']))
+    
+    print(f"Sending {len(jobs)} reviews to {model} with {args.workers} in flight...")
+    session = create_session(pool_size=args.workers)
+    # Parts of long reviews count against --workers too
+    slots = threading.BoundedSemaphore(args.workers)
+    cache = None if args.no_cache else LLMCache(args.cache)
+    try:
+        print(f"Loaded {model} in {warm_up(model, session, args.url, args.keep_alive):.1f}s")
+    except Exception as e:
+        print(f"Could not load {model} ahead of time: {e}")
+    
+    def process(job):
+        filename, artist, album = job
+        metadata, original_review = read_saved_review(reviews_folder, filename, store)
+        reformatted_path = os.path.join(reformatted_folder, filename)
+        return write_reformatted_review(session, metadata, original_review, reformatted_path, artist, album, model,
+                                        args.url, cache, args.num_ctx, args.keep_alive, store, slots)
+    
+    done = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(process, job): job for job in jobs}
+        for future in as_completed(futures):
+            filename, artist, album = futures[future]
+            done += 1
+            try:
+                stats = future.result()
+                if stats is None:
+                    print(f"[{done}/{len(jobs)}] {artist} - {album}: saved cached result to "
+                          f"{args.store or os.path.join(reformatted_folder, filename)}")
+                    continue
+                parts = f", {stats['parts']} parts" if 'parts' in stats else ""
+                print(f"[{done}/{len(jobs)}] {artist} - {album}: saved to "
+                      f"{args.store or os.path.join(reformatted_folder, filename)} "
+                      f"(first token {stats['ttft']:.2f}s, {stats['tokens']} tokens, "
+                      f"{stats['tokens_per_sec']:.1f} tokens/s{parts})")
+            except Exception as e:
+                print(f"[{done}/{len(jobs)}] Failed to reformat review for {artist} - {album}: {e}")
+    
+    copied = copy_reformatted(reviews_folder, reformatted_folder, duplicates, store)
+    if copied:
+        print(f"Copied reformatted reviews to {copied} near-identical reviews")
     
     print("\nProcessing complete! All reviews have been reformatted.")
 
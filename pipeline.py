@@ -0,0 +1,403 @@
+# pipeline.py
+"""Run tidal.py, amg.py and the reformatter as one streaming pipeline.
+
+    Tidal favorites -> [queue] -> AMG crawl workers -> [queue] -> reformat workers
+
+Each stage is a pool of threads connected to the next by a bounded queue, so a
+review found by the crawler is reformatted while the crawl goes on, and a slow
+stage makes the faster ones wait instead of piling up work in memory. The
+total run time is close to that of the slowest stage rather than the sum.
+
+Progress is kept where the separate scripts keep it (crawl_state.jsonl, the
+review files and reformatted_reviews/), so an interrupted run continues where
+it stopped. Ctrl-C stops taking new work and lets the items in progress
+finish; press it again to quit immediately.
+"""
+import argparse
+import csv
+import os
+import queue
+import signal
+import threading
+import time
+
+import metrics
+from amg import (append_crawl_state, compact_crawl_state, create_session, crawl_record, fetch_review_fields,
+                 find_review_url, load_crawl_state, needs_crawl)
+from amg_parsers import BACKEND_FACTORIES, DEFAULT_BACKEND
+from http_cache import HTTPCache, DEFAULT_CACHE_FILE
+from llm_cache import DEFAULT_CACHE_FILE as LLM_CACHE_FILE, LLMCache
+from ollama_reviews import DEFAULT_NUM_CTX, OLLAMA_URL
+from ratelimit import HostRateLimiter, TokenBucket
+from router import add_router_arguments, build_router
+from reviews import RATINGS_CSV, REVIEWS_FOLDER, album_key, format_metadata, read_review_file, save_review
+from store import LibraryStore, has_reformatted
+from tidal import (CSV_FIELDNAMES, album_row, fetch_favorite_pages, get_session, read_existing_rows,
+                   write_favorites)
+
+FAVORITES_CSV = 'tidal_favorite_albums.csv'
+REFORMATTED_FOLDER = 'reformatted_reviews'
+DEFAULT_OLLAMA_MODEL = 'llama3'
+
+DONE = object()  # Sent down a queue once per worker when the previous stage has finished
+
+class Stage:
+    """A pool of worker threads taking items from a bounded queue and passing results to the next.
+
+    `handle(item)` returns the item for the next stage, or None. Once `stop`
+    is set, the remaining items are taken off the queue without being handled
+    so the stages before never block on a full queue.
+    """
+
+    def __init__(self, name, workers, handle, inbox, outbox=None, stop=None):
+        self.name = name
+        self.workers = workers
+        self.handle = handle
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop = stop or threading.Event()
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.threads = [threading.Thread(target=self.work, name=f"{name}-{i}", daemon=True)
+                        for i in range(workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def work(self):
+        while True:
+            item = self.inbox.get()
+            if item is DONE:
+                return
+            if self.stop.is_set():
+                continue
+            start = time.perf_counter()
+            result = None
+            try:
+                with metrics.timer('pipeline_stage', stage=self.name):
+                    result = self.handle(item)
+                failed = False
+            except Exception as e:
+                print(f"[{self.name}] {e}")
+                failed = True
+            with self.lock:
+                self.processed += 1
+                self.failed += failed
+                self.busy += time.perf_counter() - start
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)  # Blocks while the next stage is behind
+
+    def join(self, next_stage=None):
+        """Wait for the workers, then tell the next stage's workers there is nothing more"""
+        for thread in self.threads:
+            thread.join()
+        if next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.inbox.put(DONE)
+
+    def summary(self, wall_time):
+        utilization = self.busy / (self.workers * wall_time) if wall_time else 0.0
+        return (f"{self.name:<9} {self.processed:>6} items  {self.failed:>4} failed  "
+                f"{self.busy:>8.1f}s busy  {utilization:>5.0%} of {self.workers} workers")
+
+def favorite_albums(args, stop, result):
+    """Album rows: new Tidal favorites as their pages arrive, then the ones exported before.
+
+    The favorites CSV is only rewritten if every new page was fetched, since
+    the next delta sync stops at the first album it already knows.
+    """
+    if args.skip_tidal:
+        with open(args.favorites, 'r', encoding='utf-8') as csvfile:
+            existing_rows = list(csv.DictReader(csvfile))
+    else:
+        session = get_session(args.session_file)
+        if not session.check_login():
+            raise RuntimeError("Tidal login failed")
+        existing_rows = read_existing_rows(args.favorites)
+        known_ids = {row['Tidal ID'] for row in existing_rows} if existing_rows is not None else None
+        bucket = TokenBucket(args.tidal_rate)
+        new_rows = []
+        for album in fetch_favorite_pages(session, args.page_size, known_ids):
+            if stop.is_set():
+                return
+            if album.release_date is None:
+                bucket.acquire()
+                try:
+                    album = session.album(album.id)
+                except Exception as e:
+                    print(f"[tidal] Error fetching details for {album.artist.name} - {album.name}: {e}")
+            row = album_row(album)
+            new_rows.append(row)
+            yield row
+        write_favorites(args.favorites, new_rows + (existing_rows or []))
+        result['new_favorites'] = len(new_rows)
+
+    for row in existing_rows or []:
+        if stop.is_set():
+            return
+        yield row
+
+def make_crawler(args, state, state_file, store, cache):
+    """The crawl stage's handler: look up one album on Angry Metal Guy"""
+    session = create_session(pool_size=args.crawl_workers)
+    limiter = HostRateLimiter(args.rate, args.burst)
+    state_lock = threading.Lock()
+
+    def record(album, status, review_url=None, rating=None):
+        with state_lock:
+            append_crawl_state(state_file, state, crawl_record(album, status, review_url, rating))
+
+    def crawl(album):
+        label = f"{album['Artist']} - {album['Album']}"
+        if not needs_crawl(album, state, args.reviews, args.max_age_days, store):
+            # Looked up before; found reviews may still need reformatting
+            return album if state[album['AlbumID']]['status'] == 'found' else None
+
+        review_url, review = None, {'text': None, 'rating': None}
+        try:
+            review_url = find_review_url(album['Album'], album['Artist'], session, cache, limiter, args.parser)
+            if review_url:
+                review = fetch_review_fields(review_url, session, cache, limiter, args.parser)
+        except Exception as e:
+            record(album, 'error', review_url)
+            raise RuntimeError(f"Error looking up {label}: {e}")
+
+        review_text, rating = review['text'], review['rating']
+        if not review_url:
+            record(album, 'not_found')
+            print(f"[crawl] {label}: no review found")
+            return None
+        if not review_text:
+            record(album, 'no_text', review_url)
+            print(f"[crawl] {label}: could not extract review from {review_url}")
+            return None
+        save_review(args.reviews, album, review_url, review_text, store, review)
+        record(album, 'found', review_url, rating)
+        print(f"[crawl] {label}: review found (rating: {rating or 'not found'})")
+        return album
+
+    return crawl
+
+def make_reformatter(args, store):
+    """The reformat stage's handler: reformat one saved review with Ollama, OpenAI or the model router.
+
+    Returns the handler and the Router, which is None unless --reformatter is router.
+    """
+    router = None
+    if args.reformatter == 'router':
+        cache = None if args.no_llm_cache else LLMCache(args.llm_cache)
+        router = build_router(args, cache, args.url, args.num_ctx, args.max_chunk_tokens, store)
+        router.warm_up()
+
+        def reformat_text(metadata, text, album, path):
+            backend, tokens = router.reformat(metadata, text, album['Artist'], album['Album'], path)
+            return f"{backend.model}, {'cached' if tokens is None else f'{tokens} tokens'}"
+    elif args.reformatter == 'ollama':
+        import ollama_reviews
+        session = ollama_reviews.create_session(pool_size=args.reformat_workers)
+        cache = None if args.no_llm_cache else LLMCache(args.llm_cache)
+        model = args.model or DEFAULT_OLLAMA_MODEL
+        # Parts of long reviews count against --reformat-workers too
+        slots = threading.BoundedSemaphore(args.reformat_workers)
+
+        def reformat_text(metadata, text, album, path):
+            stats = ollama_reviews.write_reformatted_review(session, metadata, text, path, album['Artist'],
+                                                            album['Album'], model, args.url, cache, args.num_ctx,
+                                                            store=store, slots=slots)
+            return f"{stats['tokens_per_sec']:.1f} tokens/s" if stats else "cached"
+    else:
+        import fix_reviews
+        config = fix_reviews.load_config()
+        if not config:
+            raise SystemExit(1)
+        client = fix_reviews.create_client(config)
+        cache = None if args.no_llm_cache else LLMCache(args.llm_cache)
+        max_chunk_tokens = args.max_chunk_tokens or fix_reviews.MAX_CHUNK_TOKENS
+
+        def reformat_text(metadata, text, album, path):
+            reformatted_review = fix_reviews.process_review_with_gpt(client, text, album['Artist'], album['Album'],
+                                                                     cache, max_chunk_tokens)
+            if not reformatted_review:
+                raise RuntimeError(f"Failed to reformat review for {album['Artist']} - {album['Album']}")
+            fix_reviews.save_reformatted_review(path, metadata, reformatted_review, store)
+            return "done"
+
+    def reformat(album):
+        path = os.path.join(args.reformatted, f"{album['AlbumID']}.txt")
+        if has_reformatted(path, store):
+            return None  # Reformatted by an earlier run
+        if store is not None:
+            review = store.get_review(album['AlbumID'])
+            metadata = format_metadata(album['Artist'], album['Album'], album['AlbumID'], review['Review URL'])
+            text = review['text']
+        else:
+            metadata, text = read_review_file(os.path.join(args.reviews, f"{album['AlbumID']}.txt"))
+        result = reformat_text(metadata, text, album, path)
+        print(f"[reformat] {album['Artist']} - {album['Album']}: saved to {args.store or path} ({result})")
+        return None
+
+    return reformat, router
+
+def write_ratings(csv_filename, albums, state):
+    """Write the ratings CSV that amg.py produces, for the albums this run went through"""
+    for album in albums:
+        record = state.get(album['AlbumID'])
+        album['AMG_Rating'] = (record or {}).get('rating') or ''
+    fieldnames = CSV_FIELDNAMES + ['AlbumID', 'AMG_Rating']
+    tmp_filename = csv_filename + '.tmp'
+    with open(tmp_filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(albums)
+    os.replace(tmp_filename, csv_filename)
+
+def run_pipeline(args):
+    os.makedirs(args.reviews, exist_ok=True)
+    os.makedirs(args.reformatted, exist_ok=True)
+    state_file = os.path.join(args.reviews, 'crawl_state.jsonl')
+    state = load_crawl_state(state_file)
+    store = LibraryStore(args.store) if args.store else None
+
+    stop = threading.Event()
+
+    def handle_interrupt(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        print("\nStopping: finishing the albums in progress (Ctrl-C again to quit now)...")
+        stop.set()
+
+    signal.signal(signal.SIGINT, handle_interrupt)
+
+    crawl_queue = queue.Queue(maxsize=args.queue_size)
+    reformat_queue = queue.Queue(maxsize=args.queue_size) if args.reformatter != 'none' else None
+    cache = None if args.no_cache else HTTPCache(args.cache, max_bytes=args.cache_max_mb * 1024 * 1024)
+    crawler = make_crawler(args, state, state_file, store, cache)
+    crawl_stage = Stage('crawl', args.crawl_workers, crawler, crawl_queue, reformat_queue, stop)
+    reformat_stage = router = None
+    if reformat_queue is not None:
+        reformat, router = make_reformatter(args, store)
+        # The router needs a worker for every slot of its backends to spill reviews over
+        workers = router.capacity if router is not None else args.reformat_workers
+        reformat_stage = Stage('reformat', workers, reformat, reformat_queue, stop=stop)
+
+    albums = []
+    source_result = {}
+
+    def produce():
+        try:
+            for row in favorite_albums(args, stop, source_result):
+                # Derive the ID from artist and album so it is the same on every run
+                row['AlbumID'] = album_key(row['Artist'], row['Album'])
+                albums.append(row)
+                crawl_queue.put(row)
+        except Exception as e:
+            print(f"[tidal] {e}")
+            stop.set()
+        finally:
+            for _ in range(crawl_stage.workers):
+                crawl_queue.put(DONE)
+
+    start = time.perf_counter()
+    source = threading.Thread(target=produce, name='tidal', daemon=True)
+    source.start()
+    crawl_stage.start()
+    if reformat_stage is not None:
+        reformat_stage.start()
+    try:
+        source.join()
+        crawl_stage.join(reformat_stage)
+        if reformat_stage is not None:
+            reformat_stage.join()
+    finally:
+        compact_crawl_state(state_file, state)
+        if cache is not None:
+            cache.close()
+    wall_time = time.perf_counter() - start
+
+    if stop.is_set():
+        print("Stopped early; run the pipeline again to continue where it left off")
+    else:
+        write_ratings(args.ratings, albums, state)
+        if store is not None:
+            store.upsert_albums(albums)
+        print(f"Ratings saved to {args.ratings}")
+    if store is not None:
+        store.close()
+
+    if 'new_favorites' in source_result:
+        print(f"{source_result['new_favorites']} new Tidal favorites")
+    print(f"\n{len(albums)} albums in {wall_time:.1f}s")
+    for stage in (crawl_stage, reformat_stage):
+        if stage is not None:
+            print(stage.summary(wall_time))
+    if router is not None:
+        for line in router.report():
+            print(f"  {line}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export Tidal favorites, fetch their AMG reviews and reformat "
+                                                 "them in one streaming run")
+    source = parser.add_argument_group('Tidal')
+    source.add_argument('--skip-tidal', action='store_true',
+                        help="Don't sync with Tidal, only process the albums already in the favorites CSV")
+    source.add_argument('--favorites', default=FAVORITES_CSV, help=f"Favorites CSV (default: {FAVORITES_CSV})")
+    source.add_argument('--session-file', default='tidal_session.json',
+                        help="Where the OAuth session is saved between runs (default: tidal_session.json)")
+    source.add_argument('--page-size', type=int, default=100, help="Favorites fetched per request (default: 100)")
+    source.add_argument('--tidal-rate', type=float, default=10.0,
+                        help="Maximum album detail requests per second (default: 10)")
+
+    crawl = parser.add_argument_group('Angry Metal Guy')
+    crawl.add_argument('--crawl-workers', type=int, default=4, help="Albums looked up at once (default: 4)")
+    crawl.add_argument('--rate', type=float, default=1.0,
+                       help="Maximum requests per second to angrymetalguy.com (default: 1)")
+    crawl.add_argument('--burst', type=int, default=2, help="Requests allowed back-to-back (default: 2)")
+    crawl.add_argument('--max-age-days', type=int, default=30,
+                       help="Re-search albums without a review after this many days (default: 30)")
+    crawl.add_argument('--reviews', default=REVIEWS_FOLDER, help=f"Review folder (default: {REVIEWS_FOLDER})")
+    crawl.add_argument('--ratings', default=RATINGS_CSV, help=f"Ratings CSV to write (default: {RATINGS_CSV})")
+    crawl.add_argument('--store', metavar='FILE',
+                       help="Save reviews and ratings in this library store (see store.py) instead of text files")
+    crawl.add_argument('--cache', default=DEFAULT_CACHE_FILE,
+                       help=f"Response cache file (default: {DEFAULT_CACHE_FILE})")
+    crawl.add_argument('--no-cache', action='store_true', help="Always download pages")
+    crawl.add_argument('--cache-max-mb', type=int, default=500,
+                       help="Maximum size of cached pages in MB (default: 500)")
+    crawl.add_argument('--parser', default=DEFAULT_BACKEND, choices=sorted(BACKEND_FACTORIES),
+                       help=f"HTML parser backend (default: {DEFAULT_BACKEND})")
+
+    reformat = parser.add_argument_group('Reformatting')
+    reformat.add_argument('--reformatter', choices=['ollama', 'openai', 'router', 'none'], default='ollama',
+                          help="Reformat reviews with a local Ollama model, the OpenAI API, the model router "
+                               "(router.py: a model per review length), or not at all (default: ollama)")
+    reformat.add_argument('--reformat-workers', type=int, default=4,
+                          help="Reviews reformatted at once; for Ollama match OLLAMA_NUM_PARALLEL (default: 4). "
+                               "The router runs one per slot of its backends instead")
+    reformat.add_argument('--model', help=f"Ollama model (default: {DEFAULT_OLLAMA_MODEL})")
+    reformat.add_argument('--url', default=OLLAMA_URL, help=f"Ollama server URL (default: {OLLAMA_URL})")
+    reformat.add_argument('--num-ctx', type=int, default=DEFAULT_NUM_CTX,
+                          help=f"Ollama context window in tokens (default: {DEFAULT_NUM_CTX})")
+    reformat.add_argument('--max-chunk-tokens', type=int,
+                          help="Split reviews longer than this many tokens for OpenAI (default: as fix_reviews.py)")
+    reformat.add_argument('--reformatted', default=REFORMATTED_FOLDER,
+                          help=f"Reformatted review folder (default: {REFORMATTED_FOLDER})")
+    reformat.add_argument('--llm-cache', default=LLM_CACHE_FILE,
+                          help=f"Shared LLM result cache (default: {LLM_CACHE_FILE})")
+    reformat.add_argument('--no-llm-cache', action='store_true', help="Don't use the LLM result cache")
+    add_router_arguments(parser.add_argument_group('Model router (--reformatter router)'))
+
+    parser.add_argument('--queue-size', type=int, default=16,
+                        help="Albums waiting between two stages before the earlier one pauses (default: 16)")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
+    run_pipeline(args)
+
+if __name__ == "__main__":
+    main()
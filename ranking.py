@@ -0,0 +1,269 @@
+# ranking.py
+"""Rank the reviewed albums we don't have yet by how well they fit the favorites.
+
+Every review in the AMG catalog (amg_catalog.py) becomes one row of a float32
+feature matrix: how often each genre term occurs in the review (log-scaled and
+L2-normalized), the AMG rating and the release year. The matrix is kept in
+ranking_index/features.f32 and memory-mapped like the embedding index;
+ranking_index/index.json maps rows to post IDs and remembers when each post
+was last modified, so an update only featurizes new and changed reviews.
+
+The taste profile is built from the favorites that have a review: the mean of
+their genre vectors, and the mean and spread of their release years. Every
+candidate is then scored in one NumPy pass:
+
+    0.6 * genre similarity + 0.25 * rating / 5 + 0.15 * year closeness
+
+Profiles come from existing rows, so ranking again after adding a favorite
+only costs that pass.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from reviews import RATINGS_CSV, REVIEWS_FOLDER, load_albums_data, review_fields, tokenize
+
+INDEX_FOLDER = 'ranking_index'
+GENRE_TERMS = [
+    'black', 'death', 'doom', 'thrash', 'heavy', 'power', 'speed', 'progressive', 'prog', 'folk',
+    'pagan', 'viking', 'symphonic', 'melodic', 'technical', 'brutal', 'sludge', 'stoner', 'post-metal',
+    'post-rock', 'atmospheric', 'blackgaze', 'grindcore', 'grind', 'metalcore', 'deathcore', 'hardcore',
+    'crust', 'industrial', 'gothic', 'funeral', 'epic', 'occult', 'psychedelic', 'djent', 'avant-garde',
+    'dissonant', 'orchestral', 'ambient', 'drone', 'punk', 'traditional', 'nwobhm', 'groove', 'cosmic',
+    'war', 'blackened', 'depressive', 'old-school', 'experimental',
+]
+TERM_COLUMNS = {term: i for i, term in enumerate(GENRE_TERMS)}
+RATING_COLUMN = len(GENRE_TERMS)
+YEAR_COLUMN = RATING_COLUMN + 1
+DIM = YEAR_COLUMN + 1
+WEIGHTS = {'genre': 0.6, 'rating': 0.25, 'year': 0.15}
+
+def review_features(text, rating=None, year=None):
+    """Feature row of a review: genre term weights, then rating and year (0 when unknown)"""
+    row = np.zeros(DIM, dtype=np.float32)
+    columns = [TERM_COLUMNS[token] for token in tokenize(text or '') if token in TERM_COLUMNS]
+    if columns:
+        columns, counts = np.unique(columns, return_counts=True)
+        row[columns] = 1 + np.log(counts)
+        row[:RATING_COLUMN] /= np.linalg.norm(row[:RATING_COLUMN])
+    try:
+        row[RATING_COLUMN] = float(rating) if rating else 0.0
+    except ValueError:
+        pass
+    if year is None:
+        year = review_fields(text)['year']
+    try:
+        row[YEAR_COLUMN] = int(str(year)[:4]) if year else 0
+    except ValueError:
+        pass
+    return row
+
+class FeatureIndex:
+    """Memory-mapped feature matrix of the catalog's reviews, grown by doubling like embeddings.ReviewIndex"""
+
+    def __init__(self, folder=INDEX_FOLDER):
+        self.folder = folder
+        self.meta_path = os.path.join(folder, 'index.json')
+        self.features_path = os.path.join(folder, 'features.f32')
+        self.meta = {'terms': GENRE_TERMS, 'count': 0, 'ids': [], 'modified': {}, 'links': {}, 'albums': {}}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        if self.meta['terms'] != GENRE_TERMS:
+            self.reset()  # Different columns, so every row has to be computed again
+        self.rows = {post_id: row for row, post_id in enumerate(self.meta['ids']) if post_id is not None}
+        self._matrix = None
+
+    @property
+    def count(self):
+        return self.meta['count']
+
+    def reset(self):
+        self._matrix = None
+        if os.path.exists(self.features_path):
+            os.remove(self.features_path)
+        self.meta = {'terms': GENRE_TERMS, 'count': 0, 'ids': [], 'modified': {}, 'links': {}, 'albums': {}}
+        self.rows = {}
+
+    def capacity(self):
+        if not os.path.exists(self.features_path):
+            return 0
+        return os.path.getsize(self.features_path) // (4 * DIM)
+
+    def matrix(self, writable=False):
+        """The used rows of the memory-mapped features file"""
+        if self._matrix is None or (writable and not self._matrix.flags.writeable):
+            if not self.capacity():
+                return np.zeros((0, DIM), dtype=np.float32)
+            self._matrix = np.memmap(self.features_path, dtype=np.float32, mode='r+' if writable else 'r',
+                                     shape=(self.capacity(), DIM))
+        return self._matrix[:self.count]
+
+    def _grow(self, rows_needed):
+        capacity = self.capacity()
+        if rows_needed <= capacity:
+            return
+        self._matrix = None
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.features_path, 'ab') as f:
+            f.truncate(max(rows_needed, 2 * capacity, 1024) * DIM * 4)
+
+    def add(self, posts):
+        """Store the features of new or changed posts, given as dicts from Catalog.get"""
+        new = [post['id'] for post in posts if str(post['id']) not in self.rows]
+        self._grow(self.count + len(new))
+        self.matrix(writable=True)
+        for post in posts:
+            post_id = str(post['id'])
+            row = self.rows.get(post_id)
+            if row is None:
+                row = self.meta['count']
+                self.rows[post_id] = row
+                self.meta['ids'].append(post_id)
+                self.meta['count'] += 1
+            self._matrix[row] = review_features(post['text'], post['rating'])
+            self.meta['modified'][post_id] = post['modified']
+            self.meta['links'][post['link']] = post_id
+            self.meta['albums'][post_id] = post['title']
+        self._matrix.flush()
+
+    def remove(self, post_ids):
+        """Blank out the rows of posts that left the catalog"""
+        if not post_ids:
+            return
+        self.matrix(writable=True)
+        links = {post_id: link for link, post_id in self.meta['links'].items()}
+        for post_id in post_ids:
+            row = self.rows.pop(post_id)
+            self._matrix[row] = 0
+            self.meta['ids'][row] = None
+            self.meta['modified'].pop(post_id, None)
+            self.meta['albums'].pop(post_id, None)
+            self.meta['links'].pop(links.get(post_id), None)
+        self._matrix.flush()
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+def update_index(index, catalog, batch_size=1000):
+    """Featurize new and changed catalog posts and drop deleted ones; returns (added, removed)"""
+    current = {str(post_id): modified for post_id, modified in catalog.modified_times().items()}
+    pending = [post_id for post_id, modified in current.items() if index.meta['modified'].get(post_id) != modified]
+    removed = [post_id for post_id in index.rows if post_id not in current]
+    index.remove(removed)
+    for start in range(0, len(pending), batch_size):
+        index.add([catalog.get(int(post_id)) for post_id in pending[start:start + batch_size]])
+    if pending or removed:
+        index.save()
+    return len(pending), len(removed)
+
+def load_favorites(csv_file=RATINGS_CSV, state_file=None):
+    """Favorites from amg.py's ratings CSV with the review URL of each, from the crawl state"""
+    state_file = state_file or os.path.join(REVIEWS_FOLDER, 'crawl_state.jsonl')
+    review_urls = {}
+    if os.path.exists(state_file):
+        with open(state_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                review_urls[record['AlbumID']] = record.get('review_url')
+    favorites = load_albums_data(csv_file)
+    for album_id, album in favorites.items():
+        album['Review URL'] = review_urls.get(album_id)
+    return favorites
+
+def taste_profile(index, favorites):
+    """(genre vector, mean year, year spread, rows of the favorites) from the favorites' catalog rows"""
+    rows = sorted({index.rows[index.meta['links'][album['Review URL']]] for album in favorites.values()
+                   if album['Review URL'] in index.meta['links']})
+    matrix = index.matrix()
+    genre = matrix[rows, :RATING_COLUMN].mean(axis=0) if rows else np.zeros(RATING_COLUMN, dtype=np.float32)
+    norm = np.linalg.norm(genre)
+    genre = genre / norm if norm else genre
+    years = np.array([int(album['Year']) for album in favorites.values() if str(album['Year']).isdigit()]
+                     or matrix[rows, YEAR_COLUMN][matrix[rows, YEAR_COLUMN] > 0].tolist(), dtype=np.float32)
+    mean_year = float(years.mean()) if len(years) else 0.0
+    # A few years either way always count as close
+    spread = max(float(years.std()), 5.0) if len(years) else 0.0
+    return genre.astype(np.float32), mean_year, spread, rows
+
+def rank(index, favorites, n=20, weights=WEIGHTS):
+    """Top-n (post ID, score) of the albums not among the favorites"""
+    matrix = index.matrix()
+    if not len(matrix):
+        return []
+    genre, mean_year, spread, favorite_rows = taste_profile(index, favorites)
+    ratings = matrix[:, RATING_COLUMN]
+    years = matrix[:, YEAR_COLUMN]
+    # Unknown ratings and years count as average rather than bad
+    rating_score = np.where(ratings > 0, ratings / 5, 0.5)
+    if spread:
+        year_score = np.where(years > 0, np.exp(-0.5 * ((years - mean_year) / spread) ** 2), 0.5)
+    else:
+        year_score = np.full(len(matrix), 0.5, dtype=np.float32)
+    scores = (weights['genre'] * (matrix[:, :RATING_COLUMN] @ genre) + weights['rating'] * rating_score
+              + weights['year'] * year_score)
+
+    valid = np.array([post_id is not None for post_id in index.meta['ids']], dtype=bool)
+    valid[favorite_rows] = False
+    rows = np.flatnonzero(valid)
+    scores = scores[rows]
+    n = min(n, len(rows))
+    if n <= 0:
+        return []
+    top = np.argpartition(-scores, n - 1)[:n]
+    top = top[np.argsort(-scores[top])]
+    return [(index.meta['ids'][rows[i]], float(scores[i])) for i in top]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recommend reviewed albums that fit the Tidal favorites")
+    parser.add_argument('--index', default=INDEX_FOLDER, help=f"Index folder (default: {INDEX_FOLDER})")
+    parser.add_argument('--catalog', default='amg_catalog.sqlite',
+                        help="Review catalog from amg_catalog.py (default: amg_catalog.sqlite)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('update', help="Featurize new and changed reviews in the catalog")
+    recommend_parser = subparsers.add_parser('recommend', help="Albums to listen to next")
+    recommend_parser.add_argument('-n', type=int, default=20, help="Number of albums to show (default: 20)")
+    recommend_parser.add_argument('--csv', default=RATINGS_CSV, help=f"Ratings CSV (default: {RATINGS_CSV})")
+    recommend_parser.add_argument('--no-update', action='store_true',
+                                  help="Rank with the features as they are, without reading the catalog")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    index = FeatureIndex(args.index)
+
+    if args.command == 'update' or not args.no_update:
+        from amg_catalog import Catalog
+        catalog = Catalog(args.catalog)
+        start = time.perf_counter()
+        added, removed = update_index(index, catalog)
+        catalog.close()
+        print(f"{added} reviews featurized, {removed} removed, {len(index.rows)} in the index "
+              f"({time.perf_counter() - start:.1f}s)")
+    if args.command == 'update':
+        return
+
+    if not index.count:
+        print(f"The index in '{args.index}' is empty; sync the catalog with 'python amg_catalog.py sync' first")
+        return
+    favorites = load_favorites(args.csv)
+    start = time.perf_counter()
+    results = rank(index, favorites, args.n)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Recommended for {len(favorites)} favorites:")
+    for post_id, score in results:
+        print(f"  {score:.3f}  {index.meta['albums'][post_id]} (post {post_id})")
+    print(f"({elapsed:.1f} ms over {len(index.rows)} reviews)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# recommender.py
+"""One entry point for every step of the project:
+
+    python recommender.py fetch-favorites              # tidal.py
+    python recommender.py crawl --async                # amg.py
+    python recommender.py reformat ollama --model mistral
+    python recommender.py models --cached              # get_models.py
+    python recommender.py search search "doom organ"   # review_search.py
+
+A subcommand takes the options of the script it runs (see `python
+recommender.py crawl --help`). Only the script of the chosen subcommand is
+imported, so openai, tidalapi, requests, bs4 and numpy are loaded by the
+commands that use them and not by the others.
+"""
+import argparse
+import importlib
+import sys
+
+# Subcommand: (module whose main() runs it, description)
+COMMANDS = {
+    'fetch-favorites': ('tidal', "Export the Tidal favorites to tidal_favorite_albums.csv"),
+    'crawl': ('amg', "Fetch the Angry Metal Guy reviews of the favorites"),
+    'reformat': (None, "Reformat the reviews with openai, ollama (default) or the model router"),
+    'models': ('get_models', "List the OpenAI models available to your API key"),
+    'search': ('review_search', "Index and search the reviews with BM25"),
+    'similar': ('embeddings', "Find albums with reviews like a given album's"),
+    'recommend': ('ranking', "Rank reviewed albums you don't have yet against your favorites"),
+    'pipeline': ('pipeline', "Run fetch-favorites, crawl and reformat as one streaming pipeline"),
+}
+REFORMATTERS = {'openai': 'fix_reviews', 'ollama': 'ollama_reviews', 'router': 'router'}
+
+def parse_args(argv=None):
+    epilog = "commands:\n" + "\n".join(f"  {name:<17} {description}" for name, (_, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(description="Album recommender: Tidal favorites, Angry Metal Guy reviews "
+                                                 "and what to listen to next",
+                                     epilog=epilog, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=COMMANDS, metavar='command', help="One of the commands below")
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="Options of the command, see '<command> --help'")
+    return parser.parse_args(argv)
+
+def run(command, args):
+    """Import the module of a subcommand and run its main() with `args` as the command line"""
+    module_name = COMMANDS[command][0]
+    prog = f"{sys.argv[0]} {command}"
+    if command == 'reformat':
+        reformatter = 'ollama'
+        if args and args[0] in REFORMATTERS:
+            reformatter, args = args[0], args[1:]
+        module_name = REFORMATTERS[reformatter]
+        prog += f" {reformatter}"
+    module = importlib.import_module(module_name)
+    # The scripts parse sys.argv themselves
+    sys.argv = [prog, *args]
+    return module.main()
+
+def main():
+    args = parse_args()
+    run(args.command, args.args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# review_metadata.py
+"""Structured review fields, kept next to the reviews in a typed SQLite table.
+
+amg.py takes the rating, label, release date, dynamic range, reviewer, tags
+and categories of every review from the same parse that extracts its text,
+and saves them here: in album_reviews/metadata.sqlite, or in the library
+store file when it runs with --store. Filters and reports can then query the
+fields directly instead of reading and parsing the review files again:
+
+    python review_metadata.py query --tag "Doom Metal" --min-rating 4 --year 2015-2020
+    python review_metadata.py stats
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+from reviews import REVIEWS_FOLDER
+
+METADATA_FILE = 'metadata.sqlite'
+DEFAULT_METADATA_FILE = os.path.join(REVIEWS_FOLDER, METADATA_FILE)
+COLUMNS = ['album_id', 'review_url', 'rating', 'label', 'release_date', 'year', 'dr', 'reviewer',
+           'categories', 'tags']
+
+class ReviewMetadata:
+    """Table of structured fields per album, plus one row per tag for filtering by tag"""
+
+    def __init__(self, path=DEFAULT_METADATA_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS review_metadata (
+                album_id TEXT PRIMARY KEY,
+                review_url TEXT,
+                rating REAL,
+                label TEXT,
+                release_date TEXT,
+                year INTEGER,
+                dr INTEGER,
+                reviewer TEXT,
+                categories TEXT,
+                tags TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS review_metadata_rating ON review_metadata (rating);
+            CREATE INDEX IF NOT EXISTS review_metadata_year ON review_metadata (year);
+            CREATE TABLE IF NOT EXISTS review_tags (
+                album_id TEXT NOT NULL,
+                tag TEXT NOT NULL COLLATE NOCASE,
+                PRIMARY KEY (album_id, tag)
+            );
+            CREATE INDEX IF NOT EXISTS review_tags_tag ON review_tags (tag);
+        """)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def put(self, album_id, review_url, fields):
+        """Store the fields of one review (a dict as returned by amg.parse_review)"""
+        try:
+            rating = float(fields.get('rating')) if fields.get('rating') else None
+        except ValueError:
+            rating = None
+        tags = fields.get('tags') or []
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO review_metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (album_id, review_url, rating, fields.get('label'), fields.get('release_date'),
+                               fields.get('year'), fields.get('dr'), fields.get('reviewer'),
+                               ', '.join(fields.get('categories') or []), ', '.join(tags), time.time()))
+            self.conn.execute("DELETE FROM review_tags WHERE album_id = ?", (album_id,))
+            self.conn.executemany("INSERT OR IGNORE INTO review_tags VALUES (?, ?)",
+                                  ((album_id, tag) for tag in tags))
+            self.conn.commit()
+
+    def get(self, album_id):
+        with self.lock:
+            row = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM review_metadata WHERE album_id = ?",
+                                    (album_id,)).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def query(self, tag=None, min_rating=None, years=None, label=None, reviewer=None, limit=None):
+        """Rows matching all given filters, best rated first; `years` is a (first, last) pair"""
+        where, params = [], []
+        if tag:
+            where.append("album_id IN (SELECT album_id FROM review_tags WHERE tag = ?)")
+            params.append(tag)
+        if min_rating is not None:
+            where.append("rating >= ?")
+            params.append(min_rating)
+        if years:
+            where.append("year BETWEEN ? AND ?")
+            params.extend(years)
+        if label:
+            where.append("label LIKE ?")
+            params.append(f"%{label}%")
+        if reviewer:
+            where.append("reviewer LIKE ?")
+            params.append(f"%{reviewer}%")
+        sql = f"SELECT {', '.join(COLUMNS)} FROM review_metadata"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY rating DESC, year DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def tag_counts(self, limit=20):
+        with self.lock:
+            return self.conn.execute("SELECT tag, COUNT(*) FROM review_tags GROUP BY tag COLLATE NOCASE "
+                                     "ORDER BY COUNT(*) DESC LIMIT ?", (limit,)).fetchall()
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM review_metadata").fetchone()[0]
+
+_sidecars = {}
+_sidecars_lock = threading.Lock()
+
+def open_metadata(path):
+    """The shared ReviewMetadata for a file, opened on first use"""
+    with _sidecars_lock:
+        if path not in _sidecars:
+            _sidecars[path] = ReviewMetadata(path)
+        return _sidecars[path]
+
+def parse_years(value):
+    """'2015-2020' or '2015' as a (first, last) pair"""
+    first, _, last = value.partition('-')
+    return int(first), int(last or first)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query the structured fields of the saved reviews")
+    parser.add_argument('--metadata', default=DEFAULT_METADATA_FILE,
+                        help=f"Metadata file, or a library store file (default: {DEFAULT_METADATA_FILE})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    query_parser = subparsers.add_parser('query', help="List the reviews matching some filters")
+    query_parser.add_argument('--tag', help="Tag or genre, e.g. \"Doom Metal\"")
+    query_parser.add_argument('--min-rating', type=float)
+    query_parser.add_argument('--year', type=parse_years, help="Release year or range, e.g. 2015-2020")
+    query_parser.add_argument('--label')
+    query_parser.add_argument('--reviewer')
+    query_parser.add_argument('-n', type=int, default=50, help="Number of reviews to show (default: 50)")
+    subparsers.add_parser('stats', help="Show the most common tags")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.metadata):
+        print(f"No review metadata in '{args.metadata}', run amg.py first")
+        return
+    metadata = ReviewMetadata(args.metadata)
+    if args.command == 'query':
+        rows = metadata.query(args.tag, args.min_rating, args.year, args.label, args.reviewer, args.n)
+        for row in rows:
+            print(f"{row['rating'] or '-':>4}  {row['release_date'] or '':<10}  {row['label'] or '':<24.24}  "
+                  f"{row['tags']}  (ID: {row['album_id']}, by {row['reviewer'] or 'unknown'})")
+        print(f"{len(rows)} reviews")
+    elif args.command == 'stats':
+        print(f"{metadata.count()} reviews")
+        for tag, count in metadata.tag_counts():
+            print(f"{count:>6}  {tag}")
+    metadata.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+# review_search.py
+"""Full-text search over the harvested reviews, ranked with BM25.
+
+The inverted index lives in search_index/ as a list of immutable segments.
+Each segment stores its sorted term list, and for every term a slice of two
+compact postings arrays (document number and term frequency), as .npy files
+that are memory-mapped when searched. The reviews themselves (segment, text
+hash, names, rating, year, length) are rows of index.sqlite, which also holds
+the segment list, so an update commits in one transaction. Adding reviews
+writes a new segment; changed and deleted reviews are only dropped from
+index.sqlite and disappear from the postings when segments are merged, like
+in Lucene.
+
+Segments are written with NumPy, but a query reads them with mmap and
+memoryview alone and only looks up the rows of its best candidates, so a
+one-off search neither imports NumPy nor reads every review's row.
+"""
+import argparse
+import bisect
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import time
+from collections import Counter, deque
+from itertools import repeat
+from operator import add, mul, truediv
+
+from reviews import RATINGS_CSV, REVIEWS_FOLDER, load_albums_data, load_reviews, read_review, tokenize
+
+INDEX_FOLDER = 'search_index'
+SEGMENT_DOCS = 5000  # Reviews per segment written by one update
+MAX_SEGMENTS = 8     # More than this and all segments are merged into one
+MAX_TERM_LENGTH = 40
+BM25_K1 = 1.2
+BM25_B = 0.75
+# memoryview formats of the .npy number types the segments use
+NPY_FORMATS = {'i8': 'q', 'i4': 'i', 'u2': 'H'}
+NPY_HEADER = re.compile(rb"'descr':\s*'([<>|=])(\w+)'.*'shape':\s*\((\d*),?\)", re.S)
+
+def numpy():
+    """NumPy, imported when segments are built or merged; queries don't need it"""
+    import numpy
+    return numpy
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_year(value):
+    match = re.match(r'\d{4}', str(value or ''))
+    return int(match.group()) if match else None
+
+class NpyArray:
+    """Memory-mapped 1-D .npy array read without NumPy: numbers as a memoryview, strings decoded on access"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # Format 1.0 has a 2-byte header length, 2.0 and 3.0 a 4-byte one
+        size_bytes = 2 if self.map[6] == 1 else 4
+        start = 8 + size_bytes + int.from_bytes(self.map[8:8 + size_bytes], 'little')
+        match = NPY_HEADER.search(self.map[8 + size_bytes:start])
+        if match is None:
+            raise ValueError(f"{path} is not a 1-D .npy array")
+        order, kind, length = match.group(1).decode(), match.group(2).decode(), int(match.group(3) or 0)
+        if order == '>' or (order != '|' and sys.byteorder != 'little'):
+            raise ValueError(f"{path} is not in this machine's byte order")
+        data = memoryview(self.map)[start:]
+        self.width = None
+        if kind.startswith('U'):
+            # Fixed-width UTF-32 strings, padded with zeros
+            self.width = 4 * int(kind[1:])
+            self.values = data[:length * self.width]
+            self.length = length
+        else:
+            self.values = data.cast(NPY_FORMATS[kind])[:length]
+            self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if self.width is None:
+            return self.values[i]
+        return self.values[i * self.width:(i + 1) * self.width].tobytes().decode('utf-32-le').rstrip('\0')
+
+class Segment:
+    """One immutable part of the inverted index"""
+
+    FIELDS = ('terms', 'offsets', 'docs', 'tfs', 'album_ids', 'lengths')
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        for name in self.FIELDS:
+            setattr(self, name, NpyArray(os.path.join(path, f"{name}.npy")))
+
+    def arrays(self):
+        """The segment's arrays as memory-mapped NumPy arrays, for merging"""
+        np = numpy()
+        return {name: np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r') for name in self.FIELDS}
+
+    @staticmethod
+    def write(path, terms, term_ids, docs, tfs, album_ids, lengths):
+        """Write postings given as parallel (term id, doc, tf) arrays into a segment folder"""
+        np = numpy()
+        order = np.lexsort((docs, term_ids))
+        term_ids = term_ids[order]
+        arrays = {
+            'terms': terms,
+            'offsets': np.searchsorted(term_ids, np.arange(len(terms) + 1)).astype(np.int64),
+            'docs': docs[order].astype(np.int32),
+            'tfs': np.minimum(tfs[order], np.iinfo(np.uint16).max).astype(np.uint16),
+            'album_ids': np.asarray(album_ids, dtype=str),
+            'lengths': np.asarray(lengths, dtype=np.int32),
+        }
+        # Leftovers of an update that was interrupted before index.sqlite was committed
+        tmp_path = path + '.tmp'
+        for leftover in (path, tmp_path):
+            shutil.rmtree(leftover, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def build(cls, path, reviews):
+        """Tokenize reviews into a new segment; returns the number of tokens of every review"""
+        np = numpy()
+        postings_terms, postings_docs, postings_tfs, lengths = [], [], [], []
+        for doc, review in enumerate(reviews):
+            tokens = [token for token in tokenize(review['text']) if len(token) <= MAX_TERM_LENGTH]
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings_terms.append(term)
+                postings_docs.append(doc)
+                postings_tfs.append(tf)
+        terms, term_ids = np.unique(np.asarray(postings_terms, dtype=str), return_inverse=True)
+        cls.write(path, terms, term_ids, np.asarray(postings_docs, dtype=np.int32),
+                  np.asarray(postings_tfs, dtype=np.int64), [review['AlbumID'] for review in reviews], lengths)
+        return lengths
+
+    def postings(self, term):
+        """(docs, tfs) of a term in this segment"""
+        i = bisect.bisect_left(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+class SearchIndex:
+    """BM25 search over the review segments, with the reviews listed in index.sqlite"""
+
+    def __init__(self, folder=INDEX_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(folder, 'index.sqlite'))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                album_id TEXT PRIMARY KEY,
+                segment TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                artist TEXT,
+                album TEXT,
+                rating REAL,
+                year INTEGER,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+        self.meta = {'next_segment': 1, 'segments': [], 'count': 0, 'total_length': 0}
+        self.meta.update((key, json.loads(value)) for key, value in self.conn.execute("SELECT key, value FROM meta"))
+        self._segments = None
+
+    def save(self):
+        """Commit the reviews and the segment list together"""
+        self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                              ((key, json.dumps(value)) for key, value in self.meta.items()))
+        self.conn.commit()
+
+    def segments(self):
+        """The memory-mapped segments, opened on first use"""
+        if self._segments is None:
+            self._segments = [Segment(os.path.join(self.folder, name)) for name in self.meta['segments']]
+        return self._segments
+
+    def doc(self, album_id):
+        """Artist, album, rating, year and segment of an indexed review, or None"""
+        row = self.conn.execute("SELECT artist, album, rating, year, segment FROM docs WHERE album_id = ?",
+                                (album_id,)).fetchone()
+        return dict(zip(('artist', 'album', 'rating', 'year', 'segment'), row)) if row else None
+
+    def _new_segment_name(self):
+        name = f"segment_{self.meta['next_segment']:06d}"
+        self.meta['next_segment'] += 1
+        return name
+
+    def update(self, reviews, albums_data=None):
+        """Index new and changed reviews, drop deleted ones and refresh ratings; returns (added, removed)"""
+        albums_data = albums_data or {}
+        hashes = dict(self.conn.execute("SELECT album_id, hash FROM docs"))
+        current = {review['AlbumID'] for review in reviews}
+        removed = [album_id for album_id in hashes if album_id not in current]
+        self.conn.executemany("DELETE FROM docs WHERE album_id = ?", ((album_id,) for album_id in removed))
+
+        pending = [review for review in reviews if hashes.get(review['AlbumID']) != text_hash(review['text'])]
+        for start in range(0, len(pending), SEGMENT_DOCS):
+            batch = pending[start:start + SEGMENT_DOCS]
+            name = self._new_segment_name()
+            lengths = Segment.build(os.path.join(self.folder, name), batch)
+            self.meta['segments'].append(name)
+            self.conn.executemany("INSERT OR REPLACE INTO docs (album_id, segment, hash, artist, album, length) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)",
+                                  ((review['AlbumID'], name, text_hash(review['text']), review['Artist'],
+                                    review['Album'], length) for review, length in zip(batch, lengths)))
+
+        # Ratings and years come from the CSV and can change without the review changing
+        self.conn.executemany("UPDATE docs SET rating = ?, year = ? WHERE album_id = ?",
+                              ((parse_float(album.get('AMG_Rating')), parse_year(album.get('Year')), album_id)
+                               for album_id, album in albums_data.items()))
+        # For BM25's average document length, without reading the rows on every query
+        count, total_length = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+        self.meta.update(count=count, total_length=total_length)
+
+        self._segments = None
+        if len(self.meta['segments']) > MAX_SEGMENTS:
+            self.merge()
+        self.save()
+        return len(pending), len(removed)
+
+    def merge(self):
+        """Rewrite all segments as one, leaving out changed and deleted reviews"""
+        np = numpy()
+        segments = self.segments()
+        if not segments:
+            return
+        doc_segments = dict(self.conn.execute("SELECT album_id, segment FROM docs"))
+        all_terms, term_ids, docs, tfs, album_ids, lengths = [], [], [], [], [], []
+        term_offset = 0
+        doc_offset = 0
+        for segment in segments:
+            arrays = segment.arrays()
+            # Changed reviews stay in their old segment until a merge
+            live = np.array([doc_segments.get(album_id) == segment.name for album_id in arrays['album_ids'].tolist()],
+                            dtype=bool)
+            # New document numbers of the live documents, -1 for the rest
+            new_docs = np.full(len(live), -1, dtype=np.int64)
+            new_docs[live] = doc_offset + np.arange(live.sum())
+            doc_offset += int(live.sum())
+            album_ids.extend(np.asarray(arrays['album_ids'])[live])
+            lengths.append(np.asarray(arrays['lengths'])[live])
+
+            segment_term_ids = np.repeat(np.arange(len(arrays['terms'])), np.diff(arrays['offsets']))
+            keep = new_docs[arrays['docs']] >= 0
+            all_terms.append(np.asarray(arrays['terms']))
+            term_ids.append(segment_term_ids[keep] + term_offset)
+            docs.append(new_docs[arrays['docs']][keep])
+            tfs.append(np.asarray(arrays['tfs'])[keep])
+            term_offset += len(arrays['terms'])
+
+        terms, inverse = np.unique(np.concatenate(all_terms), return_inverse=True)
+        term_ids = inverse[np.concatenate(term_ids)]
+        # Drop terms that only occurred in removed documents
+        used = np.unique(term_ids)
+        remap = np.full(len(terms), -1, dtype=np.int64)
+        remap[used] = np.arange(len(used))
+
+        name = self._new_segment_name()
+        Segment.write(os.path.join(self.folder, name), terms[used], remap[term_ids],
+                      np.concatenate(docs), np.concatenate(tfs), album_ids, np.concatenate(lengths))
+        old_segments = self.meta['segments']
+        self.meta['segments'] = [name]
+        self.conn.execute("UPDATE docs SET segment = ?", (name,))
+        self.save()
+        self._segments = None
+        for old_name in old_segments:
+            shutil.rmtree(os.path.join(self.folder, old_name), ignore_errors=True)
+
+    def search(self, query, k=10, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        """Top-k (AlbumID, BM25 score) for a query, restricted by AMG rating and release year"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        total_docs = self.meta['count']
+        if not terms or not total_docs:
+            return []
+        segments = self.segments()
+
+        # Collection statistics over live documents; document frequencies include
+        # not yet merged old versions, as in Lucene
+        postings = [[segment.postings(term) for term in terms] for segment in segments]
+        idf = [math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+               for df in (sum(len(p[i][0]) for p in postings if p[i] is not None) for i in range(len(terms)))]
+        # BM25 term score w * tf / (tf + norm) with norm = K1 * (1 - B + B * length / average length)
+        c = BM25_K1 * (1 - BM25_B)
+        d = BM25_K1 * BM25_B * total_docs / (self.meta['total_length'] or 1)
+
+        # Scores are summed over dense per-segment lists with map(), which keeps the
+        # loops over the postings in C
+        candidates = []
+        for segment, segment_postings in zip(segments, postings):
+            # Reviews share lengths, so each norm is only computed once, as Lucene caches them
+            lengths = segment.lengths.values.tolist()
+            norms = list(map({length: c + d * length for length in set(lengths)}.__getitem__, lengths))
+            scores = [0.0] * len(norms)
+            for term_idf, posting in zip(idf, segment_postings):
+                if posting is None:
+                    continue
+                docs, tfs = posting[0].tolist(), posting[1].tolist()
+                term_scores = [0.0] * len(norms)
+                weighted = map(mul, tfs, repeat(term_idf * (BM25_K1 + 1), len(tfs)))
+                deque(map(term_scores.__setitem__, docs,
+                          map(truediv, weighted, map(add, tfs, map(norms.__getitem__, docs)))), maxlen=0)
+                scores = list(map(add, scores, term_scores))
+            candidates.append((segment, scores))
+
+        # Rows, and with them liveness, ratings and years, are only looked up for the
+        # best candidates, fetching more of them while filters turn too many away
+        results = []
+        wanted = k
+        while len(results) < k:
+            top = heapq.nlargest(wanted, ((scores[doc], number, doc) for number, (_, scores) in enumerate(candidates)
+                                          for doc in heapq.nlargest(wanted, range(len(scores)), key=scores.__getitem__)))
+            results = []
+            for score, number, doc in top:
+                if score <= 0:
+                    break
+                segment = candidates[number][0]
+                album_id = segment.album_ids[doc]
+                entry = self.doc(album_id)
+                # Changed reviews stay in their old segment until a merge
+                if entry is None or entry['segment'] != segment.name:
+                    continue
+                rating, year = entry['rating'], entry['year'] or 0
+                if min_rating is not None and (rating is None or rating < min_rating):
+                    continue
+                if max_rating is not None and (rating is None or rating > max_rating):
+                    continue
+                if min_year is not None and year < min_year:
+                    continue
+                if max_year is not None and not 0 < year <= max_year:
+                    continue
+                results.append((album_id, score))
+                if len(results) == k:
+                    break
+            if len(top) < wanted:
+                break
+            wanted *= 4
+        return results
+
+def snippet(text, terms, width=160):
+    """The first sentence of a review that mentions one of the query terms"""
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        if any(term in tokenize(sentence) for term in terms):
+            return sentence if len(sentence) <= width else sentence[:width - 3] + '...'
+    return ''
+
+def parse_year_range(value):
+    """'2015', '2015-2020', '2015-' or '-2020' as (min_year, max_year)"""
+    low, dash, high = value.partition('-')
+    if not dash:
+        high = low
+    return (int(low) if low else None, int(high) if high else None)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Full-text search over the album reviews")
+    parser.add_argument('--index', default=INDEX_FOLDER, help=f"Index folder (default: {INDEX_FOLDER})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    update_parser = subparsers.add_parser('update', help="Index new and changed reviews and drop deleted ones")
+    update_parser.add_argument('--reviews', default=REVIEWS_FOLDER,
+                               help=f"Folder with the review files (default: {REVIEWS_FOLDER})")
+    update_parser.add_argument('--csv', default=RATINGS_CSV,
+                               help=f"CSV with the AMG ratings and years (default: {RATINGS_CSV})")
+    update_parser.add_argument('--store', metavar='FILE',
+                               help="Read reviews, ratings and years from this library store (see store.py)")
+    update_parser.add_argument('--merge', action='store_true', help="Merge all segments into one")
+
+    search_parser = subparsers.add_parser('search', help="Reviews ranked by BM25 for a query")
+    search_parser.add_argument('query', help="Words to search for, e.g. \"dissonant black metal\"")
+    search_parser.add_argument('-k', type=int, default=10, help="Number of results (default: 10)")
+    search_parser.add_argument('--min-rating', type=float, help="Only albums rated at least this by AMG")
+    search_parser.add_argument('--max-rating', type=float, help="Only albums rated at most this by AMG")
+    search_parser.add_argument('--year', type=parse_year_range,
+                               help="Release year or range, e.g. 2019 or 2015-2020")
+    search_parser.add_argument('--reviews', default=REVIEWS_FOLDER,
+                               help=f"Folder with the review files, for snippets (default: {REVIEWS_FOLDER})")
+    search_parser.add_argument('--store', metavar='FILE', help="Library store to take snippets from instead")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    index = SearchIndex(args.index)
+
+    if args.command == 'update':
+        start = time.perf_counter()
+        if args.store:
+            from store import LibraryStore
+            store = LibraryStore(args.store)
+            reviews, albums_data = list(store.iter_reviews()), store.albums_data()
+        else:
+            try:
+                albums_data = load_albums_data(args.csv)
+            except FileNotFoundError:
+                print(f"'{args.csv}' not found, ratings and years won't be searchable")
+                albums_data = {}
+            reviews = load_reviews(args.reviews)
+        added, removed = index.update(reviews, albums_data)
+        if args.merge:
+            index.merge()
+        print(f"{added} reviews indexed, {removed} removed, {index.meta['count']} in "
+              f"{len(index.meta['segments'])} segment(s) ({time.perf_counter() - start:.1f}s)")
+        return
+
+    min_year, max_year = args.year or (None, None)
+    index.segments()  # Open the segments first so the timing is of the query alone
+    start = time.perf_counter()
+    results = index.search(args.query, args.k, args.min_rating, args.max_rating, min_year, max_year)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    terms = tokenize(args.query)
+    store = None
+    if args.store:
+        from store import LibraryStore
+        store = LibraryStore(args.store)
+    for album_id, score in results:
+        doc = index.doc(album_id)
+        rating = f", rated {doc['rating']:g}" if doc['rating'] is not None else ""
+        year = f" ({doc['year']})" if doc['year'] else ""
+        print(f"{score:6.2f}  {doc['artist']} - {doc['album']}{year}{rating} (ID: {album_id})")
+        review_path = os.path.join(args.reviews, f"{album_id}.txt")
+        review = store.get_review(album_id) if store else (
+            read_review(review_path) if os.path.exists(review_path) else None)
+        if review:
+            print(f"        {snippet(review['text'], terms)}")
+    print(f"{len(results)} results in {elapsed:.1f} ms")
+
+if __name__ == "__main__":
+    main()
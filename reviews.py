@@ -0,0 +1,146 @@
+# reviews.py
+"""Writing and reading the review files, and reading the ratings CSV written by amg.py.
+
+Each file in album_reviews/ starts with the 4-line header written by
+save_review (Artist, Album, Album ID, Review URL), then a blank line and
+the review text.
+"""
+import csv
+import hashlib
+import os
+import re
+import unicodedata
+from datetime import datetime
+
+import metrics
+
+REVIEWS_FOLDER = 'album_reviews'
+RATINGS_CSV = 'tidal_favorite_albums_with_ratings.csv'
+
+def format_metadata(artist, album, album_id, review_url):
+    """The 4-line header at the top of review and reformatted review files"""
+    return f"Artist: {artist}\nAlbum: {album}\nAlbum ID: {album_id}\nReview URL: {review_url}"
+
+def save_review(reviews_folder, album, review_url, review_text, store=None, fields=None):
+    """Write a review text file with the 4-line metadata header, or put it in the library store.
+
+    `fields` from parse_review go to the review metadata table next to the
+    reviews: album_reviews/metadata.sqlite, or the library store file.
+    """
+    if fields is not None:
+        from review_metadata import METADATA_FILE, open_metadata  # It imports this module for REVIEWS_FOLDER
+        metadata = open_metadata(store.path if store is not None else os.path.join(reviews_folder, METADATA_FILE))
+        with metrics.timer('file_write', kind='review_metadata', target='sqlite'):
+            metadata.put(album['AlbumID'], review_url, fields)
+    if store is not None:
+        with metrics.timer('file_write', kind='review', target='store'):
+            store.put_review(album['AlbumID'], review_url, review_text)
+        return f"{store.path} (ID: {album['AlbumID']})"
+    review_filename = os.path.join(reviews_folder, f"{album['AlbumID']}.txt")
+    with metrics.timer('file_write', kind='review', target='file'):
+        with open(review_filename, 'w', encoding='utf-8') as f:
+            # Include the album ID in the review file
+            f.write(format_metadata(album['Artist'], album['Album'], album['AlbumID'], review_url) + "\n\n")
+            f.write(review_text)
+    return review_filename
+
+def album_key(artist_name, album_name):
+    """Stable album ID derived from the normalized artist and album names"""
+    def normalize(value):
+        value = unicodedata.normalize('NFKC', value or '').casefold()
+        return ' '.join(value.split())
+    digest = hashlib.sha1(f"{normalize(artist_name)}\x1f{normalize(album_name)}".encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+def read_review_file(review_file_path):
+    """Split a review file into its 4-line metadata header and the review text"""
+    with open(review_file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    # Extract review metadata (first 4 lines) and the review text
+    lines = content.split('\n')
+    metadata = '\n'.join(lines[:4])
+    original_review = '\n'.join(lines[4:]).strip()
+    return metadata, original_review
+
+def read_review(review_file_path):
+    """Album ID, artist, album, review URL and text of a review file"""
+    metadata, text = read_review_file(review_file_path)
+    fields = {}
+    for line in metadata.split('\n'):
+        name, _, value = line.partition(': ')
+        fields[name] = value
+    album_id = fields.get('Album ID') or os.path.splitext(os.path.basename(review_file_path))[0]
+    return {'AlbumID': album_id, 'Artist': fields.get('Artist', ''), 'Album': fields.get('Album', ''),
+            'Review URL': fields.get('Review URL', ''), 'text': text}
+
+def load_reviews(reviews_folder=REVIEWS_FOLDER):
+    """All non-empty reviews in a folder, in file name order"""
+    reviews = []
+    for filename in sorted(os.listdir(reviews_folder)):
+        if filename.endswith('.txt'):
+            review = read_review(os.path.join(reviews_folder, filename))
+            if review['text']:
+                reviews.append(review)
+    return reviews
+
+def load_albums_data(csv_file=RATINGS_CSV):
+    """Read artist, album, year and rating for every album ID in the ratings CSV"""
+    albums_data = {}
+    with open(csv_file, 'r', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            album_id = row.get('AlbumID')
+            if album_id:
+                albums_data[album_id] = {
+                    'Artist': row.get('Artist', ''),
+                    'Album': row.get('Album', ''),
+                    'Year': row.get('Year', ''),
+                    'AMG_Rating': row.get('AMG_Rating', '')
+                }
+    return albums_data
+
+# The facts box at the end of a review: "Label:", "DR: 8 |", "Releases Worldwide: March 5th, 2019"
+LABEL_PATTERN = re.compile(r"Label:\s*([^\n|]+)")
+DR_PATTERN = re.compile(r"\bDR:\s*(\d+)")
+FACTS_LENGTH = 2000
+RELEASE_PATTERN = re.compile(r"Releases?\s+Worldwide:\s*([A-Za-z]+)\s+(\d{1,2})(?:st|nd|rd|th)?,?\s*(\d{4})")
+
+def review_fields(review_text):
+    """Label, release date (ISO), release year and dynamic range from the facts box of a review"""
+    fields = {'label': None, 'release_date': None, 'year': None, 'dr': None}
+    # The facts box closes the review, so there's no need to scan the whole text
+    tail = (review_text or '')[-FACTS_LENGTH:]
+    match = LABEL_PATTERN.search(tail)
+    if match and match.group(1).strip():
+        fields['label'] = match.group(1).strip()
+    match = DR_PATTERN.search(tail)
+    if match:
+        fields['dr'] = int(match.group(1))
+    match = RELEASE_PATTERN.search(tail)
+    if match:
+        month, day, year = match.groups()
+        fields['year'] = int(year)
+        try:
+            # The first three letters work for full and abbreviated month names alike
+            fields['release_date'] = datetime.strptime(f"{month[:3]} {day} {year}", "%b %d %Y").date().isoformat()
+        except ValueError:
+            fields['release_date'] = year  # Not a month name
+    return fields
+
+# Letters and digits of any script, so "Motörhead" or "Лес" stay whole words and
+# one-character words ("5", or a single CJK character) are kept too
+TOKEN_PATTERN = re.compile(r"[^\W_](?:[^\W_]|['\-])*")
+# Bumped when tokenize() changes, so TF-IDF embedding models fitted with the old tokens are refitted
+TOKENIZER_VERSION = 3
+STOP_WORDS = frozenset("""
+a about after all also an and any are as at be been but by can could did do does for from had has have he her
+his how i if in into is it its just like me more most my no not of on one only or our out so some than that the
+their them then there these they this those to too up was we were what when which while who will with would you
+""".split())
+
+def tokenize(text):
+    """Lowercased words of a text without accents and the most common English words"""
+    if not text.isascii():
+        text = ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+    return [token for token in TOKEN_PATTERN.findall(text.casefold()) if token not in STOP_WORDS]
@@ -0,0 +1,312 @@
+# router.py
+"""Send each review to the model that suits its length, and spill over when that model is busy.
+
+Short reviews go to a small, fast local model and long ones to a larger
+model, both through Ollama. Each backend takes a fixed number of reviews at
+once (for Ollama, the server's OLLAMA_NUM_PARALLEL); when the preferred
+backend of a review is full, or fails, the review goes to the next backend of
+its route instead of waiting:
+
+    short reviews: small model -> large model -> OpenAI (with --openai)
+    long reviews:  large model -> OpenAI (with --openai)
+
+The Ollama models are loaded before the first review and kept loaded with
+`keep_alive`, so no review waits for a model to load. At the end the
+throughput of every backend is printed, to tune the routing with:
+
+    python router.py --small-model llama3.2:3b --large-model llama3 --long-tokens 1500 --openai
+"""
+import argparse
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from chunking import count_tokens
+from dedup import copy_reformatted, reviews_to_reformat
+from llm_cache import LLMCache, DEFAULT_CACHE_FILE
+from ollama_reviews import (DEFAULT_KEEP_ALIVE, DEFAULT_NUM_CTX, OLLAMA_URL, create_session, warm_up,
+                            write_reformatted_review)
+from reviews import load_albums_data
+from store import LibraryStore, read_saved_review, review_filenames
+
+SMALL_MODEL = 'llama3.2:3b'
+LARGE_MODEL = 'llama3'
+# Reviews longer than this many tokens go to the large model
+LONG_REVIEW_TOKENS = 1500
+
+class Backend(ABC):
+    """A model that takes up to `capacity` reviews at once, with its throughput so far"""
+
+    kind = None
+
+    def __init__(self, name, model, capacity, store=None):
+        self.name = name
+        self.model = model
+        self.capacity = capacity
+        # Results go to this library store instead of the reformatted review files
+        self.store = store
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.stats = {'reviews': 0, 'cached': 0, 'fallbacks': 0, 'errors': 0, 'tokens': 0, 'busy': 0.0}
+
+    def warm_up(self):
+        pass
+
+    @abstractmethod
+    def reformat(self, metadata, text, artist, album, path):
+        """Reformat a review into `path`; returns the generated tokens, or None when it came from the cache"""
+
+    def record(self, tokens, seconds, fallback):
+        with self.lock:
+            self.stats['reviews'] += 1
+            self.stats['cached'] += tokens is None
+            self.stats['fallbacks'] += fallback
+            self.stats['tokens'] += tokens or 0
+            self.stats['busy'] += seconds
+
+    def record_error(self):
+        with self.lock:
+            self.stats['errors'] += 1
+
+class OllamaBackend(Backend):
+    kind = 'ollama'
+
+    def __init__(self, name, model, session=None, url=OLLAMA_URL, cache=None, num_ctx=DEFAULT_NUM_CTX,
+                 keep_alive=DEFAULT_KEEP_ALIVE, capacity=4, store=None):
+        super().__init__(name, model, capacity, store)
+        self.session = session or create_session(pool_size=capacity)
+        self.url = url
+        self.cache = cache
+        self.num_ctx = num_ctx
+        self.keep_alive = keep_alive
+        # Parts of long reviews take up capacity too
+        self.slots = threading.BoundedSemaphore(capacity)
+
+    def warm_up(self):
+        return warm_up(self.model, self.session, self.url, self.keep_alive)
+
+    def reformat(self, metadata, text, artist, album, path):
+        stats = write_reformatted_review(self.session, metadata, text, path, artist, album, self.model, self.url,
+                                         self.cache, self.num_ctx, self.keep_alive, self.store, self.slots)
+        return stats['tokens'] if stats else None
+
+class OpenAIBackend(Backend):
+    kind = 'openai'
+
+    def __init__(self, name, client, model=None, cache=None, max_chunk_tokens=None, capacity=8, store=None):
+        import fix_reviews
+        super().__init__(name, model or fix_reviews.MODEL, capacity, store)
+        self.client = client
+        self.cache = cache
+        self.max_chunk_tokens = max_chunk_tokens or fix_reviews.MAX_CHUNK_TOKENS
+
+    def reformat(self, metadata, text, artist, album, path):
+        import fix_reviews
+        cached = fix_reviews.cached_review(self.cache, text, artist, album, self.max_chunk_tokens,
+                                           self.model) is not None
+        reformatted_review = fix_reviews.process_review_with_gpt(self.client, text, artist, album, self.cache,
+                                                                 self.max_chunk_tokens, self.model)
+        if not reformatted_review:
+            raise RuntimeError(f"{self.model} returned nothing")
+        fix_reviews.save_reformatted_review(path, metadata, reformatted_review, self.store, self.model)
+        return None if cached else count_tokens(reformatted_review)
+
+class Router:
+    """Picks a backend for each review by its length, falling back along the route when one is full or fails"""
+
+    def __init__(self, short, long=None, long_tokens=LONG_REVIEW_TOKENS):
+        self.routes = {'short': short, 'long': long or short}
+        self.long_tokens = long_tokens
+        self.condition = threading.Condition()
+        self.started_at = time.perf_counter()
+
+    @property
+    def backends(self):
+        return list(dict.fromkeys(self.routes['short'] + self.routes['long']))
+
+    @property
+    def capacity(self):
+        return sum(backend.capacity for backend in self.backends)
+
+    def warm_up(self):
+        """Load every local model before the first review"""
+        for backend in self.backends:
+            try:
+                seconds = backend.warm_up()
+                if seconds is not None:
+                    print(f"Loaded {backend.model} in {seconds:.1f}s")
+            except Exception as e:
+                print(f"Could not load {backend.model} ahead of time: {e}")
+        self.started_at = time.perf_counter()
+
+    def route(self, text):
+        return 'long' if count_tokens(text) > self.long_tokens else 'short'
+
+    def _acquire(self, candidates):
+        """The first backend with a free slot, waiting for one when all of them are busy"""
+        with self.condition:
+            while True:
+                for backend in candidates:
+                    if backend.in_flight < backend.capacity:
+                        backend.in_flight += 1
+                        return backend
+                self.condition.wait()
+
+    def _release(self, backend):
+        with self.condition:
+            backend.in_flight -= 1
+            self.condition.notify_all()
+
+    def reformat(self, metadata, text, artist, album, path):
+        """Reformat a review into `path`; returns the backend that did it and the tokens it generated"""
+        route = self.route(text)
+        candidates = list(self.routes[route])
+        while True:
+            backend = self._acquire(candidates)
+            start = time.perf_counter()
+            try:
+                tokens = backend.reformat(metadata, text, artist, album, path)
+            except Exception as e:
+                backend.record_error()
+                metrics.count('router_errors', backend=backend.name)
+                candidates.remove(backend)
+                if not candidates:
+                    raise
+                print(f"{backend.name} ({backend.model}) failed on {artist} - {album}: {e}; "
+                      f"trying {candidates[0].name}")
+                continue
+            finally:
+                self._release(backend)
+            fallback = backend is not self.routes[route][0]
+            backend.record(tokens, time.perf_counter() - start, fallback)
+            metrics.count('router_reviews', backend=backend.name, route=route, fallback=fallback)
+            return backend, tokens
+
+    def report(self):
+        """One line per backend: reviews, fallbacks, errors and tokens per second"""
+        wall = time.perf_counter() - self.started_at
+        lines = []
+        for backend in self.backends:
+            stats = backend.stats
+            generated = stats['reviews'] - stats['cached']
+            per_request = stats['tokens'] / stats['busy'] if stats['busy'] and generated else 0.0
+            lines.append(f"{backend.name:<6} {backend.model:<20} {stats['reviews']:>5} reviews "
+                         f"({stats['cached']} cached, {stats['fallbacks']} spilled over, {stats['errors']} errors), "
+                         f"{stats['tokens']} tokens, {per_request:.1f} tokens/s per review, "
+                         f"{stats['tokens'] / wall if wall else 0.0:.1f} tokens/s overall")
+        return lines
+
+def add_router_arguments(parser):
+    """The router's options, shared with pipeline.py"""
+    parser.add_argument('--small-model', default=SMALL_MODEL,
+                        help=f"Ollama model for short reviews (default: {SMALL_MODEL})")
+    parser.add_argument('--large-model', default=LARGE_MODEL,
+                        help=f"Ollama model for long reviews (default: {LARGE_MODEL})")
+    parser.add_argument('--long-tokens', type=int, default=LONG_REVIEW_TOKENS,
+                        help=f"Reviews longer than this many tokens go to the large model (default: {LONG_REVIEW_TOKENS})")
+    parser.add_argument('--ollama-parallel', type=int, default=4,
+                        help="Reviews each Ollama model takes at once; match OLLAMA_NUM_PARALLEL (default: 4)")
+    parser.add_argument('--keep-alive', default=DEFAULT_KEEP_ALIVE,
+                        help=f"How long Ollama keeps the models loaded between requests (default: {DEFAULT_KEEP_ALIVE})")
+    parser.add_argument('--openai', nargs='?', const='', metavar='MODEL',
+                        help="Send reviews to the OpenAI API (config.yaml) when the local models are full or fail; "
+                             "optionally with another model than fix_reviews.py's")
+    parser.add_argument('--openai-parallel', type=int, default=8,
+                        help="Reviews sent to OpenAI at once (default: 8)")
+
+def build_router(args, cache=None, url=OLLAMA_URL, num_ctx=DEFAULT_NUM_CTX, max_chunk_tokens=None, store=None):
+    """A Router from the options of add_router_arguments"""
+    small = OllamaBackend('small', args.small_model, url=url, cache=cache, num_ctx=num_ctx,
+                          keep_alive=args.keep_alive, capacity=args.ollama_parallel, store=store)
+    large = small
+    if args.large_model != args.small_model:
+        large = OllamaBackend('large', args.large_model, url=url, cache=cache, num_ctx=num_ctx,
+                              keep_alive=args.keep_alive, capacity=args.ollama_parallel, store=store)
+    short, long = [small, large], [large]
+    if args.openai is not None:
+        import fix_reviews
+        config = fix_reviews.load_config()
+        if not config:
+            raise SystemExit(1)
+        openai = OpenAIBackend('openai', fix_reviews.create_client(config), args.openai or None, cache,
+                               max_chunk_tokens, args.openai_parallel, store)
+        short.append(openai)
+        long.append(openai)
+    return Router(list(dict.fromkeys(short)), long, args.long_tokens)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reformat album reviews, routing each to a model by its length")
+    add_router_arguments(parser)
+    parser.add_argument('--url', default=OLLAMA_URL, help=f"Ollama server URL (default: {OLLAMA_URL})")
+    parser.add_argument('--num-ctx', type=int, default=DEFAULT_NUM_CTX,
+                        help=f"Ollama context window in tokens (default: {DEFAULT_NUM_CTX})")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE,
+                        help=f"Shared LLM result cache (default: {DEFAULT_CACHE_FILE})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Send every review to a model even if an identical request was cached")
+    parser.add_argument('--store', metavar='FILE',
+                        help="Read reviews from this library store (see store.py) and save the results there "
+                             "instead of in text files")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="Reformat near-identical reviews (other editions of an album) separately "
+                             "instead of copying one result")
+    metrics.add_arguments(parser)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    metrics.enable_from_args(args)
+
+    reviews_folder = "album_reviews"
+    reformatted_folder = "reformatted_reviews"
+    os.makedirs(reformatted_folder, exist_ok=True)
+    store = LibraryStore(args.store) if args.store else None
+    try:
+        albums_data = store.albums_data() if store is not None else load_albums_data()
+    except Exception as e:
+        print(f"Error reading CSV file: {e}")
+        return
+
+    review_files = review_filenames(reviews_folder, store)
+    # Other editions of an album share their review text; reformat it once and copy the result
+    review_files, duplicates = reviews_to_reformat(reviews_folder, review_files, albums_data, store,
+                                                   not args.no_dedup)
+    jobs = [(filename, albums_data[filename.split('.')[0]]['Artist'], albums_data[filename.split('.')[0]]['Album'])
+            for filename in review_files if filename.split('.')[0] in albums_data]
+
+    cache = None if args.no_cache else LLMCache(args.cache)
+    router = build_router(args, cache, args.url, args.num_ctx, store=store)
+    router.warm_up()
+    print(f"Reformatting {len(jobs)} reviews; up to {args.long_tokens} tokens go to "
+          f"{router.routes['short'][0].model}, longer ones to {router.routes['long'][0].model}")
+
+    def process(job):
+        filename, artist, album = job
+        metadata, text = read_saved_review(reviews_folder, filename, store)
+        return router.reformat(metadata, text, artist, album, os.path.join(reformatted_folder, filename))
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=router.capacity) as executor:
+        futures = {executor.submit(process, job): job for job in jobs}
+        for future in as_completed(futures):
+            filename, artist, album = futures[future]
+            done += 1
+            try:
+                backend, tokens = future.result()
+                result = "cached" if tokens is None else f"{tokens} tokens"
+                print(f"[{done}/{len(jobs)}] {artist} - {album}: {backend.model} ({result})")
+            except Exception as e:
+                print(f"[{done}/{len(jobs)}] Failed to reformat review for {artist} - {album}: {e}")
+
+    copied = copy_reformatted(reviews_folder, reformatted_folder, duplicates, store)
+    if copied:
+        print(f"Copied reformatted reviews to {copied} near-identical reviews")
+    print("\nThroughput per backend:")
+    for line in router.report():
+        print(f"  {line}")
+
+if __name__ == "__main__":
+    main()
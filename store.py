@@ -0,0 +1,376 @@
+# store.py
+"""Single-file library store: albums, ratings, review texts and reformatted reviews.
+
+Replaces the two CSV files and the one-file-per-album folders with one SQLite
+database in WAL mode. Albums are indexed by AlbumID and by artist/album,
+texts are stored zlib-compressed, and reviews can be streamed in batches
+without listing a directory. `python store.py import` and `export` convert
+from and to the CSV/txt layout the scripts have used so far.
+"""
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from reviews import (RATINGS_CSV, REVIEWS_FOLDER, album_key, format_metadata, read_review, read_review_file,
+                     save_review)
+
+DEFAULT_STORE_FILE = 'library.sqlite'
+REFORMATTED_FOLDER = 'reformatted_reviews'
+
+# Album columns, in the order of the ratings CSV written by amg.py
+ALBUM_COLUMNS = [
+    ('Album', 'album'),
+    ('Artist', 'artist'),
+    ('Release Date', 'release_date'),
+    ('Year', 'year'),
+    ('Cover URL', 'cover_url'),
+    ('Tidal ID', 'tidal_id'),
+    ('Date Added', 'date_added'),
+    ('AlbumID', 'album_id'),
+    ('AMG_Rating', 'amg_rating'),
+]
+
+REFORMATTED_MARKER = re.compile(r'^--- REFORMATTED BY (.+) ---$', re.M)
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'))
+
+def decompress(data):
+    return zlib.decompress(data).decode('utf-8')
+
+class LibraryStore:
+    """SQLite store shared by the crawler, the reformatters and the indexes"""
+
+    def __init__(self, path=DEFAULT_STORE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS albums (
+                album_id TEXT PRIMARY KEY,
+                artist TEXT NOT NULL,
+                album TEXT NOT NULL,
+                release_date TEXT,
+                year TEXT,
+                cover_url TEXT,
+                tidal_id TEXT,
+                date_added TEXT,
+                amg_rating TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS albums_artist_album
+                ON albums (artist COLLATE NOCASE, album COLLATE NOCASE);
+            CREATE TABLE IF NOT EXISTS reviews (
+                album_id TEXT PRIMARY KEY,
+                review_url TEXT,
+                text BLOB NOT NULL,
+                fetched_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS reformatted (
+                album_id TEXT NOT NULL,
+                model TEXT NOT NULL,
+                text BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (album_id, model)
+            );
+        """)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # Albums
+
+    def upsert_albums(self, rows):
+        """Insert or update albums given as CSV rows (the keys of ALBUM_COLUMNS)"""
+        now = time.time()
+        values = [tuple(row.get(key) or '' for key, _ in ALBUM_COLUMNS) + (now,) for row in rows]
+        columns = ', '.join(column for _, column in ALBUM_COLUMNS)
+        updates = ', '.join(f"{column} = excluded.{column}" for _, column in ALBUM_COLUMNS if column != 'album_id')
+        with self.lock:
+            self.conn.executemany(
+                f"INSERT INTO albums ({columns}, updated_at) VALUES ({', '.join('?' * (len(ALBUM_COLUMNS) + 1))}) "
+                f"ON CONFLICT (album_id) DO UPDATE SET {updates}, updated_at = excluded.updated_at",
+                values)
+            self.conn.commit()
+        return len(values)
+
+    def _album_rows(self, where='', params=()):
+        columns = ', '.join(column for _, column in ALBUM_COLUMNS)
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {columns} FROM albums {where}", params).fetchall()
+        return [{key: value for (key, _), value in zip(ALBUM_COLUMNS, row)} for row in rows]
+
+    def get_album(self, album_id):
+        """An album as a CSV row, or None"""
+        rows = self._album_rows("WHERE album_id = ?", (album_id,))
+        return rows[0] if rows else None
+
+    def find_albums(self, artist, album=None):
+        """Albums by artist (and album) name, case-insensitively"""
+        if album is None:
+            return self._album_rows("WHERE artist = ? COLLATE NOCASE ORDER BY album", (artist,))
+        return self._album_rows("WHERE artist = ? COLLATE NOCASE AND album = ? COLLATE NOCASE", (artist, album))
+
+    def albums(self):
+        """Every album, in the order they were first added"""
+        return self._album_rows("ORDER BY rowid")
+
+    def albums_data(self):
+        """{AlbumID: row}, the same shape as reviews.load_albums_data()"""
+        return {row['AlbumID']: row for row in self.albums()}
+
+    # Reviews
+
+    def put_review(self, album_id, review_url, text):
+        self.put_reviews([(album_id, review_url, text)])
+
+    def put_reviews(self, reviews):
+        """Store (AlbumID, review URL, text) tuples in one transaction"""
+        now = time.time()
+        values = [(album_id, review_url, compress(text), now) for album_id, review_url, text in reviews]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO reviews VALUES (?, ?, ?, ?)", values)
+            self.conn.commit()
+        return len(values)
+
+    def has_review(self, album_id):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM reviews WHERE album_id = ?", (album_id,)).fetchone() is not None
+
+    def get_review(self, album_id):
+        """A review in the shape of reviews.read_review(), or None"""
+        with self.lock:
+            row = self.conn.execute("""
+                SELECT r.album_id, a.artist, a.album, r.review_url, r.text
+                FROM reviews r LEFT JOIN albums a USING (album_id) WHERE r.album_id = ?
+            """, (album_id,)).fetchone()
+        return self._review(row) if row else None
+
+    @staticmethod
+    def _review(row):
+        album_id, artist, album, review_url, text = row
+        return {'AlbumID': album_id, 'Artist': artist or '', 'Album': album or '',
+                'Review URL': review_url or '', 'text': decompress(text)}
+
+    def iter_reviews(self, batch_size=500):
+        """Stream every review in AlbumID order, `batch_size` rows per read"""
+        last_id = ''
+        while True:
+            # Keyset pagination, so the lock is only held for one batch at a time
+            with self.lock:
+                rows = self.conn.execute("""
+                    SELECT r.album_id, a.artist, a.album, r.review_url, r.text
+                    FROM reviews r LEFT JOIN albums a USING (album_id)
+                    WHERE r.album_id > ? ORDER BY r.album_id LIMIT ?
+                """, (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._review(row)
+            last_id = rows[-1][0]
+
+    def review_ids(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT album_id FROM reviews ORDER BY album_id")]
+
+    def delete_review(self, album_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM reviews WHERE album_id = ?", (album_id,))
+            self.conn.commit()
+
+    # Reformatted reviews
+
+    def put_reformatted(self, album_id, model, text):
+        self.put_reformatted_reviews([(album_id, model, text)])
+
+    def put_reformatted_reviews(self, reviews):
+        """Store (AlbumID, model, text) tuples in one transaction"""
+        now = time.time()
+        values = [(album_id, model, compress(text), now) for album_id, model, text in reviews]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO reformatted VALUES (?, ?, ?, ?)", values)
+            self.conn.commit()
+        return len(values)
+
+    def get_reformatted(self, album_id, model=None):
+        """(model, text) of an album's reformatted review, the newest one unless `model` is given"""
+        with self.lock:
+            if model is None:
+                row = self.conn.execute("""
+                    SELECT model, text FROM reformatted WHERE album_id = ? ORDER BY created_at DESC LIMIT 1
+                """, (album_id,)).fetchone()
+            else:
+                row = self.conn.execute("SELECT model, text FROM reformatted WHERE album_id = ? AND model = ?",
+                                        (album_id, model)).fetchone()
+        return (row[0], decompress(row[1])) if row else None
+
+    def has_reformatted(self, album_id):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM reformatted WHERE album_id = ?",
+                                     (album_id,)).fetchone() is not None
+
+    def iter_reformatted(self):
+        """(AlbumID, model, text) of every reformatted review"""
+        with self.lock:
+            rows = self.conn.execute("SELECT album_id, model, text FROM reformatted ORDER BY album_id, model").fetchall()
+        for album_id, model, text in rows:
+            yield album_id, model, decompress(text)
+
+    def stats(self):
+        with self.lock:
+            counts = {table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ('albums', 'reviews', 'reformatted')}
+        counts['bytes'] = os.path.getsize(self.path)
+        return counts
+
+# The reformatters name reviews by file, <AlbumID>.txt; these read and check them
+# in the review folder, or in the store when one is given
+
+def review_filenames(reviews_folder=REVIEWS_FOLDER, store=None):
+    """<AlbumID>.txt of every saved review"""
+    if store is not None:
+        return [f"{album_id}.txt" for album_id in store.review_ids()]
+    return [f for f in os.listdir(reviews_folder) if f.endswith('.txt')]
+
+def read_saved_review(reviews_folder, filename, store=None):
+    """(metadata header, text) of a saved review, like reviews.read_review_file"""
+    if store is None:
+        return read_review_file(os.path.join(reviews_folder, filename))
+    album_id = filename.split('.')[0]
+    review = store.get_review(album_id)
+    if review is None:
+        # What a missing review file raises, so callers handle both the same way
+        raise FileNotFoundError(f"No review for {album_id} in {store.path}")
+    return format_metadata(review['Artist'], review['Album'], review['AlbumID'], review['Review URL']), review['text']
+
+def has_reformatted(reformatted_path, store=None):
+    if store is not None:
+        return store.has_reformatted(os.path.basename(reformatted_path).split('.')[0])
+    return os.path.exists(reformatted_path)
+
+def batched(iterable, size):
+    """Lists of up to `size` items from an iterable"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def import_library(store, csv_file=RATINGS_CSV, reviews_folder=REVIEWS_FOLDER,
+                   reformatted_folder=REFORMATTED_FOLDER):
+    """Load the CSV/txt layout into the store; returns the number of albums, reviews and reformatted reviews"""
+    albums = 0
+    if csv_file and os.path.exists(csv_file):
+        with open(csv_file, 'r', encoding='utf-8') as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        for row in rows:
+            if not row.get('AlbumID'):  # Favorites CSV from tidal.py, before amg.py added IDs
+                row['AlbumID'] = album_key(row['Artist'], row['Album'])
+        albums = store.upsert_albums(rows)
+
+    def read_reviews(folder):
+        for entry in os.scandir(folder):
+            if entry.name.endswith('.txt'):
+                review = read_review(entry.path)
+                if review['text']:
+                    yield review['AlbumID'], review['Review URL'], review['text']
+
+    def read_reformatted(folder):
+        for entry in os.scandir(folder):
+            if not entry.name.endswith('.txt'):
+                continue
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            match = REFORMATTED_MARKER.search(content)
+            if match:
+                yield os.path.splitext(entry.name)[0], match.group(1).lower(), content[match.end():].strip()
+
+    # Written in batches so neither memory nor a single transaction grows with the library
+    reviews = 0
+    if reviews_folder and os.path.isdir(reviews_folder):
+        for batch in batched(read_reviews(reviews_folder), 1000):
+            reviews += store.put_reviews(batch)
+
+    reformatted = 0
+    if reformatted_folder and os.path.isdir(reformatted_folder):
+        for batch in batched(read_reformatted(reformatted_folder), 1000):
+            reformatted += store.put_reformatted_reviews(batch)
+    return albums, reviews, reformatted
+
+def export_library(store, csv_file=RATINGS_CSV, reviews_folder=REVIEWS_FOLDER,
+                   reformatted_folder=REFORMATTED_FOLDER):
+    """Write the store back out as the ratings CSV and review text files"""
+    albums = store.albums()
+    if csv_file:
+        with open(csv_file, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=[key for key, _ in ALBUM_COLUMNS])
+            writer.writeheader()
+            writer.writerows(albums)
+
+    reviews = 0
+    if reviews_folder:
+        os.makedirs(reviews_folder, exist_ok=True)
+        for review in store.iter_reviews():
+            save_review(reviews_folder, review, review['Review URL'], review['text'])
+            reviews += 1
+
+    reformatted = 0
+    if reformatted_folder:
+        os.makedirs(reformatted_folder, exist_ok=True)
+        for album_id, model, text in store.iter_reformatted():
+            album = store.get_album(album_id) or {'Artist': '', 'Album': ''}
+            review = store.get_review(album_id)
+            metadata = format_metadata(album['Artist'], album['Album'], album_id,
+                                       review['Review URL'] if review else '')
+            with open(os.path.join(reformatted_folder, f"{album_id}.txt"), 'w', encoding='utf-8') as f:
+                f.write(metadata + "\n\n")
+                f.write(f"--- REFORMATTED BY {model.upper()} ---\n\n")
+                f.write(text)
+            reformatted += 1
+    return len(albums), reviews, reformatted
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import, export or inspect the library store")
+    parser.add_argument('--store', default=DEFAULT_STORE_FILE, help=f"Store file (default: {DEFAULT_STORE_FILE})")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in (('import', "Load the CSV and review folders into the store"),
+                               ('export', "Write the store out as the CSV and review folders")):
+        command_parser = subparsers.add_parser(command, help=help_text)
+        command_parser.add_argument('--csv', default=RATINGS_CSV, help=f"Albums CSV (default: {RATINGS_CSV})")
+        command_parser.add_argument('--reviews', default=REVIEWS_FOLDER,
+                                    help=f"Review text folder (default: {REVIEWS_FOLDER})")
+        command_parser.add_argument('--reformatted', default=REFORMATTED_FOLDER,
+                                    help=f"Reformatted review folder (default: {REFORMATTED_FOLDER})")
+    subparsers.add_parser('stats', help="Show what the store holds")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    store = LibraryStore(args.store)
+    start = time.perf_counter()
+    if args.command == 'import':
+        albums, reviews, reformatted = import_library(store, args.csv, args.reviews, args.reformatted)
+        print(f"Imported {albums} albums, {reviews} reviews and {reformatted} reformatted reviews "
+              f"({time.perf_counter() - start:.1f}s)")
+    elif args.command == 'export':
+        albums, reviews, reformatted = export_library(store, args.csv, args.reviews, args.reformatted)
+        print(f"Exported {albums} albums, {reviews} reviews and {reformatted} reformatted reviews "
+              f"({time.perf_counter() - start:.1f}s)")
+    stats = store.stats()
+    print(f"{args.store}: {stats['albums']} albums, {stats['reviews']} reviews, "
+          f"{stats['reformatted']} reformatted reviews, {stats['bytes'] / 1024 / 1024:.1f} MB")
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,159 @@
-import tidalapi
-import time
+# tidal.py
+import argparse
 import csv
 import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-# Create a session
-session = tidalapi.Session()
+from ratelimit import TokenBucket
 
-# Login using OAuth (this will display a URL to visit and link your account)
-session.login_oauth_simple()
+CSV_FIELDNAMES = ['Album', 'Artist', 'Release Date', 'Year', 'Cover URL', 'Tidal ID', 'Date Added']
+
+def get_session(session_file='tidal_session.json'):
+    """Log in to Tidal, reusing the OAuth tokens saved by a previous run"""
+    import tidalapi
+
+    # Create a session
+    session = tidalapi.Session()
+
+    # Loads the saved tokens (refreshing them if needed); only when there are none
+    # does this display a URL to visit and link your account, then save the new tokens
+    session.login_session_file(Path(session_file))
+    return session
+
+def fetch_favorite_pages(session, page_size=100, known_ids=None):
+    """Page through favorite albums, newest first.
+
+    With `known_ids`, stops at the first album that was already exported, so a
+    delta sync only downloads the favorites added since then.
+    """
+    from tidalapi.types import AlbumOrder, OrderDirection
 
-# Check if login was successful
-if session.check_login():
-    # Get your favorites
     favorites = session.user.favorites
-    
-    # Get your favorite albums
-    favorite_albums = favorites.albums()
-    
-    # Prepare CSV file
-    csv_filename = "tidal_favorite_albums.csv"
-    
-    # Write to CSV file
-    with open(csv_filename, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['Album', 'Artist', 'Release Date', 'Year', 'Cover URL']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
+    offset = 0
+    while True:
+        page = favorites.albums(limit=page_size, offset=offset,
+                                order=AlbumOrder.DateAdded,
+                                order_direction=OrderDirection.Descending)
+        for album in page:
+            if known_ids is not None and str(album.id) in known_ids:
+                return
+            yield album
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+def album_row(album):
+    """CSV row for an album; the cover URL is computed once"""
+    try:
+        cover_url = album.image()
+    except ValueError:
+        cover_url = ''  # Album without cover art
+    date_added = getattr(album, 'user_date_added', None)
+    return {
+        'Album': album.name,
+        'Artist': album.artist.name,
+        'Release Date': album.release_date,
+        'Year': album.year,
+        'Cover URL': cover_url,
+        'Tidal ID': album.id,
+        'Date Added': date_added.isoformat() if date_added else '',
+    }
+
+def complete_metadata(session, albums, workers=8, rate=10.0):
+    """Fetch full album details for favorites that came back without a release date.
+
+    Requests run on `workers` threads but never faster than `rate` per second.
+    """
+    bucket = TokenBucket(rate, capacity=workers)
+
+    def fetch(album):
+        if album.release_date is not None:
+            return album
+        bucket.acquire()
+        try:
+            return session.album(album.id)
+        except Exception as e:
+            print(f"Error fetching details for {album.artist.name} - {album.name}: {e}")
+            return album
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fetch, albums))
+
+def read_existing_rows(csv_filename):
+    """Rows of a previous export, or None if there is nothing to sync against"""
+    if not os.path.exists(csv_filename):
+        return None
+    with open(csv_filename, 'r', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        if 'Tidal ID' not in (reader.fieldnames or []):
+            print(f"'{csv_filename}' has no Tidal ID column, doing a full export")
+            return None
+        return list(reader)
+
+def write_favorites(csv_filename, rows):
+    """Write the favorites CSV atomically, so an interrupted run never leaves half a file"""
+    tmp_filename = csv_filename + '.tmp'
+    with open(tmp_filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDNAMES, extrasaction='ignore')
         writer.writeheader()
-        
-        # Display albums with the specified metadata
-        print("Your favorite albums:")
-        for album in favorite_albums:
-            album_data = {
-                'Album': album.name,
-                'Artist': album.artist.name,
-                'Release Date': album.release_date,
-                'Year': album.year,
-                'Cover URL': album.image()
-            }
-            
-            # Write to CSV
-            writer.writerow(album_data)
-            
-            # Print to console
-            print(f"- Album: {album.name}")
-            print(f"  Artist: {album.artist.name}")
-            print(f"  Release date: {album.release_date}")
-            print(f"  Year: {album.year}")
-            print(f"  Cover URL: {album.image()}")
-            print("  ---")
-            
-            # Add a sleep to avoid hitting rate limits
-            time.sleep(0.5)  # Wait 0.5 seconds between albums
-    
+        writer.writerows(rows)
+    os.replace(tmp_filename, csv_filename)
+
+def export_favorites(session, csv_filename="tidal_favorite_albums.csv", full=False,
+                     page_size=100, workers=8, rate=10.0):
+    """Export favorite albums to CSV, only pulling new favorites unless `full` is set"""
+    existing_rows = None if full else read_existing_rows(csv_filename)
+    known_ids = {row['Tidal ID'] for row in existing_rows} if existing_rows is not None else None
+
+    new_albums = list(fetch_favorite_pages(session, page_size, known_ids))
+    new_albums = complete_metadata(session, new_albums, workers, rate)
+    new_rows = [album_row(album) for album in new_albums]
+
+    # Display albums with the specified metadata
+    print("New favorite albums:" if known_ids is not None else "Your favorite albums:")
+    for row in new_rows:
+        print(f"- Album: {row['Album']}")
+        print(f"  Artist: {row['Artist']}")
+        print(f"  Release date: {row['Release Date']}")
+        print(f"  Year: {row['Year']}")
+        print(f"  Cover URL: {row['Cover URL']}")
+        print("  ---")
+
+    # Newest favorites first, followed by everything exported before
+    rows = new_rows + (existing_rows or [])
+    write_favorites(csv_filename, rows)
+
+    print(f"{len(new_rows)} new albums, {len(rows)} in total")
     print(f"Data saved to {os.path.abspath(csv_filename)}")
-else:
-    print("Login failed!")
+    return new_rows
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export your favorite Tidal albums to CSV")
+    parser.add_argument('--output', default="tidal_favorite_albums.csv",
+                        help="CSV file to write (default: tidal_favorite_albums.csv)")
+    parser.add_argument('--full', action='store_true',
+                        help="Re-export every favorite instead of only the ones added since the last export")
+    parser.add_argument('--session-file', default='tidal_session.json',
+                        help="Where the OAuth session is saved between runs (default: tidal_session.json)")
+    parser.add_argument('--page-size', type=int, default=100,
+                        help="Favorites fetched per request (default: 100)")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="Concurrent album detail requests (default: 8)")
+    parser.add_argument('--rate', type=float, default=10.0,
+                        help="Maximum album detail requests per second (default: 10)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    session = get_session(args.session_file)
 
+    # Check if login was successful
+    if not session.check_login():
+        print("Login failed!")
+        return
 
+    export_favorites(session, args.output, args.full, args.page_size, args.workers, args.rate)
 
+if __name__ == "__main__":
+    main()